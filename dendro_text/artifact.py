@@ -0,0 +1,268 @@
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+import os
+import zipfile
+
+import numpy as np
+
+# A dendrogram artifact keeps the expensive output of a run (the condensed distance vector and the linkage),
+# so that the same corpus can be rendered again without reading, tokenizing, and the distance calculation.
+
+ARTIFACT_FORMAT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class DendrogramArtifact:
+    labels: List[Tuple[str, ...]]  # file names of each document (identical files are merged into one)
+    distances: np.ndarray  # condensed distance vector
+    linkage: np.ndarray  # linkage matrix of scipy.cluster.hierarchy
+    digests: List[str]  # content hashes of the documents
+    mode: str  # tokenization mode
+
+    def label_strs(self, label_separator: str = ",") -> List[str]:
+        return [label_separator.join(items) for items in self.labels]
+
+
+def _compact_distances(distances: np.ndarray) -> np.ndarray:
+    if len(distances) == 0 or np.isnan(distances).any():
+        return distances.astype(np.float64)
+    max_value = distances.max()
+    for dtype in [np.uint16, np.uint32]:
+        if max_value <= np.iinfo(dtype).max:
+            return distances.astype(dtype)
+    return distances.astype(np.float64)
+
+
+def save_artifact(path: str, artifact: DendrogramArtifact) -> None:
+    label_items = [item for items in artifact.labels for item in items]
+    with open(path, "wb") as outp:
+        np.savez_compressed(
+            outp,
+            format_version=np.array(ARTIFACT_FORMAT_VERSION),
+            label_items=np.array(label_items, dtype=np.str_),
+            label_counts=np.array([len(items) for items in artifact.labels], dtype=np.int32),
+            distances=_compact_distances(artifact.distances),
+            linkage=np.asarray(artifact.linkage, dtype=np.float64),
+            digests=np.array(artifact.digests, dtype=np.str_),
+            mode=np.array(artifact.mode),
+        )
+
+
+def _split_labels(label_items: Sequence[str], label_counts: Sequence[int]) -> List[Tuple[str, ...]]:
+    labels = []
+    p = 0
+    for c in label_counts:
+        labels.append(tuple(label_items[p : p + c]))
+        p += c
+    return labels
+
+
+def load_artifact(path: str) -> DendrogramArtifact:
+    """Load an artifact written by `save_artifact`. Raises ValueError for a file of another format."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["format_version"]) != ARTIFACT_FORMAT_VERSION:
+                raise ValueError("unsupported format version: %d" % int(data["format_version"]))
+            labels = _split_labels(data["label_items"].tolist(), data["label_counts"].tolist())
+            return DendrogramArtifact(
+                labels=labels,
+                distances=data["distances"].astype(np.float64),
+                linkage=data["linkage"],
+                digests=data["digests"].tolist(),
+                mode=str(data["mode"]),
+            )
+    except KeyError as e:
+        raise ValueError("not a dendrogram artifact: missing %s" % e) from e
+    except zipfile.BadZipFile as e:
+        raise ValueError("not a dendrogram artifact: %s" % e) from e
+
+
+def fill_from_artifact(
+    darr: np.ndarray, digests: Sequence[str], previous: DendrogramArtifact, pairs: slice = slice(None)
+) -> int:
+    """Copy the distances of the pairs of documents also found in `previous` (by content hash) into the
+    condensed vector `darr` of the documents `digests`, or into the vector of the pairs of the slice `pairs` of
+    the condensed indices. Returns the number of copied pairs.
+    """
+    n = len(digests)
+    n_old = len(previous.digests)
+    start, stop, step = pairs.indices(n * (n - 1) // 2)
+    assert darr.shape == (len(range(start, stop, step)),)
+    old_index_of = dict((d, i) for i, d in enumerate(previous.digests))
+    old_indices = np.array([old_index_of.get(d, -1) for d in digests], dtype=np.int64)
+
+    copied = 0
+    for i in range(n - 1):
+        oi = old_indices[i]
+        if oi < 0:
+            continue  # for i
+        js = np.arange(i + 1, n)
+        ojs = old_indices[i + 1 :]
+        found = ojs >= 0
+        if not found.any():
+            continue  # for i
+        js = js[found]
+        ojs = ojs[found]
+        a = np.minimum(oi, ojs)
+        b = np.maximum(oi, ojs)
+        old_ks = n_old * a - a * (a + 1) // 2 + (b - a - 1)
+        ks = n * i - i * (i + 1) // 2 + (js - i - 1)
+        ts, rs = np.divmod(ks - start, step)
+        selected = (ts >= 0) & (rs == 0)
+        darr[ts[selected]] = previous.distances[old_ks[selected]]
+        copied += int(np.count_nonzero(selected))
+    return copied
+
+
+# A shard is a deterministic slice of the pairs of documents for multi-machine runs. The documents are ordered
+# by their content hashes, so that machines with different paths of the same files agree on the pairs; the
+# shard k (1 <= k <= n) of n shards has the pairs whose condensed index in that order is k - 1 modulo n.
+
+SHARD_FORMAT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class ShardArtifact:
+    labels: List[Tuple[str, ...]]  # in the order of digests
+    digests: List[str]  # sorted
+    mode: str
+    shard: int
+    shard_count: int
+    distances: np.ndarray  # distances of the pairs of the shard, in the order of condensed index
+    positions: np.ndarray  # position of each document in the input files, to restore the order in merging
+
+    def pair_indices(self) -> slice:
+        return slice(self.shard - 1, None, self.shard_count)
+
+
+def shard_order(digests: Sequence[str]) -> List[int]:
+    """Order of documents in shards, i.e. the indices of `digests` sorted by the digests."""
+    return sorted(range(len(digests)), key=lambda i: digests[i])
+
+
+def save_shard(path: str, shard: ShardArtifact) -> None:
+    label_items = [item for items in shard.labels for item in items]
+    with open(path, "wb") as outp:
+        np.savez_compressed(
+            outp,
+            shard_format_version=np.array(SHARD_FORMAT_VERSION),
+            label_items=np.array(label_items, dtype=np.str_),
+            label_counts=np.array([len(items) for items in shard.labels], dtype=np.int32),
+            digests=np.array(shard.digests, dtype=np.str_),
+            mode=np.array(shard.mode),
+            shard=np.array(shard.shard),
+            shard_count=np.array(shard.shard_count),
+            distances=_compact_distances(shard.distances),
+            positions=np.asarray(shard.positions, dtype=np.int64),
+        )
+
+
+def load_shard(path: str) -> ShardArtifact:
+    """Load a shard written by `save_shard`. Raises ValueError for a file of another format."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["shard_format_version"]) != SHARD_FORMAT_VERSION:
+                raise ValueError("unsupported format version: %d" % int(data["shard_format_version"]))
+            return ShardArtifact(
+                labels=_split_labels(data["label_items"].tolist(), data["label_counts"].tolist()),
+                digests=data["digests"].tolist(),
+                mode=str(data["mode"]),
+                shard=int(data["shard"]),
+                shard_count=int(data["shard_count"]),
+                distances=data["distances"].astype(np.float64),
+                positions=data["positions"],
+            )
+    except KeyError as e:
+        raise ValueError("not a shard file: missing %s" % e) from e
+    except zipfile.BadZipFile as e:
+        raise ValueError("not a shard file: %s" % e) from e
+
+
+def merge_shards(shards: Sequence[ShardArtifact]) -> Tuple[List[Tuple[str, ...]], List[str], str, np.ndarray]:
+    """Combine shards into the labels, digests, tokenization mode, and condensed distance vector of all pairs,
+    with the documents in the order of the input files of the first shard.
+
+    Raises ValueError when the shards are of different documents or modes, or do not cover all pairs.
+    """
+    if not shards:
+        raise ValueError("no shards")
+    first = shards[0]
+    n = len(first.digests)
+    darr = np.full(n * (n - 1) // 2, np.nan, dtype=np.float64)
+    seen = set()
+    for shard in shards:
+        if shard.digests != first.digests or shard.mode != first.mode:
+            raise ValueError("shard %d/%d is made from other documents or mode" % (shard.shard, shard.shard_count))
+        if shard.shard_count != first.shard_count:
+            raise ValueError("shards are of different counts: %d, %d" % (first.shard_count, shard.shard_count))
+        if shard.shard in seen:
+            raise ValueError("duplicated shard: %d/%d" % (shard.shard, shard.shard_count))
+        seen.add(shard.shard)
+        darr[shard.pair_indices()] = shard.distances
+    missing = sorted(set(range(1, first.shard_count + 1)) - seen)
+    if missing:
+        raise ValueError("missing shards: %s" % ", ".join("%d/%d" % (k, first.shard_count) for k in missing))
+    if np.isnan(darr).any():
+        raise ValueError("incomplete pairs: %d" % int(np.count_nonzero(np.isnan(darr))))
+
+    order = np.argsort(first.positions, kind="stable").tolist()
+    labels = [first.labels[p] for p in order]
+    digests = [first.digests[p] for p in order]
+    sorted_artifact = DendrogramArtifact(
+        labels=first.labels, distances=darr, linkage=np.zeros((0, 4)), digests=first.digests, mode=first.mode
+    )
+    ordered = np.empty_like(darr)
+    fill_from_artifact(ordered, digests, sorted_artifact)
+    return labels, digests, first.mode, ordered
+
+
+# A checkpoint keeps the distances calculated so far (NaN for the pairs to be calculated) of an interrupted run.
+# It is tied to the content hashes of the documents in the order of the run, the tokenization mode, and the
+# pairs of the run (e.g. a shard), so that it is never resumed against other inputs.
+
+CHECKPOINT_FORMAT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    digests: List[str]
+    mode: str
+    scope: str  # pairs of the run, "all" or "K/N" of a shard
+    distances: np.ndarray  # condensed distance vector, NaN for the pairs not calculated yet
+
+    def matches(self, digests: Sequence[str], mode: str, scope: str) -> bool:
+        return list(digests) == self.digests and mode == self.mode and scope == self.scope
+
+
+def save_checkpoint(path: str, checkpoint: Checkpoint) -> None:
+    """Write a checkpoint atomically, so that an interruption while writing keeps the previous one."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as outp:
+        np.savez(
+            outp,
+            checkpoint_format_version=np.array(CHECKPOINT_FORMAT_VERSION),
+            digests=np.array(checkpoint.digests, dtype=np.str_),
+            mode=np.array(checkpoint.mode),
+            scope=np.array(checkpoint.scope),
+            distances=np.asarray(checkpoint.distances, dtype=np.float64),
+        )
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+    """Load a checkpoint written by `save_checkpoint`. Raises ValueError for a file of another format."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["checkpoint_format_version"]) != CHECKPOINT_FORMAT_VERSION:
+                raise ValueError("unsupported format version: %d" % int(data["checkpoint_format_version"]))
+            return Checkpoint(
+                digests=data["digests"].tolist(),
+                mode=str(data["mode"]),
+                scope=str(data["scope"]),
+                distances=data["distances"],
+            )
+    except KeyError as e:
+        raise ValueError("not a checkpoint file: missing %s" % e) from e
+    except zipfile.BadZipFile as e:
+        raise ValueError("not a checkpoint file: %s" % e) from e
@@ -0,0 +1,308 @@
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import hashlib
+import sqlite3
+import time
+import zlib
+
+import numpy as np
+
+DEFAULT_DISTANCE_CACHE_SIZE = 1000000  # entries
+DEFAULT_TOKEN_CACHE_SIZE = 100000  # documents
+DISTANCE_CACHE_FORMAT = 2
+TOKEN_CACHE_FORMAT = 1
+
+
+def token_digest(doc: Sequence[str]) -> str:
+    """Content hash of a token sequence. Tokens are length-prefixed, so that a different split gives a different hash."""
+    h = hashlib.sha1()
+    for token in doc:
+        b = token.encode("utf-8", "surrogatepass")
+        h.update(b"%d:" % len(b))
+        h.update(b)
+    return h.hexdigest()
+
+
+def int_doc_digests(idocs: Sequence[Sequence[int]], word_to_index: Dict[str, int]) -> List[str]:
+    """Content hashes of interned documents, which do not depend on the vocabulary of the run."""
+    index_to_word = [""] * (len(word_to_index) + 1)
+    for w, i in word_to_index.items():
+        index_to_word[i] = w
+    return [token_digest([index_to_word[i] for i in idoc]) for idoc in idocs]
+
+
+def _distinct_pair_count(digests: Sequence[str]) -> int:
+    """Number of the pairs of documents with different content hashes (the others are trivially zero)."""
+    n = len(digests)
+    return n * (n - 1) // 2 - sum(c * (c - 1) // 2 for c in Counter(digests).values())
+
+
+class DistanceCache:
+    """On-disk cache of distances between documents, keyed by the content hashes of the two documents and the
+    tokenization mode. The hashes and the modes are interned to integer ids, and `last_used` is the number of the
+    run. When the cache has more than `max_entries`, the least recently used entries of the earlier runs are
+    evicted; the entries looked up or stored in this run are kept. `hits` and `misses` count the pairs found and
+    not found by the lookups, and `evicted` the entries removed.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_DISTANCE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.conn = sqlite3.connect(path)
+        (version,) = self.conn.execute("PRAGMA user_version").fetchone()
+        if version != DISTANCE_CACHE_FORMAT:
+            # the entries of another format are dropped, as they can be calculated again
+            self.conn.executescript(
+                """
+                DROP TABLE IF EXISTS distances;
+                DROP TABLE IF EXISTS distance_keys;
+                DROP TABLE IF EXISTS distance_modes;
+                PRAGMA user_version = %d;
+                """
+                % DISTANCE_CACHE_FORMAT
+            )
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS distance_keys (id INTEGER PRIMARY KEY, digest TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS distance_modes (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS distances (
+                mode INTEGER NOT NULL,
+                a INTEGER NOT NULL,
+                b INTEGER NOT NULL,
+                distance INTEGER NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (mode, a, b)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS distances_last_used ON distances (last_used);
+            """
+        )
+        (self.run,) = self.conn.execute("SELECT COALESCE(MAX(last_used), 0) + 1 FROM distances").fetchone()
+        self.key_ids: Dict[str, int] = dict()
+        self.mode_ids: Dict[str, int] = dict()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self) -> "DistanceCache":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _intern(self, table: str, column: str, ids: Dict[str, int], value: str, create: bool) -> int:
+        """Id of `value` in `table`, a new one if `create`, or -1."""
+        i = ids.get(value)
+        if i is None:
+            row = self.conn.execute("SELECT id FROM %s WHERE %s = ?" % (table, column), (value,)).fetchone()
+            if row is not None:
+                i = ids[value] = row[0]
+            elif create:
+                i = ids[value] = self.conn.execute(
+                    "INSERT INTO %s (%s) VALUES (?)" % (table, column), (value,)
+                ).lastrowid
+            else:
+                return -1
+        return i
+
+    def _key_id(self, digest: str, create: bool = False) -> int:
+        return self._intern("distance_keys", "digest", self.key_ids, digest, create)
+
+    def _mode_id(self, mode: str, create: bool = False) -> int:
+        return self._intern("distance_modes", "name", self.mode_ids, mode, create)
+
+    def _load_docs(self, digests: Sequence[str]) -> None:
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS docs (idx INTEGER NOT NULL, id INTEGER NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS temp.docs_id ON docs (id)")
+        self.conn.execute("DELETE FROM docs")
+        self.conn.executemany("INSERT INTO docs VALUES (?, ?)", enumerate(self._key_id(d) for d in digests))
+
+    def lookup_pairs(self, digests: Sequence[str], mode: str) -> Iterator[Tuple[int, int, int]]:
+        """Yield (i, j, distance), i < j, of the cached pairs among the documents of `digests`."""
+        self._load_docs(digests)
+        m = self._mode_id(mode)
+        self.conn.execute(
+            """
+            UPDATE distances SET last_used = ?
+            WHERE mode = ? AND a IN (SELECT id FROM docs) AND b IN (SELECT id FROM docs) AND last_used != ?
+            """,
+            (self.run, m, self.run),
+        )
+        cur = self.conn.execute(
+            """
+            SELECT x.idx, y.idx, d.distance FROM docs AS x
+            JOIN distances AS d ON d.mode = ? AND d.a = x.id JOIN docs AS y ON y.id = d.b
+            """,
+            (m,),
+        )
+        found = 0
+        for ia, ib, distance in cur:
+            found += 1
+            yield (ia, ib, distance) if ia < ib else (ib, ia, distance)
+        self.hits += found
+        self.misses += _distinct_pair_count(digests) - found
+
+    def lookup_query(self, digests: Sequence[str], query: int, mode: str) -> Dict[int, int]:
+        """Return {i: distance} of the cached pairs of the document `query` and the other documents."""
+        q = digests[query]
+        self._load_docs(digests)
+        m = self._mode_id(mode)
+        qi = self._key_id(q)
+        # the pairs are found by the primary key, as (min, max) of the two ids
+        self.conn.execute(
+            """
+            UPDATE distances SET last_used = ?
+            WHERE mode = ? AND (a, b) IN (SELECT MIN(id, ?), MAX(id, ?) FROM docs WHERE id != ?) AND last_used != ?
+            """,
+            (self.run, m, qi, qi, qi, self.run),
+        )
+        cur = self.conn.execute(
+            """
+            SELECT docs.idx, d.distance FROM docs
+            JOIN distances AS d ON d.mode = ? AND d.a = MIN(docs.id, ?) AND d.b = MAX(docs.id, ?)
+            WHERE docs.id != ?
+            """,
+            (m, qi, qi, qi),
+        )
+        r = dict(cur.fetchall()) if qi >= 0 else dict()
+        self.hits += len(r)
+        self.misses += sum(1 for d in digests if d != q) - len(r)
+        return r
+
+    def store(self, items: Iterable[Tuple[str, str, int]], mode: str) -> None:
+        """Store (digest, digest, distance) items and evict the least recently used entries of the earlier runs
+        over the size cap.
+        """
+        m = self._mode_id(mode, create=True)
+
+        def rows():
+            for da, db, distance in items:
+                if da == db:
+                    continue  # trivially zero
+                a = self._key_id(da, create=True)
+                b = self._key_id(db, create=True)
+                if a > b:
+                    a, b = b, a
+                yield (m, a, b, int(distance), self.run)
+
+        self.conn.executemany("INSERT OR REPLACE INTO distances VALUES (?, ?, ?, ?, ?)", rows())
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM distances").fetchone()
+        if count > self.max_entries:
+            cur = self.conn.execute(
+                """
+                DELETE FROM distances WHERE (mode, a, b) IN (
+                    SELECT mode, a, b FROM distances WHERE last_used < ? ORDER BY last_used LIMIT ?
+                )
+                """,
+                (self.run, count - self.max_entries),
+            )
+            self.evicted += cur.rowcount
+        self.conn.commit()
+
+    def format_stats(self) -> str:
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM distances").fetchone()
+        return "%d hits, %d misses, %d evicted, %d entries" % (self.hits, self.misses, self.evicted, count)
+
+
+def token_cache_key(content_digest: str, mode: str, lexer: str, prep: Sequence[str]) -> str:
+    """Key of a tokenized document: the hash of the file content, the tokenization mode, the lexer (name and
+    version, for -t), and the preprocessor commands.
+    """
+    return token_digest(["v%d" % TOKEN_CACHE_FORMAT, content_digest, mode, lexer] + list(prep))
+
+
+def encode_token_doc(words: Sequence[str], ids: np.ndarray) -> bytes:
+    """Compress a document given as its distinct words and the word ids of its tokens."""
+    lengths = np.array([len(w) for w in words], dtype=np.uint32)
+    header = np.array([len(words), len(ids)], dtype=np.uint32)
+    text = "".join(words).encode("utf-8", "surrogatepass")
+    return zlib.compress(header.tobytes() + lengths.tobytes() + np.asarray(ids, dtype=np.uint32).tobytes() + text)
+
+
+def decode_token_doc(blob: bytes) -> Tuple[List[str], np.ndarray]:
+    data = zlib.decompress(blob)
+    word_count, id_count = np.frombuffer(data, dtype=np.uint32, count=2).tolist()
+    p = 8
+    lengths = np.frombuffer(data, dtype=np.uint32, count=word_count, offset=p)
+    p += 4 * word_count
+    ids = np.frombuffer(data, dtype=np.uint32, count=id_count, offset=p)
+    p += 4 * id_count
+    text = data[p:].decode("utf-8", "surrogatepass")
+    ends = np.cumsum(lengths).tolist()
+    words = [text[b:e] for b, e in zip([0] + ends[:-1], ends)]
+    return words, ids
+
+
+class TokenCache:
+    """On-disk cache of tokenized documents, keyed by `token_cache_key()`. Documents are stored compressed, as
+    their distinct words and the word ids of the tokens. The least recently used entries are evicted when the
+    cache has more than `max_entries`. `hits` and `misses` count the documents found and not found by the lookups.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS token_docs (
+                key TEXT NOT NULL PRIMARY KEY,
+                doc BLOB NOT NULL,
+                last_used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS token_docs_last_used ON token_docs (last_used);
+            """
+        )
+        self.now = time.time_ns()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self) -> "TokenCache":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def lookup(self, keys: Sequence[str]) -> Dict[int, Tuple[List[str], np.ndarray]]:
+        """Return {i: (words, ids)} of the cached documents among `keys`."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS token_keys (idx INTEGER NOT NULL, key TEXT NOT NULL)")
+        self.conn.execute("DELETE FROM token_keys")
+        self.conn.executemany("INSERT INTO token_keys VALUES (?, ?)", enumerate(keys))
+        self.conn.execute(
+            "UPDATE token_docs SET last_used = ? WHERE key IN (SELECT key FROM token_keys)",
+            (self.now,),
+        )
+        cur = self.conn.execute("SELECT k.idx, d.doc FROM token_docs AS d JOIN token_keys AS k ON k.key = d.key")
+        r = dict()
+        for i, blob in cur:
+            r[i] = decode_token_doc(blob)
+        self.hits += len(r)
+        self.misses += len(keys) - len(r)
+        self.conn.commit()
+        return r
+
+    def store(self, items: Iterable[Tuple[str, Sequence[str], np.ndarray]]) -> None:
+        """Store (key, words, ids) items and evict the least recently used entries over the size cap."""
+
+        def rows():
+            for key, words, ids in items:
+                yield (key, encode_token_doc(words, ids), self.now)
+
+        self.conn.executemany("INSERT OR REPLACE INTO token_docs VALUES (?, ?, ?)", rows())
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM token_docs").fetchone()
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM token_docs WHERE rowid IN (SELECT rowid FROM token_docs ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self.conn.commit()
+
+    def format_stats(self) -> str:
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM token_docs").fetchone()
+        return "%d hits, %d misses, %d entries" % (self.hits, self.misses, count)
@@ -9,8 +9,12 @@ import tempfile
 
 from tqdm import tqdm
 
-from .dld import distance_int_list
+from .artifact import DendrogramArtifact
+from .dld import DistanceFunction, distance_int_list
 from .dld import edit_sequence_int_list, EditOp
+from .lower_bounds import compute_signatures
+from .neighbors import DistanceMap, SearchStats, find_neighbors
+from .patience import ANCHORED_DIFF_CELLS, anchored_edit_sequence_int_list, line_starts
 from .ts import strip_common_head_and_tail
 
 
@@ -31,10 +35,15 @@ class DummyProgressBar:
         pass
 
 
-def pyplot_dendrogram(result, label_strs, font=None):
+def pyplot_dendrogram(result, label_strs=None, font=None):
     from scipy.cluster.hierarchy import dendrogram
     import matplotlib.pyplot as plt
 
+    if isinstance(result, DendrogramArtifact):
+        if label_strs is None:
+            label_strs = result.label_strs()
+        result = result.linkage
+
     if font:
         import matplotlib as mpl
 
@@ -91,21 +100,33 @@ def do_listing_in_order_of_increasing_distance(
     neighbors: int = -1,
     separator: str = "\t",
     progress: bool = False,
-    distance_function: Callable[[List[int], List[int]], int] = distance_int_list,
+    distance_function: DistanceFunction = distance_int_list,
+    stats: Optional[SearchStats] = None,
+    known_distances: Optional[Dict[int, int]] = None,
+    map_distances: Optional[DistanceMap] = None,
+    batch_size: int = 1,
 ) -> None:
-    dds: List[Tuple[int, int]] = [(0, 0)]
+    """Print the distance and label of the neighbors of the first document. Each row is printed as soon as its
+    rank is final, while the search continues.
+    """
     pbar = tqdm(desc="Identifying neighbors", total=len(idocs) - 1, leave=False) if progress else DummyProgressBar()
-    for i in range(1, len(idocs)):
-        d = distance_function(idocs[0], idocs[i])
-        dds.append((d, i))
-        pbar.update(1)
-    pbar.close()
-    dds.sort()
 
-    if neighbors > 0:
-        dds = dds[: neighbors + 1]
-    for dist, doci in dds:
-        print("%d%s%s" % (dist, separator, labels[doci]))
+    def print_row(dist: int, doci: int) -> None:
+        print("%d%s%s" % (dist, separator, labels[doci]), flush=True)
+
+    find_neighbors(
+        idocs,
+        max(neighbors, 0),
+        distance_function=distance_function,
+        pbar=pbar,
+        signatures=compute_signatures(idocs),
+        stats=stats,
+        known_distances=known_distances,
+        map_distances=map_distances,
+        batch_size=batch_size,
+        on_final=print_row,
+    )
+    pbar.close()
 
 
 def convert_to_int_docs(docs: List[List[str]]) -> Tuple[List[List[int]], Dict[str, int]]:
@@ -134,6 +155,7 @@ def do_diff(
     lbegend: Optional[Tuple[str, str]] = None,
     rbegend: Optional[Tuple[str, str]] = None,
     sep: str = '',
+    use_numba: bool = True,
 ) -> None:
     if write is None:
         write = sys.stdout.write
@@ -145,7 +167,11 @@ def do_diff(
     idocs, _word_to_index = convert_to_int_docs(docs)
     lidoc, ridoc = idocs[0], idocs[1]
 
-    es = edit_sequence_int_list(lidoc, ridoc)
+    if len(lidoc) * len(ridoc) > ANCHORED_DIFF_CELLS:
+        lstarts, rstarts = line_starts(ldoc, sep), line_starts(rdoc, sep)
+        es = anchored_edit_sequence_int_list(lidoc, ridoc, lstarts, rstarts, use_numba=use_numba)
+    else:
+        es = edit_sequence_int_list(lidoc, ridoc, use_numba=use_numba)
     li = ri = 0
     i = 0
     len_es = len(es)
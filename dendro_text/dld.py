@@ -1,11 +1,45 @@
 from enum import IntFlag
-from typing import List as PList
+from typing import Callable, List as PList, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Interned documents are stored as contiguous arrays of this type, which the Numba kernels take without conversion.
+INT_DOC_DTYPE = np.int32
+
+
+def pack_int_docs(idocs: Sequence[Sequence[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate documents into one flat token buffer. Document i is `tokens[offsets[i]:offsets[i + 1]]`."""
+    offsets = np.zeros(len(idocs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(idoc) for idoc in idocs])
+    tokens = np.empty(offsets[-1], dtype=INT_DOC_DTYPE)
+    for i, idoc in enumerate(idocs):
+        tokens[offsets[i] : offsets[i + 1]] = idoc
+    return tokens, offsets
+
+
+def unpack_int_docs(tokens: np.ndarray, offsets: np.ndarray) -> PList[np.ndarray]:
+    return [tokens[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def to_int_arrays(idocs: Sequence[Sequence[int]]) -> PList[np.ndarray]:
+    """Store the documents once as contiguous int32 arrays (views of a single buffer)."""
+    return unpack_int_docs(*pack_int_docs(idocs))
+
+
+def _as_int_list(s: Sequence[int]) -> Sequence[int]:
+    # The pure-Python implementations are much faster on Python ints than on NumPy scalars.
+    return s.tolist() if isinstance(s, np.ndarray) else s
+
 
 # ref: https://en.wikibooks.org/wiki/Algorithm_Implementation/Strings/Levenshtein_distance#Python
 # distance_int_list was copied from the above page and refactored somehow.
 
-def distance_int_list_python(s1: PList[int], s2: PList[int]) -> int:
+def distance_int_list_python(s1: PList[int], s2: PList[int], max_dist: Optional[int] = None) -> int:
     """Reference and explicit fallback implementation of Levenshtein distance."""
+    if max_dist is not None:
+        return distance_int_list_banded_python(s1, s2, max_dist)
+    s1 = _as_int_list(s1)
+    s2 = _as_int_list(s2)
     if len(s1) < len(s2):
         tmp = s1
         s1 = s2
@@ -28,14 +62,254 @@ def distance_int_list_python(s1: PList[int], s2: PList[int]) -> int:
     return current_row[-1]
 
 
+# ref: E. Ukkonen, "Algorithms for approximate string matching", 1985.
+# With an upper bound k of the distance, only the cells within k of the diagonal can have a value <= k, and the
+# calculation can stop as soon as every cell of a row exceeds k.
+
+def distance_int_list_banded_python(s1: PList[int], s2: PList[int], max_dist: int) -> int:
+    """Levenshtein distance if it is at most `max_dist`, otherwise `max_dist + 1`."""
+    s1 = _as_int_list(s1)
+    s2 = _as_int_list(s2)
+    if len(s1) < len(s2):
+        tmp = s1
+        s1 = s2
+        s2 = tmp
+    assert len(s1) >= len(s2)
+
+    n = len(s1)
+    m = len(s2)
+    k = max(max_dist, 0)
+    over = k + 1
+    if n - m > k:
+        return over
+    if m == 0:
+        return n
+
+    # two rows of full length, of which only the band and the cells just outside of it are written
+    previous_row = [j if j <= k else over for j in range(m + 1)]
+    current_row = [over] * (m + 1)
+    for i in range(1, n + 1):
+        c1 = s1[i - 1]
+        lo = max(1, i - k)
+        hi = min(m, i + k)
+        current_row[lo - 1] = i if lo == 1 and i <= k else over
+        row_min = current_row[lo - 1]
+        for j in range(lo, hi + 1):
+            d_ins = previous_row[j] + 1
+            d_del = current_row[j - 1] + 1
+            d_sub = previous_row[j - 1] + (c1 != s2[j - 1])
+            d = min(d_ins, d_del, d_sub, over)
+            current_row[j] = d
+            if d < row_min:
+                row_min = d
+        if hi < m:
+            current_row[hi + 1] = over
+        if row_min > k:
+            return over
+        tmp_row = previous_row
+        previous_row = current_row
+        current_row = tmp_row
+
+    return previous_row[m]
+
+
+# ref: G. Myers, "A fast bit-vector algorithm for approximate string matching based on dynamic programming", 1999.
+# ref: H. Hyyro, "A bit-vector algorithm for computing Levenshtein and Damerau edit distances", 2003.
+# The vertical deltas of a DP column are kept as bit vectors (Pv: +1, Mv: -1), one bit per item of the shorter
+# sequence, so that a column is advanced in O(len(s2) / word size) instead of O(len(s2)).
+
+def distance_int_list_bitparallel_python(s1: PList[int], s2: PList[int], max_dist: Optional[int] = None) -> int:
+    """Bit-parallel (Myers/Hyyro) Levenshtein distance using Python integers as bit vectors of any length.
+
+    With `max_dist`, returns `max_dist + 1` as soon as the distance is known to exceed it.
+    """
+    s1 = _as_int_list(s1)
+    s2 = _as_int_list(s2)
+    if len(s1) < len(s2):
+        tmp = s1
+        s1 = s2
+        s2 = tmp
+    assert len(s1) >= len(s2)
+
+    n = len(s1)
+    m = len(s2)
+    if max_dist is not None and n - m > max_dist:
+        return max_dist + 1
+    if m == 0:
+        return n
+
+    peq = dict()
+    for j, c2 in enumerate(s2):
+        peq[c2] = peq.get(c2, 0) | (1 << j)
+
+    mask = (1 << m) - 1
+    last_bit = 1 << (m - 1)
+    pv = mask
+    mv = 0
+    score = m
+    for i, c1 in enumerate(s1):
+        eq = peq.get(c1, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & last_bit:
+            score += 1
+        elif mh & last_bit:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask  # the top row of the DP table increases by one in each column
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        if max_dist is not None and score - (n - 1 - i) > max_dist:
+            return max_dist + 1  # the bottom row decreases by at most one in each of the remaining columns
+
+    return score
+
+
+# Edit script in linear memory (Hirschberg's algorithm): a segment of the two sequences is split at the middle of
+# s1 and at the position of s2 where the costs of the forward and the backward DP rows sum to the minimum, until
+# the segment has at most EDIT_TABLE_CELLS cells, which are traced back on a full table with the same rules as
+# `edit_sequence_int_list_python()`. The functions are compiled by Numba when it is available.
+
+EDIT_TABLE_CELLS = 1 << 16
+
+
+def _edit_ops_table(s1, a0, a1, s2, b0, b1, out, pos, rev):
+    swapped = a1 - a0 < b1 - b0
+    if swapped:
+        x, x0, nx, y, y0, ny = s2, b0, b1 - b0, s1, a0, a1 - a0
+    else:
+        x, x0, nx, y, y0, ny = s1, a0, a1 - a0, s2, b0, b1 - b0
+    table = np.empty((nx + 1, ny + 1), dtype=np.int64)
+    for j in range(ny + 1):
+        table[0, j] = j
+    for i in range(1, nx + 1):
+        table[i, 0] = i
+        c1 = x[x0 + i - 1]
+        for j in range(1, ny + 1):
+            d_ins = table[i - 1, j] + 1
+            d_del = table[i, j - 1] + 1
+            d_sub = table[i - 1, j - 1] + (c1 != y[y0 + j - 1])
+            table[i, j] = min(d_ins, d_del, d_sub)
+
+    count = 0
+    i, j = nx, ny
+    while i > 0 and j > 0:
+        d_del = table[i - 1, j]
+        d_ins = table[i, j - 1]
+        d_sub = table[i - 1, j - 1]
+        d_min = min(d_del, d_ins, d_sub)
+        if d_min == d_sub:
+            rev[count] = 3 if x[x0 + i - 1] == y[y0 + j - 1] else 0  # NO_EDIT or SUB
+            i -= 1
+            j -= 1
+        elif d_min == d_del:
+            rev[count] = 1  # DEL
+            i -= 1
+        else:
+            rev[count] = 2  # INS
+            j -= 1
+        count += 1
+    while j > 0:
+        rev[count] = 2
+        j -= 1
+        count += 1
+    while i > 0:
+        rev[count] = 1
+        i -= 1
+        count += 1
+
+    for k in range(count):
+        op = rev[count - 1 - k]
+        if swapped and op != 0 and op != 3:
+            op = 3 - op  # DEL <-> INS
+        out[pos + k] = op
+    return pos + count
+
+
+def _forward_costs(s1, a0, a1, s2, b0, b1, row):
+    """row[j] = distance(s1[a0:a1], s2[b0:b0 + j])"""
+    m = b1 - b0
+    for j in range(m + 1):
+        row[j] = j
+    for i in range(a0, a1):
+        diagonal = row[0]
+        row[0] = i - a0 + 1
+        c1 = s1[i]
+        for j in range(1, m + 1):
+            above = row[j]
+            row[j] = min(above + 1, row[j - 1] + 1, diagonal + (c1 != s2[b0 + j - 1]))
+            diagonal = above
+
+
+def _backward_costs(s1, a0, a1, s2, b0, b1, row):
+    """row[j] = distance(s1[a0:a1], s2[b0 + j:b1])"""
+    m = b1 - b0
+    for j in range(m + 1):
+        row[j] = m - j
+    for i in range(a1 - 1, a0 - 1, -1):
+        diagonal = row[m]
+        row[m] = a1 - i
+        c1 = s1[i]
+        for j in range(m - 1, -1, -1):
+            below = row[j]
+            row[j] = min(below + 1, row[j + 1] + 1, diagonal + (c1 != s2[b0 + j]))
+            diagonal = below
+
+
+def _make_edit_ops_hirschberg(edit_ops_table, forward_costs, backward_costs):
+    # the helpers are given, so that the Numba version calls the compiled ones
+    def edit_ops_hirschberg(s1, s2, out):
+        n = len(s1)
+        m = len(s2)
+        forward = np.empty(m + 1, dtype=np.int64)
+        backward = np.empty(m + 1, dtype=np.int64)
+        rev = np.empty(n + m + 1, dtype=np.int8)
+        depth = 4
+        while (1 << depth) <= n + 1:
+            depth += 1
+        stack = np.empty((2 * depth + 4, 4), dtype=np.int64)  # segments (a0, a1, b0, b1), the left one on the top
+        stack[0, 0], stack[0, 1], stack[0, 2], stack[0, 3] = 0, n, 0, m
+        top = 1
+        pos = 0
+        while top > 0:
+            top -= 1
+            a0, a1, b0, b1 = stack[top, 0], stack[top, 1], stack[top, 2], stack[top, 3]
+            if a1 - a0 <= 1 or (a1 - a0) * (b1 - b0 + 1) <= EDIT_TABLE_CELLS:
+                pos = edit_ops_table(s1, a0, a1, s2, b0, b1, out, pos, rev)
+                continue
+            mid = (a0 + a1) // 2
+            forward_costs(s1, a0, mid, s2, b0, b1, forward)
+            backward_costs(s1, mid, a1, s2, b0, b1, backward)
+            split = 0
+            best = forward[0] + backward[0]
+            for j in range(1, b1 - b0 + 1):
+                c = forward[j] + backward[j]
+                if c < best:
+                    best = c
+                    split = j
+            stack[top, 0], stack[top, 1], stack[top, 2], stack[top, 3] = mid, a1, b0 + split, b1
+            stack[top + 1, 0], stack[top + 1, 1], stack[top + 1, 2], stack[top + 1, 3] = a0, mid, b0, b0 + split
+            top += 2
+        return pos
+
+    return edit_ops_hirschberg
+
+
+_edit_ops_hirschberg = _make_edit_ops_hirschberg(_edit_ops_table, _forward_costs, _backward_costs)
+
+
 try:
     from numba import njit
-    from numba.typed import List as TList
 except ImportError:
     distance_int_list_numba = None
+    distance_int_list_bitparallel_numba = None
+    condensed_distances_i = None
+    _edit_ops_hirschberg_i = None
 else:
 
-    @njit(nogil=True)
+    @njit(nogil=True, cache=True)
     def distance_int_list_i(s1, s2):
         if len(s1) < len(s2):
             tmp = s1
@@ -43,38 +317,225 @@ else:
             s2 = tmp
         assert len(s1) >= len(s2)
 
-        if len(s2) == 0:
+        m = len(s2)
+        if m == 0:
             return len(s1)
 
-        current_row = TList()
-        current_row.extend(range(len(s2) + 1))
-        for i, c1 in enumerate(s1):
-            previous_row = current_row
-            current_row = TList()
-            current_row.append(i + 1)
-            [current_row.append(0) for _ in s2]
-            for j, c2 in enumerate(s2):
+        # two row buffers, swapped after each row instead of allocating a new row
+        previous_row = np.arange(m + 1)
+        current_row = np.empty(m + 1, dtype=previous_row.dtype)
+        for i in range(len(s1)):
+            c1 = s1[i]
+            current_row[0] = i + 1
+            for j in range(m):
                 d_ins = previous_row[j + 1] + 1  # j+1 instead of j since previous_row and current_row are one character longer
                 d_del = current_row[j] + 1  # than s2
-                d_sub = previous_row[j] + (c1 != c2)
+                d_sub = previous_row[j] + (c1 != s2[j])
                 current_row[j + 1] = min(d_ins, d_del, d_sub)
+            tmp_row = previous_row
+            previous_row = current_row
+            current_row = tmp_row
 
-        return current_row[-1]
+        return previous_row[m]
 
 
-    def distance_int_list_numba(s1: PList[int], s2: PList[int]) -> int:
-        ns1 = TList()
-        [ns1.append(i) for i in s1]
-        ns2 = TList()
-        [ns2.append(i) for i in s2]
-        return distance_int_list_i(ns1, ns2)
+    def _as_int_array(s: Sequence[int]) -> np.ndarray:
+        if isinstance(s, np.ndarray) and s.dtype == INT_DOC_DTYPE:
+            return s  # no conversion for documents prepared by to_int_arrays()
+        return np.asarray(s, dtype=INT_DOC_DTYPE)
 
 
-def distance_int_list(s1: PList[int], s2: PList[int]) -> int:
-    """Use Numba when available; use the reference implementation otherwise."""
-    if distance_int_list_numba is None:
-        return distance_int_list_python(s1, s2)
-    return distance_int_list_numba(s1, s2)
+    @njit(nogil=True, cache=True)
+    def distance_int_list_banded_i(s1, s2, max_dist):
+        if len(s1) < len(s2):
+            tmp = s1
+            s1 = s2
+            s2 = tmp
+        assert len(s1) >= len(s2)
+
+        n = len(s1)
+        m = len(s2)
+        k = max(max_dist, 0)
+        over = k + 1
+        if n - m > k:
+            return over
+        if m == 0:
+            return n
+
+        previous_row = np.full(m + 1, over)
+        current_row = np.full(m + 1, over)
+        for j in range(min(m, k) + 1):
+            previous_row[j] = j
+        for i in range(1, n + 1):
+            c1 = s1[i - 1]
+            lo = max(1, i - k)
+            hi = min(m, i + k)
+            current_row[lo - 1] = i if lo == 1 and i <= k else over
+            row_min = current_row[lo - 1]
+            for j in range(lo, hi + 1):
+                d = min(previous_row[j] + 1, current_row[j - 1] + 1, previous_row[j - 1] + (c1 != s2[j - 1]), over)
+                current_row[j] = d
+                if d < row_min:
+                    row_min = d
+            if hi < m:
+                current_row[hi + 1] = over
+            if row_min > k:
+                return over
+            tmp_row = previous_row
+            previous_row = current_row
+            current_row = tmp_row
+
+        return previous_row[m]
+
+
+    def distance_int_list_numba(s1: PList[int], s2: PList[int], max_dist: Optional[int] = None) -> int:
+        if max_dist is not None:
+            return int(distance_int_list_banded_i(_as_int_array(s1), _as_int_array(s2), max_dist))
+        return int(distance_int_list_i(_as_int_array(s1), _as_int_array(s2)))
+
+
+    @njit(nogil=True, cache=True)
+    def distance_int_list_bitparallel_i(s1, s2, max_dist):  # max_dist < 0 for no bound
+        # Hyyro's block extension of Myers' algorithm: the bit vectors are split into 64-bit blocks and the
+        # horizontal delta at the bottom of each block is carried into the next one.
+        if len(s1) < len(s2):
+            tmp = s1
+            s1 = s2
+            s2 = tmp
+        assert len(s1) >= len(s2)
+
+        n = len(s1)
+        m = len(s2)
+        if max_dist >= 0 and n - m > max_dist:
+            return max_dist + 1
+        if m == 0:
+            return n
+
+        alphabet = np.unique(s2)
+        len_alphabet = len(alphabet)
+        blocks = (m + 63) // 64
+        peq = np.zeros((len_alphabet + 1, blocks), dtype=np.uint64)  # the last row is for items not in s2
+        one = np.uint64(1)
+        for j in range(m):
+            a = np.searchsorted(alphabet, s2[j])
+            peq[a, j // 64] |= one << np.uint64(j % 64)
+
+        pv = np.full(blocks, ~np.uint64(0), dtype=np.uint64)
+        mv = np.zeros(blocks, dtype=np.uint64)
+        high_bit = one << np.uint64(63)
+        last_bit = one << np.uint64((m - 1) % 64)
+        score = m
+        for i in range(len(s1)):
+            c1 = s1[i]
+            a = np.searchsorted(alphabet, c1)
+            if a >= len_alphabet or alphabet[a] != c1:
+                a = len_alphabet
+            h_in = 1  # the top row of the DP table increases by one in each column
+            for b in range(blocks):
+                eq = peq[a, b]
+                pvb = pv[b]
+                mvb = mv[b]
+                xv = eq | mvb
+                if h_in < 0:
+                    eq |= one
+                xh = (((eq & pvb) + pvb) ^ pvb) | eq
+                ph = mvb | ~(xh | pvb)
+                mh = pvb & xh
+                out_bit = last_bit if b == blocks - 1 else high_bit
+                h_out = 0
+                if ph & out_bit:
+                    h_out = 1
+                elif mh & out_bit:
+                    h_out = -1
+                ph <<= one
+                mh <<= one
+                if h_in < 0:
+                    mh |= one
+                elif h_in > 0:
+                    ph |= one
+                pv[b] = mh | ~(xv | ph)
+                mv[b] = ph & xv
+                h_in = h_out
+            score += h_in
+            if max_dist >= 0 and score - (n - 1 - i) > max_dist:
+                return max_dist + 1
+
+        return score
+
+
+    def distance_int_list_bitparallel_numba(s1: PList[int], s2: PList[int], max_dist: Optional[int] = None) -> int:
+        s1 = _as_int_array(s1)
+        s2 = _as_int_array(s2)
+        if max_dist is None:
+            return int(distance_int_list_bitparallel_i(s1, s2, -1))
+        # a band cell costs about as much as 1/16 of the operations on a 64-bit block
+        if 2 * max_dist + 1 < (min(len(s1), len(s2)) + 63) // 64 * 16:
+            return int(distance_int_list_banded_i(s1, s2, max_dist))
+        return int(distance_int_list_bitparallel_i(s1, s2, max(max_dist, 0)))
+
+
+    @njit(nogil=True, cache=True)
+    def condensed_distances_i(tokens, offsets, k_begin, k_end, i, j, step, use_dp, out, stop):
+        # Fills the NaN items of out[k_begin:k_end], a range of a vector of every `step`-th pair of a condensed
+        # distance vector, where (i, j) is the pair of the index k_begin. Returns early, leaving the other items
+        # NaN, when stop[0] is set by another thread.
+        n = len(offsets) - 1
+        for k in range(k_begin, k_end):
+            if stop[0]:
+                return
+            if np.isnan(out[k]):
+                s1 = tokens[offsets[i] : offsets[i + 1]]
+                s2 = tokens[offsets[j] : offsets[j + 1]]
+                if use_dp:
+                    out[k] = distance_int_list_i(s1, s2)
+                else:
+                    out[k] = distance_int_list_bitparallel_i(s1, s2, -1)
+            j += step
+            while j >= n and i < n - 2:
+                i += 1
+                j -= n - 1 - i  # the same offset past the end of the row, from the start of the next row
+
+    _edit_ops_table_i = njit(nogil=True, cache=True)(_edit_ops_table)
+    _forward_costs_i = njit(nogil=True, cache=True)(_forward_costs)
+    _backward_costs_i = njit(nogil=True, cache=True)(_backward_costs)
+
+    # not cached: Numba keys the cache of a closure by its free variables, and the dispatchers differ in each
+    # process; the helpers are cached, and the closure is compiled only for inputs over EDIT_TABLE_CELLS
+    _edit_ops_hirschberg_i = njit(nogil=True)(
+        _make_edit_ops_hirschberg(_edit_ops_table_i, _forward_costs_i, _backward_costs_i)
+    )
+
+
+DISTANCE_ENGINES = ("bitparallel", "dp")
+
+
+# A distance function takes two documents and an optional `max_dist`. When the distance exceeds `max_dist`, it
+# returns `max_dist + 1` instead of the exact distance.
+DistanceFunction = Callable[..., int]
+
+
+def select_distance_function(engine: str = "bitparallel", use_numba: bool = True) -> DistanceFunction:
+    """Return the distance function of the given engine, the Numba version if available and `use_numba` is set."""
+    if engine == "bitparallel":
+        if use_numba and distance_int_list_bitparallel_numba is not None:
+            return distance_int_list_bitparallel_numba
+        return distance_int_list_bitparallel_python
+    elif engine == "dp":
+        if use_numba and distance_int_list_numba is not None:
+            return distance_int_list_numba
+        return distance_int_list_python
+    else:
+        raise ValueError("unknown distance engine: %s" % repr(engine))
+
+
+def distance_int_list(s1: PList[int], s2: PList[int], max_dist: Optional[int] = None) -> int:
+    """Use the bit-parallel engine, compiled by Numba when available.
+
+    With `max_dist`, returns `max_dist + 1` as soon as the distance is known to exceed it.
+    """
+    if distance_int_list_bitparallel_numba is None:
+        return distance_int_list_bitparallel_python(s1, s2, max_dist)
+    return distance_int_list_bitparallel_numba(s1, s2, max_dist)
 
 
 class EditOp(IntFlag):
@@ -113,7 +574,8 @@ def trans_edit_sequence(edit_seq: PList[int]) -> PList[int]:
     return r
 
 
-def edit_sequence_int_list(s1: PList[int], s2: PList[int]) -> PList[int]:
+def edit_sequence_int_list_python(s1: PList[int], s2: PList[int]) -> PList[int]:
+    """Edit script by the full DP table (O(n m) memory), the reference of `edit_sequence_int_list()`."""
     s1_s2_swapped = False
     if len(s1) < len(s2):
         tmp = s1
@@ -163,3 +625,38 @@ def edit_sequence_int_list(s1: PList[int], s2: PList[int]) -> PList[int]:
         edit_seq = trans_edit_sequence(edit_seq)
 
     return edit_seq
+
+
+def edit_sequence_int_list(s1: PList[int], s2: PList[int], use_numba: bool = True) -> PList[int]:
+    """Edit script (a list of EditOp values) that turns s1 into s2 with the minimum number of edits.
+
+    Up to EDIT_TABLE_CELLS cells, the script is the same as `edit_sequence_int_list_python()`. Larger inputs are
+    solved in O(n + m) memory by Hirschberg's algorithm after stripping the common head and tail, which gives another
+    script of the same cost when there are ties. It is compiled by Numba when available and `use_numba` is set.
+    """
+    a = np.asarray(s1, dtype=np.int64)
+    b = np.asarray(s2, dtype=np.int64)
+    if len(a) * len(b) <= EDIT_TABLE_CELLS:
+        out = np.empty(len(a) + len(b), dtype=np.int8)
+        rev = np.empty(len(a) + len(b) + 1, dtype=np.int8)
+        if use_numba and _edit_ops_hirschberg_i is not None:
+            count = _edit_ops_table_i(a, 0, len(a), b, 0, len(b), out, 0, rev)
+        else:
+            count = _edit_ops_table(a.tolist(), 0, len(a), b.tolist(), 0, len(b), out, 0, rev)
+        return out[:count].tolist()
+
+    shorter = min(len(a), len(b))
+    diff = np.flatnonzero(a[:shorter] != b[:shorter])
+    head = int(diff[0]) if len(diff) else shorter
+    diff = np.flatnonzero(a[len(a) - shorter + head :][::-1] != b[len(b) - shorter + head :][::-1])
+    tail = int(diff[0]) if len(diff) else shorter - head
+    a = a[head : len(a) - tail]
+    b = b[head : len(b) - tail]
+
+    out = np.empty(len(a) + len(b), dtype=np.int8)
+    if use_numba and _edit_ops_hirschberg_i is not None:
+        count = _edit_ops_hirschberg_i(a, b, out)
+    else:
+        count = _edit_ops_hirschberg(a.tolist(), b.tolist(), out)
+    no_edit = int(EditOp.NO_EDIT)
+    return [no_edit] * head + out[:count].tolist() + [no_edit] * tail
@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .cache import TokenCache
+from .ts import TokenizeStats, take_tokenize_stats
+
+# Parallel reading and tokenizing of the input files. A task reads a chunk of files and interns their tokens with
+# a vocabulary local to the chunk, so that only the distinct words of the chunk and arrays of ids are sent back.
+# The main process maps the local ids to a vocabulary of the run as the chunks arrive (in the order of the files),
+# and finally renumbers the ids in the order of the sorted words: the same ids as `convert_to_int_docs()`, without
+# keeping the token strings of every document. With a `TokenCache`, the cached documents are taken from it in the
+# main process, and only the others are read by the workers (and stored into the cache).
+
+ReadFunction = Callable[[str], List[str]]
+
+INGEST_CHUNKS_PER_WORKER = 8
+MAX_INGEST_CHUNK = 64
+
+
+class IngestError(Exception):
+    """An error in reading a file in a worker process; the argument is the code of its SystemExit."""
+
+
+def intern_chunk(read_doc: ReadFunction, files: Sequence[str]) -> Tuple[List[str], List[np.ndarray]]:
+    """Read the files and intern their tokens. Returns the local vocabulary and the documents of local ids."""
+    local: Dict[str, int] = dict()
+    arrays = []
+    for filename in files:
+        doc = read_doc(filename)
+        ids = (local.setdefault(w, len(local)) for w in doc)
+        arrays.append(np.fromiter(ids, dtype=np.int32, count=len(doc)))
+    return list(local), arrays
+
+
+_ingest_read_doc: Optional[ReadFunction] = None
+
+
+def _init_ingest_worker(read_doc: ReadFunction) -> None:
+    global _ingest_read_doc
+    _ingest_read_doc = read_doc
+
+
+_InternedChunk = Tuple[List[str], List[np.ndarray], Optional[TokenizeStats]]
+
+
+def _intern_chunk_task(files: Sequence[str]) -> _InternedChunk:
+    assert _ingest_read_doc is not None
+    try:
+        words, arrays = intern_chunk(_ingest_read_doc, files)
+    except SystemExit as e:
+        # a SystemExit would end the worker process without a result
+        raise IngestError(e.code) from None
+    return words, arrays, take_tokenize_stats()
+
+
+def _iter_interned_chunks(
+    files: List[str], read_doc: ReadFunction, workers: Optional[int], backend: str
+) -> Iterator[_InternedChunk]:
+    # the tokenize stats of the chunks read in this process are left in its counters (None)
+    if workers is None or workers <= 1 or len(files) <= 1:
+        for filename in files:
+            yield intern_chunk(read_doc, [filename]) + (None,)
+        return
+
+    chunk_size = max(1, min(MAX_INGEST_CHUNK, len(files) // (workers * INGEST_CHUNKS_PER_WORKER)))
+    chunks = [files[b : b + chunk_size] for b in range(0, len(files), chunk_size)]
+    if backend == "thread":
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(lambda chunk: intern_chunk(read_doc, chunk) + (None,), chunks)
+        return
+
+    assert backend == "process"
+    with Pool(workers, initializer=_init_ingest_worker, initargs=(read_doc,)) as pool:
+        try:
+            yield from pool.imap(_intern_chunk_task, chunks)
+        except IngestError as e:
+            raise SystemExit(e.args[0]) from None
+
+
+def _doc_words(words: List[str], ids: np.ndarray) -> Tuple[List[str], np.ndarray]:
+    """The distinct words of a document of a chunk, and its tokens as ids of them."""
+    used, doc_ids = np.unique(ids, return_inverse=True)
+    return [words[k] for k in used.tolist()], doc_ids
+
+
+def read_int_docs(
+    files: List[str],
+    read_doc: ReadFunction,
+    workers: Optional[int] = None,
+    backend: str = "process",
+    pbar=None,
+    stats: Optional[TokenizeStats] = None,
+    token_cache: Optional[TokenCache] = None,
+    cache_keys: Optional[Sequence[str]] = None,
+) -> Tuple[List[List[int]], Dict[str, int]]:
+    """Read and tokenize the files with `read_doc` in `workers` processes (or threads), and intern the tokens as
+    `convert_to_int_docs()` does. `pbar` is updated by the files. The counters of `text_split()` in the workers
+    and in this process are added to `stats`. With `token_cache`, the files are looked up by `cache_keys` first,
+    and the files read are stored.
+    """
+    vocabulary: Dict[str, int] = dict()  # word -> id in the order of appearance
+    docs: List[np.ndarray] = [np.zeros(0, dtype=np.int64)] * len(files)
+
+    def intern(words: List[str], arrays: List[np.ndarray], indices: List[int]) -> None:
+        ids = (vocabulary.setdefault(w, len(vocabulary)) for w in words)
+        mapping = np.fromiter(ids, dtype=np.int64, count=len(words))
+        for i, a in zip(indices, arrays):
+            docs[i] = mapping[a]
+            if pbar is not None:
+                pbar.update(1)
+
+    cached: Dict[int, Tuple[List[str], np.ndarray]] = dict()
+    if token_cache is not None:
+        assert cache_keys is not None and len(cache_keys) == len(files)
+        cached = token_cache.lookup(cache_keys)
+        for i, (words, ids) in sorted(cached.items()):
+            intern(words, [ids], [i])
+    todo = [i for i in range(len(files)) if i not in cached]
+
+    new_entries = []
+    p = 0
+    for words, arrays, chunk_stats in _iter_interned_chunks([files[i] for i in todo], read_doc, workers, backend):
+        if stats is not None and chunk_stats is not None:
+            stats.merge(chunk_stats)
+        indices = todo[p : p + len(arrays)]
+        p += len(arrays)
+        intern(words, arrays, indices)
+        if token_cache is not None:
+            new_entries.extend((cache_keys[i],) + _doc_words(words, a) for i, a in zip(indices, arrays))
+    if token_cache is not None and new_entries:
+        token_cache.store(new_entries)
+
+    if stats is not None:
+        stats.merge(take_tokenize_stats())
+
+    words = list(vocabulary)
+    order = sorted(range(len(words)), key=words.__getitem__)
+    rank = np.empty(len(words), dtype=np.int64)
+    rank[order] = np.arange(1, len(words) + 1)
+    word_to_index = dict((words[k], i + 1) for i, k in enumerate(order))
+    idocs = [rank[d].tolist() for d in docs]
+    return idocs, word_to_index
@@ -0,0 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import IO, List, Optional, Sequence, Tuple
+
+import csv
+
+import numpy as np
+
+from .dld import DistanceFunction, distance_int_list
+from .lower_bounds import LowerBoundIndex, compute_signatures
+from .neighbors import SearchStats, find_neighbors
+from .shared_corpus import SharedCorpus, SharedCorpusHandle, attach_shared_corpus
+
+# k-nearest-neighbor graph: the k nearest documents of every document, found by the bounded top-k search of
+# `find_neighbors()` with the lower bounds of `LowerBoundIndex`, instead of the full distance matrix.
+
+KNN_QUERIES_PER_TASK = 64
+
+
+@dataclass(frozen=True)
+class KnnGraph:
+    """Edges from each document to its nearest neighbors, sorted by source, then by distance and target."""
+
+    sources: np.ndarray
+    targets: np.ndarray
+    distances: np.ndarray
+
+
+def _knn_of_queries(
+    idocs: Sequence[Sequence[int]],
+    index: LowerBoundIndex,
+    signatures,
+    queries: Sequence[int],
+    k: int,
+    distance_function: DistanceFunction,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int, int]:
+    sources: List[int] = []
+    targets: List[int] = []
+    distances: List[int] = []
+    stats = SearchStats()
+    for q in queries:
+        dds = find_neighbors(
+            idocs,
+            k,
+            distance_function=distance_function,
+            stats=stats,
+            lower_bounds=index.lower_bounds(signatures[q]),
+            query=q,
+        )
+        for d, i in dds[1:]:
+            sources.append(q)
+            targets.append(i)
+            distances.append(d)
+    return (
+        np.array(sources, dtype=np.int32),
+        np.array(targets, dtype=np.int32),
+        np.array(distances, dtype=np.int64),
+        stats.exact_calls,
+        stats.pruned,
+    )
+
+
+_knn_worker_idocs: Optional[List[np.ndarray]] = None
+_knn_worker_signatures = None
+_knn_worker_index: Optional[LowerBoundIndex] = None
+_knn_worker_function: DistanceFunction = distance_int_list
+
+
+def _init_knn_worker(handle: SharedCorpusHandle, distance_function: DistanceFunction) -> None:
+    global _knn_worker_idocs, _knn_worker_signatures, _knn_worker_index, _knn_worker_function
+    _knn_worker_idocs = attach_shared_corpus(handle)
+    _knn_worker_signatures = compute_signatures(_knn_worker_idocs)
+    _knn_worker_index = LowerBoundIndex(_knn_worker_signatures)
+    _knn_worker_function = distance_function
+
+
+def _calc_knn_task(job: Tuple[np.ndarray, int]):
+    queries, k = job
+    assert _knn_worker_idocs is not None and _knn_worker_index is not None
+    return _knn_of_queries(
+        _knn_worker_idocs, _knn_worker_index, _knn_worker_signatures, queries.tolist(), k, _knn_worker_function
+    )
+
+
+def build_knn_graph(
+    idocs: Sequence[Sequence[int]],
+    k: int,
+    distance_function: DistanceFunction = distance_int_list,
+    workers: Optional[int] = None,
+    backend: str = "process",
+    pbar=None,
+    stats: Optional[SearchStats] = None,
+) -> KnnGraph:
+    """Find the `k` nearest neighbors of every document (ties are broken by index).
+
+    With `workers` > 1, the queries are split into tasks of KNN_QUERIES_PER_TASK documents, run by worker
+    processes over a shared corpus, or by threads (`backend="thread"`). `pbar` is updated by the documents.
+    """
+    assert k >= 1
+    n = len(idocs)
+    tasks = [np.arange(b, min(n, b + KNN_QUERIES_PER_TASK)) for b in range(0, n, KNN_QUERIES_PER_TASK)]
+    results = []
+
+    def collect(result) -> None:
+        results.append(result)
+        if stats is not None:
+            stats.exact_calls += result[3]
+            stats.pruned += result[4]
+        if pbar is not None:
+            pbar.update(len(np.unique(result[0])) if len(result[0]) else 0)
+
+    if workers is None or workers <= 1 or backend == "thread":
+        signatures = compute_signatures(idocs)
+        index = LowerBoundIndex(signatures)
+
+        def run(queries: np.ndarray):
+            return _knn_of_queries(idocs, index, signatures, queries.tolist(), k, distance_function)
+
+        if workers is None or workers <= 1:
+            for queries in tasks:
+                collect(run(queries))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for result in executor.map(run, tasks):
+                    collect(result)
+    else:
+        assert backend == "process"
+        with SharedCorpus(idocs) as corpus, Pool(
+            workers, initializer=_init_knn_worker, initargs=(corpus.handle, distance_function)
+        ) as pool:
+            for result in pool.imap(_calc_knn_task, ((queries, k) for queries in tasks)):
+                collect(result)
+
+    if not results:
+        empty = np.zeros(0, dtype=np.int32)
+        return KnnGraph(empty, empty, np.zeros(0, dtype=np.int64))
+    return KnnGraph(
+        sources=np.concatenate([r[0] for r in results]),
+        targets=np.concatenate([r[1] for r in results]),
+        distances=np.concatenate([r[2] for r in results]),
+    )
+
+
+def save_knn_graph(path: str, graph: KnnGraph, labels: Sequence[str]) -> None:
+    """Save the graph as `.npz` with the arrays sources, targets, distances, and labels (file names by index)."""
+    with open(path, "wb") as outp:
+        np.savez_compressed(
+            outp,
+            sources=graph.sources,
+            targets=graph.targets,
+            distances=graph.distances,
+            labels=np.array(labels, dtype=np.str_),
+        )
+
+
+def write_knn_graph_csv(outp: IO[str], graph: KnnGraph, labels: Sequence[str]) -> None:
+    """Write the graph as CSV rows of (source, target, distance), with file names."""
+    writer = csv.writer(outp, lineterminator="\n")
+    writer.writerow(["source", "target", "distance"])
+    for s, t, d in zip(graph.sources.tolist(), graph.targets.tolist(), graph.distances.tolist()):
+        writer.writerow([labels[s], labels[t], d])
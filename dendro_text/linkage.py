@@ -0,0 +1,307 @@
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import os
+import tempfile
+
+import numpy as np
+
+from .knn import KnnGraph
+
+# Linkage engines producing the linkage matrix of `scipy.cluster.hierarchy.linkage()`:
+#
+# * scipy: `scipy.cluster.hierarchy.linkage()` on the condensed distance vector (it makes a working copy of it).
+# * nn-chain: the nearest-neighbor chain algorithm (as SciPy uses for average, complete, and weighted linkage),
+#   updating the condensed vector in place. The vector is allocated in a memory-mapped temporary file by
+#   `condensed_memmap()`, so that it is paged by the OS instead of taking N^2 / 2 of memory; with a vector
+#   that must be kept, the chain works on a copy in such a file. For average, complete, and weighted linkage,
+#   the result is the same as SciPy, including ties; for single linkage (SciPy uses a minimum spanning tree),
+#   the merge distances are the same but merges at tied distances may be in another order.
+# * knn-mst: single linkage from the minimum spanning forest of a k-nearest-neighbor graph, without the
+#   distance matrix. Groups not connected by the graph are joined at the largest distance of the graph + 1.
+
+LINKAGE_METHODS = ("average", "complete", "single", "weighted")
+LINKAGE_ENGINES = ("scipy", "nn-chain", "knn-mst")
+DEFAULT_LINKAGE_NEIGHBORS = 16
+
+LinkageFunction = Callable[[np.ndarray, int], np.ndarray]
+
+_METHOD_CODES = {"single": 0, "complete": 1, "average": 2, "weighted": 3}
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(2 * n - 1))
+        self.size = [1] * n + [0] * (n - 1)
+        self.next_label = n
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def merge(self, x: int, y: int) -> int:
+        """Merge the roots x and y into a new cluster. Returns its size."""
+        self.parent[x] = self.parent[y] = self.next_label
+        size = self.size[x] + self.size[y]
+        self.size[self.next_label] = size
+        self.next_label += 1
+        return size
+
+
+def _label(merges: np.ndarray, n: int) -> np.ndarray:
+    """Sort merges (x, y, distance) of original indices by distance (stably) and give the clusters the labels of
+    SciPy, as its `_hierarchy.label()`.
+    """
+    z = merges[np.argsort(merges[:, 2], kind="mergesort")]
+    uf = _UnionFind(n)
+    for i in range(len(z)):
+        x_root, y_root = uf.find(int(z[i, 0])), uf.find(int(z[i, 1]))
+        z[i, 0], z[i, 1] = min(x_root, y_root), max(x_root, y_root)
+        z[i, 3] = uf.merge(x_root, y_root)
+    return z
+
+
+def _row_indices(n: int, x: int, others: np.ndarray) -> np.ndarray:
+    """Condensed indices of the pairs (x, i) for the indices `others` (not including x)."""
+    a = np.minimum(others, x)
+    b = np.maximum(others, x)
+    return n * a - a * (a + 1) // 2 + (b - a - 1)
+
+
+def _new_distances(method: int, d_xi: np.ndarray, d_yi: np.ndarray, nx: int, ny: int) -> np.ndarray:
+    # Lance-Williams updates, written as SciPy does
+    if method == 0:
+        return np.minimum(d_xi, d_yi)
+    if method == 1:
+        return np.maximum(d_xi, d_yi)
+    if method == 2:
+        return (nx * d_xi + ny * d_yi) / (nx + ny)
+    return 0.5 * (d_xi + d_yi)
+
+
+def _nn_chain_numpy(d: np.ndarray, n: int, method: int, z: np.ndarray) -> None:
+    size = np.ones(n, dtype=np.int64)
+    chain: List[int] = []
+    active = np.arange(n, dtype=np.int64)
+    for k in range(n - 1):
+        if not chain:
+            chain.append(int(active[0]))
+        while True:
+            x = chain[-1]
+            others = active[active != x]
+            row = d[_row_indices(n, x, others)]
+            if len(chain) > 1:
+                y = chain[-2]
+                current_min = d[_row_indices(n, x, np.array([y]))[0]]
+            else:
+                y = -1
+                current_min = np.inf
+            p = int(np.argmin(row))  # the first minimum, as the sequential scan of SciPy
+            if row[p] < current_min:
+                current_min = row[p]
+                y = int(others[p])
+            if len(chain) > 1 and y == chain[-2]:
+                break  # while True
+            chain.append(y)
+        del chain[-2:]
+        if x > y:
+            x, y = y, x
+        nx, ny = int(size[x]), int(size[y])
+        z[k, 0], z[k, 1], z[k, 2], z[k, 3] = x, y, current_min, nx + ny
+        size[x] = 0
+        size[y] = nx + ny
+        active = active[active != x]
+        others = active[active != y]
+        ky = _row_indices(n, y, others)
+        d[ky] = _new_distances(method, d[_row_indices(n, x, others)], d[ky], nx, ny)
+
+
+try:
+    from numba import njit
+except ImportError:
+    _nn_chain_i = None
+else:
+
+    @njit(cache=True)
+    def _condensed_index_i(n, i, j):
+        if i > j:
+            i, j = j, i
+        return n * i - (i * (i + 1)) // 2 + (j - i - 1)
+
+    @njit(cache=True)
+    def _nn_chain_i(d, n, method, z):
+        # a transcription of `nn_chain()` of SciPy's _hierarchy.pyx
+        size = np.ones(n, dtype=np.int64)
+        chain = np.empty(n, dtype=np.int64)
+        chain_length = 0
+        x = 0
+        y = 0
+        for k in range(n - 1):
+            if chain_length == 0:
+                chain_length = 1
+                for i in range(n):
+                    if size[i] > 0:
+                        chain[0] = i
+                        break
+            while True:
+                x = chain[chain_length - 1]
+                if chain_length > 1:
+                    y = chain[chain_length - 2]
+                    current_min = d[_condensed_index_i(n, x, y)]
+                else:
+                    current_min = np.inf
+                for i in range(n):
+                    if size[i] == 0 or x == i:
+                        continue
+                    dist = d[_condensed_index_i(n, x, i)]
+                    if dist < current_min:
+                        current_min = dist
+                        y = i
+                if chain_length > 1 and y == chain[chain_length - 2]:
+                    break
+                chain[chain_length] = y
+                chain_length += 1
+            chain_length -= 2
+            if x > y:
+                x, y = y, x
+            nx = size[x]
+            ny = size[y]
+            z[k, 0] = x
+            z[k, 1] = y
+            z[k, 2] = current_min
+            z[k, 3] = nx + ny
+            size[x] = 0
+            size[y] = nx + ny
+            for i in range(n):
+                ni = size[i]
+                if ni == 0 or i == y:
+                    continue
+                d_xi = d[_condensed_index_i(n, i, x)]
+                d_yi = d[_condensed_index_i(n, i, y)]
+                if method == 0:
+                    v = min(d_xi, d_yi)
+                elif method == 1:
+                    v = max(d_xi, d_yi)
+                elif method == 2:
+                    v = (nx * d_xi + ny * d_yi) / (nx + ny)
+                else:
+                    v = 0.5 * (d_xi + d_yi)
+                d[_condensed_index_i(n, i, y)] = v
+
+
+@contextmanager
+def condensed_memmap(n: int, dir: Optional[str] = None) -> Iterator[np.ndarray]:
+    """Condensed distance vector of `n` documents, filled with NaN, in a memory-mapped temporary file in `dir`.
+    The file is removed on exit.
+    """
+    fd, path = tempfile.mkstemp(prefix="dendro_text-", suffix=".linkage", dir=dir)
+    os.close(fd)
+    try:
+        d = np.memmap(path, dtype=np.float64, mode="w+", shape=(n * (n - 1) // 2,))
+        d[:] = np.nan
+        yield d
+        d.flush()
+        del d
+    finally:
+        os.remove(path)
+
+
+def nn_chain_linkage(
+    darr: np.ndarray,
+    n: int,
+    method: str = "average",
+    use_numba: bool = True,
+    dir: Optional[str] = None,
+    in_place: bool = False,
+) -> np.ndarray:
+    """Linkage matrix of `method` by the nearest-neighbor chain algorithm. With `in_place`, `darr` (e.g. from
+    `condensed_memmap()`) is overwritten; otherwise it is not modified and the working copy is a memory-mapped
+    temporary file in `dir`.
+    """
+    if method not in _METHOD_CODES:
+        raise ValueError("unknown linkage method: %s" % method)
+    assert darr.shape == (n * (n - 1) // 2,)
+    z = np.zeros((max(0, n - 1), 4), dtype=np.float64)
+    if n <= 1:
+        return z
+    if in_place:
+        _nn_chain(darr, n, method, use_numba, z)
+    else:
+        with condensed_memmap(n, dir=dir) as d:
+            d[:] = darr
+            _nn_chain(d, n, method, use_numba, z)
+    return _label(z, n)
+
+
+def _nn_chain(d: np.ndarray, n: int, method: str, use_numba: bool, z: np.ndarray) -> None:
+    if use_numba and _nn_chain_i is not None:
+        _nn_chain_i(d, n, _METHOD_CODES[method], z)
+    else:
+        _nn_chain_numpy(d, n, _METHOD_CODES[method], z)
+
+
+def knn_mst_linkage(n: int, graph: KnnGraph) -> np.ndarray:
+    """Single linkage from the minimum spanning forest of the (symmetrized) kNN graph, by Kruskal's algorithm."""
+    if n <= 1:
+        return np.zeros((0, 4), dtype=np.float64)
+    a = np.minimum(graph.sources, graph.targets).astype(np.int64)
+    b = np.maximum(graph.sources, graph.targets).astype(np.int64)
+    order = np.lexsort((b, a, graph.distances))
+    parent = list(range(n))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    merges: List[Tuple[int, int, float]] = []
+    for x, y, dist in zip(a[order].tolist(), b[order].tolist(), graph.distances[order].tolist()):
+        rx, ry = find(x), find(y)
+        if rx != ry:
+            parent[max(rx, ry)] = min(rx, ry)
+            merges.append((x, y, dist))
+    if len(merges) < n - 1:
+        # join the groups not connected by the graph, in the order of their first documents
+        far = (float(graph.distances.max()) if len(graph.distances) else 0.0) + 1.0
+        roots = sorted(set(find(x) for x in range(n)))
+        for r in roots[1:]:
+            merges.append((roots[0], r, far))
+    z = np.zeros((n - 1, 4), dtype=np.float64)
+    z[:, :3] = np.array(merges, dtype=np.float64)
+    return _label(z, n)
+
+
+def select_linkage_function(
+    method: str = "average", engine: str = "scipy", use_numba: bool = True, in_place: bool = False
+) -> Optional[LinkageFunction]:
+    """Return the function computing the linkage matrix from a condensed distance vector and the number of
+    documents, or None for the engine knn-mst, which does not use the distance vector. With `in_place`, the
+    engine nn-chain overwrites the distance vector instead of working on a copy.
+    Raises ValueError for an unknown or unsupported combination.
+    """
+    if method not in LINKAGE_METHODS:
+        raise ValueError("unknown linkage method: %s" % method)
+    if engine == "scipy":
+
+        def scipy_linkage(darr: np.ndarray, n: int) -> np.ndarray:
+            from scipy.cluster.hierarchy import linkage
+
+            return linkage(darr, method=method)
+
+        return scipy_linkage
+    if engine == "nn-chain":
+
+        def nn_chain(darr: np.ndarray, n: int) -> np.ndarray:
+            return nn_chain_linkage(darr, n, method, use_numba=use_numba, in_place=in_place)
+
+        return nn_chain
+    if engine == "knn-mst":
+        if method != "single":
+            raise ValueError("the linkage engine knn-mst computes only single linkage")
+        return None
+    raise ValueError("unknown linkage engine: %s" % engine)
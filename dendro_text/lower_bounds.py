@@ -0,0 +1,114 @@
+from dataclasses import dataclass
+from typing import List, Sequence
+
+import numpy as np
+
+# Cheap lower bounds of the Levenshtein distance, used to skip exact distance calculations of far candidates.
+#
+# * length: an edit changes the length by at most one.
+# * token histogram: an edit removes at most one token and adds at most one token, so the distance is at least
+#   max(|A - B|, |B - A|) of the token multisets A and B, i.e. (L1 + length difference) / 2.
+# * q-gram profile: an edit changes at most q q-grams on each side, so the distance is at least
+#   (L1 of the q-gram profiles) / (2 q).
+
+QGRAM_SIZE = 2
+
+
+@dataclass(frozen=True)
+class DocSignature:
+    length: int
+    token_keys: np.ndarray  # sorted unique token ids
+    token_counts: np.ndarray
+    qgram_keys: np.ndarray  # sorted unique q-grams, packed into int64
+    qgram_counts: np.ndarray
+
+
+def _histogram(keys: np.ndarray):
+    return np.unique(keys, return_counts=True)
+
+
+def _qgram_keys(idoc: np.ndarray) -> np.ndarray:
+    assert QGRAM_SIZE == 2
+    if len(idoc) < QGRAM_SIZE:
+        return np.zeros(0, dtype=np.int64)
+    return (idoc[:-1].astype(np.int64) << 32) | idoc[1:].astype(np.int64)
+
+
+def compute_signature(idoc: Sequence[int]) -> DocSignature:
+    a = np.asarray(idoc, dtype=np.int64)
+    token_keys, token_counts = _histogram(a)
+    qgram_keys, qgram_counts = _histogram(_qgram_keys(a))
+    return DocSignature(len(a), token_keys, token_counts, qgram_keys, qgram_counts)
+
+
+def compute_signatures(idocs: Sequence[Sequence[int]]) -> List[DocSignature]:
+    return [compute_signature(idoc) for idoc in idocs]
+
+
+def _sparse_l1(keys1: np.ndarray, counts1: np.ndarray, keys2: np.ndarray, counts2: np.ndarray) -> int:
+    _common, i1, i2 = np.intersect1d(keys1, keys2, assume_unique=True, return_indices=True)
+    common_count = int(np.minimum(counts1[i1], counts2[i2]).sum())
+    return int(counts1.sum()) + int(counts2.sum()) - 2 * common_count
+
+
+def lower_bound(sig1: DocSignature, sig2: DocSignature) -> int:
+    """A lower bound of the Levenshtein distance between the documents of the signatures."""
+    length_diff = abs(sig1.length - sig2.length)
+    token_l1 = _sparse_l1(sig1.token_keys, sig1.token_counts, sig2.token_keys, sig2.token_counts)
+    qgram_l1 = _sparse_l1(sig1.qgram_keys, sig1.qgram_counts, sig2.qgram_keys, sig2.qgram_counts)
+    histogram_bound = (token_l1 + length_diff) // 2
+    qgram_bound = -(-qgram_l1 // (2 * QGRAM_SIZE))
+    return max(length_diff, histogram_bound, qgram_bound)
+
+
+class _PostingLists:
+    """Sparse profiles of documents, by key: the documents (rows) and counts of each key, sorted by key."""
+
+    def __init__(self, key_lists: Sequence[np.ndarray], count_lists: Sequence[np.ndarray]):
+        n = len(key_lists)
+        rows = np.repeat(np.arange(n, dtype=np.int64), [len(k) for k in key_lists])
+        keys = np.concatenate(key_lists).astype(np.int64) if n else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate(count_lists).astype(np.int64) if n else np.zeros(0, dtype=np.int64)
+        order = np.lexsort((rows, keys))
+        self.rows = rows[order]
+        self.counts = counts[order]
+        self.keys, self.starts = np.unique(keys[order], return_index=True)
+        self.ends = np.append(self.starts[1:], len(order)).astype(np.int64)
+        self.totals = np.bincount(rows, weights=counts, minlength=n).astype(np.int64)
+        self.doc_count = n
+
+    def l1(self, keys: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        """L1 distances between the profile (keys, counts) and the profiles of all the documents."""
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        pos = pos[found]
+        query_counts = counts[found]
+        seg_lens = self.ends[pos] - self.starts[pos]
+        # indices of the concatenated postings of the keys of the query
+        seg_offsets = np.cumsum(seg_lens) - seg_lens
+        idx = np.repeat(self.starts[pos] - seg_offsets, seg_lens) + np.arange(int(seg_lens.sum()))
+        common = np.minimum(self.counts[idx], np.repeat(query_counts, seg_lens))
+        common_sums = np.bincount(self.rows[idx], weights=common, minlength=self.doc_count).astype(np.int64)
+        return int(counts.sum()) + self.totals - 2 * common_sums
+
+
+class LowerBoundIndex:
+    """Signatures of a corpus arranged to compute `lower_bound()` from a query to all the documents at once."""
+
+    def __init__(self, signatures: Sequence[DocSignature]):
+        self.lengths = np.array([sig.length for sig in signatures], dtype=np.int64)
+        self.tokens = _PostingLists([sig.token_keys for sig in signatures], [sig.token_counts for sig in signatures])
+        self.qgrams = _PostingLists([sig.qgram_keys for sig in signatures], [sig.qgram_counts for sig in signatures])
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def lower_bounds(self, sig: DocSignature) -> np.ndarray:
+        """`lower_bound(sig, s)` for the signature `s` of each document."""
+        length_diff = np.abs(self.lengths - sig.length)
+        token_l1 = self.tokens.l1(sig.token_keys, sig.token_counts)
+        qgram_l1 = self.qgrams.l1(sig.qgram_keys, sig.qgram_counts)
+        histogram_bound = (token_l1 + length_diff) // 2
+        qgram_bound = -(-qgram_l1 // (2 * QGRAM_SIZE))
+        return np.maximum(np.maximum(length_diff, histogram_bound), qgram_bound)
@@ -1,8 +1,11 @@
-from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass
-from typing import Callable, List, Optional, Tuple, Union
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import argparse
+import functools
+import hashlib
 import os.path
 import sys
 import tempfile
@@ -11,12 +14,61 @@ from multiprocessing import Pool
 import numpy as np
 from tqdm import tqdm
 
-from .dld import distance_int_list, distance_int_list_python
+from .artifact import (
+    Checkpoint,
+    DendrogramArtifact,
+    ShardArtifact,
+    fill_from_artifact,
+    load_artifact,
+    load_checkpoint,
+    load_shard,
+    merge_shards,
+    save_artifact,
+    save_checkpoint,
+    save_shard,
+    shard_order,
+)
+from .cache import (
+    DEFAULT_DISTANCE_CACHE_SIZE,
+    DEFAULT_TOKEN_CACHE_SIZE,
+    DistanceCache,
+    TokenCache,
+    int_doc_digests,
+    token_cache_key,
+)
+from .dld import DISTANCE_ENGINES, DistanceFunction, distance_int_list, select_distance_function, to_int_arrays
+from .ingest import read_int_docs
+from .linkage import (
+    DEFAULT_LINKAGE_NEIGHBORS,
+    LINKAGE_ENGINES,
+    LINKAGE_METHODS,
+    LinkageFunction,
+    condensed_memmap,
+    knn_mst_linkage,
+    select_linkage_function,
+)
+from .lower_bounds import compute_signatures
+from .neighbors import DistanceMap, SearchStats, find_neighbors
+from .pairwise import (
+    ALL_PAIRS,
+    DEFAULT_CHECKPOINT_INTERVAL,
+    PeriodicCheckpoint,
+    calc_condensed_distances_threaded,
+    check_thread_backend,
+    condensed_index,
+    condensed_pairs,
+    condensed_size,
+    iter_condensed_pairs,
+    batch_pair_indices,
+    nan_pairs_cost,
+    schedule_cost_batches,
+    sliced_size,
+)
+from .shared_corpus import SharedCorpus, SharedCorpusHandle, attach_shared_corpus
 from .print_tree import print_tree, BOX_DRAWING_TREE_PICTURE_TABLE, BOX_DRAWING_TREE_PICTURE_TABLE_W_FULLWIDTH_SPACE
-from .ts import text_split, text_split_by_char_type
+from .ts import TokenizeStats, lexer_name, take_tokenize_stats, text_split, text_split_by_char_type
 from .commands import (
     DummyProgressBar,
-    convert_to_int_docs,
     pyplot_dendrogram,
     do_listing_pyplot_font_names,
     do_apply_preprocessors,
@@ -85,6 +137,10 @@ def _read_doc(filename: str, args, temp_dir) -> List[str]:
                 doc = inp.read()
             except Exception as e:
                 sys.exit("Error in reading a file: %s\n%s" % (repr(filename), e))
+    return _split_doc(doc, filename, args)
+
+
+def _split_doc(doc: str, filename: str, args) -> List[str]:
     if args.char_by_char:
         return [c for c in doc]
     if args.line_by_line:
@@ -101,6 +157,58 @@ def _iter_documents(files: List[str], args):
             yield filename, _read_doc(filename, args, temp_dir)
 
 
+def _token_cache_keys(files: List[str], args) -> List[str]:
+    mode = tokenization_mode(args)
+    prep = args.prep or []
+    keys = []
+    for filename in files:
+        try:
+            with open(filename, "rb") as inp:
+                content_digest = hashlib.sha1(inp.read()).hexdigest()
+        except OSError as e:
+            sys.exit("Error in reading a file: %s\n%s" % (repr(filename), e))
+        lexer = lexer_name(filename) if args.tokenize else ""
+        keys.append(token_cache_key(content_digest, mode, lexer, prep))
+    return keys
+
+
+def _read_int_docs(files: List[str], args) -> Tuple[List[List[int]], Dict[str, int]]:
+    """Read, tokenize, and intern the files in the workers of -j (see `ingest.read_int_docs()`), taking the files
+    found in the token cache from it.
+    """
+    temp_dir_context = tempfile.TemporaryDirectory() if args.prep else nullcontext(None)
+    cache_context = TokenCache(args.token_cache, args.token_cache_size) if args.token_cache else nullcontext(None)
+    stats = TokenizeStats()
+    with temp_dir_context as temp_dir, cache_context as token_cache:
+        cache_keys = _token_cache_keys(files, args) if token_cache is not None else None
+        read_doc = functools.partial(_read_doc, args=args, temp_dir=temp_dir)
+        pbar = tqdm(desc="Reading files", total=len(files), leave=False) if args.progress else DummyProgressBar()
+        try:
+            r = read_int_docs(
+                files,
+                read_doc,
+                workers=args.workers,
+                backend=args.parallel_backend,
+                pbar=pbar,
+                stats=stats,
+                token_cache=token_cache,
+                cache_keys=cache_keys,
+            )
+        finally:
+            pbar.close()
+        if token_cache is not None and args.stats:
+            print("> Stats: token cache: %s" % token_cache.format_stats(), file=sys.stderr)
+    _report_tokenize_stats(stats, args)
+    return r
+
+
+def _report_tokenize_stats(stats: TokenizeStats, args) -> None:
+    if stats.unknown_lexers:
+        print("> Warning: %s" % stats.format_unknown_lexers(), file=sys.stderr)
+    if args.stats and stats.files > 0:
+        print("> Stats: tokenize: %s" % stats.format(), file=sys.stderr)
+
+
 def merge_identical_idocs(idocs: List[List[int]], labels: List[LabelNode]) -> Tuple[List[List[int]], List[LabelNode]]:
     idocs = idocs[:]
     labels = labels[:]
@@ -137,81 +245,243 @@ def select_neighbors(
     labels: List[LabelNode],
     neighbors: int,
     progress: bool = False,
-    distance_function: Callable[[List[int], List[int]], int] = distance_int_list,
+    distance_function: DistanceFunction = distance_int_list,
+    stats: Optional[SearchStats] = None,
+    known_distances: Optional[Dict[int, int]] = None,
+    map_distances: Optional[DistanceMap] = None,
+    batch_size: int = 1,
 ) -> Tuple[List[List[int]], List[LabelNode]]:
-    idocs = idocs[:]
-    labels = labels[:]
-    dds: List[Tuple[int, int]] = [(0, 0)]
     pbar = tqdm(desc="Identifying neighbors", total=len(idocs) - 1, leave=False) if progress else DummyProgressBar()
-    for i in range(1, len(idocs)):
-        d = distance_function(idocs[0], idocs[i])
-        dds.append((d, i))
-        pbar.update(1)
+    signatures = compute_signatures(idocs)
+    dds = find_neighbors(
+        idocs,
+        neighbors,
+        distance_function=distance_function,
+        pbar=pbar,
+        signatures=signatures,
+        stats=stats,
+        known_distances=known_distances,
+        map_distances=map_distances,
+        batch_size=batch_size,
+    )
     pbar.close()
-    dds.sort()
-    dds = dds[: neighbors + 1]
     idocs = [idocs[i] for d, i in dds]
     labels = [labels[i] for d, i in dds]
     return idocs, labels
 
 
 _distance_worker_idocs: Optional[List[List[int]]] = None
-_distance_worker_function: Callable[[List[int], List[int]], int] = distance_int_list
+_distance_worker_function: DistanceFunction = distance_int_list
 
 
 def _init_distance_worker(
-    idocs: List[List[int]], distance_function: Callable[[List[int], List[int]], int]
+    idocs: List[List[int]], distance_function: DistanceFunction
 ) -> None:
     global _distance_worker_idocs, _distance_worker_function
     _distance_worker_idocs = idocs
     _distance_worker_function = distance_function
 
 
-def calc_dld(index_pair: Tuple[int, int]) -> Tuple[Tuple[int, int], int]:
-    i, j = index_pair
+def _init_shared_distance_worker(handle: SharedCorpusHandle, distance_function: DistanceFunction) -> None:
+    _init_distance_worker(attach_shared_corpus(handle), distance_function)
+
+
+def calc_dld_batch(ks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Calculate the distances of the pairs at the condensed indices `ks`. Returns (ks, distances)."""
+    assert _distance_worker_idocs is not None
+    idocs = _distance_worker_idocs
+    f = _distance_worker_function
+    iis, jjs = condensed_pairs(len(idocs), ks)
+    pairs = zip(iis.tolist(), jjs.tolist())
+    distances = np.fromiter((f(idocs[i], idocs[j]) for i, j in pairs), dtype=np.int64, count=len(ks))
+    return ks, distances
+
+
+def _query_distances(idocs, distance_function: DistanceFunction, indices: np.ndarray, max_dists: np.ndarray) -> List[int]:
+    """Distances from the first document to the documents `indices`, bounded by `max_dists` (negative for no bound)."""
+    q = idocs[0]
+    f = distance_function
+    return [f(q, idocs[i]) if m < 0 else f(q, idocs[i], m) for i, m in zip(indices.tolist(), max_dists.tolist())]
+
+
+def calc_query_distances(job: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    indices, max_dists = job
     assert _distance_worker_idocs is not None
-    return (i, j), _distance_worker_function(_distance_worker_idocs[i], _distance_worker_idocs[j])
+    ds = _query_distances(_distance_worker_idocs, _distance_worker_function, indices, max_dists)
+    return np.array(ds, dtype=np.int64)
+
+
+QUERY_BATCH_PER_WORKER = 16
+QUERY_CHUNKS_PER_WORKER = 4
+
+
+@contextmanager
+def open_query_distance_map(
+    idocs, workers=None, distance_function=distance_int_list, backend="process"
+) -> Iterator[Tuple[Optional[DistanceMap], int]]:
+    """Yield (map_distances, batch_size) for `find_neighbors()`, which calculates the distances from the first
+    document on the parallel backend. (None, 1) with a single worker.
+    """
+    if workers is None or workers <= 1 or len(idocs) <= 2:
+        yield None, 1
+        return
+
+    def split_job(indices: List[int], max_dists: List[Optional[int]]):
+        chunk_count = min(len(indices), workers * QUERY_CHUNKS_PER_WORKER)
+        bounds = np.array([-1 if m is None else m for m in max_dists], dtype=np.int64)
+        return zip(np.array_split(np.array(indices, dtype=np.int64), chunk_count), np.array_split(bounds, chunk_count))
+
+    batch_size = workers * QUERY_BATCH_PER_WORKER
+    if backend == "thread":
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+
+            def map_distances_threaded(indices: List[int], max_dists: List[Optional[int]]) -> List[int]:
+                def run(job: Tuple[np.ndarray, np.ndarray]) -> List[int]:
+                    return _query_distances(idocs, distance_function, job[0], job[1])
+
+                return [d for ds in executor.map(run, split_job(indices, max_dists)) for d in ds]
 
+            yield map_distances_threaded, batch_size
+        return
+
+    assert backend == "process"
+    with SharedCorpus(idocs) as corpus, Pool(
+        workers, initializer=_init_shared_distance_worker, initargs=(corpus.handle, distance_function)
+    ) as pool:
+
+        def map_distances(indices: List[int], max_dists: List[Optional[int]]) -> List[int]:
+            return [d for ds in pool.map(calc_query_distances, split_job(indices, max_dists)) for d in ds.tolist()]
+
+        yield map_distances, batch_size
+
+
+PARALLEL_BACKENDS = ("process", "thread")
+PROCESS_BATCHES_PER_WORKER = 32
+
+
+def calc_condensed_distances(
+    idocs,
+    progress=False,
+    workers=None,
+    distance_function=distance_int_list,
+    backend="process",
+    darr=None,
+    checkpoint=None,
+    pairs=ALL_PAIRS,
+) -> np.ndarray:
+    """Calculate the distances of all pairs of documents, as a condensed distance vector. With `pairs`, a slice
+    of the condensed indices, only the pairs of the slice are calculated, into a vector of them.
 
-def calc_dendrogram(idocs, progress=False, workers=None, distance_function=distance_int_list):
-    import scipy.spatial.distance as distance
-    from scipy.cluster.hierarchy import linkage
+    When `darr` is given, e.g. partly filled with cached distances, only its NaN items are calculated in place.
+    A `checkpoint` (`PeriodicCheckpoint`) saves the vector periodically, and when the calculation is aborted.
 
+    The process backend sends the pairs to the workers in batches of about the same cost, the most expensive
+    pairs first. The progress bar counts the costs (`pair_costs()`), not the pairs. The costs and the batches
+    are calculated row by row, so that the peak memory is about the condensed vector.
+    """
     if workers is None:
         workers = 1
 
     len_docs = len(idocs)
-    jobs = ((i, j) for i in range(len_docs) for j in range(len_docs) if i < j)
-    total_jobs = len_docs * (len_docs - 1) // 2
-    pbar = tqdm(desc="Building dendrogram", total=total_jobs, leave=False) if progress else DummyProgressBar()
-    dld_tbl = dict()
+    if darr is None:
+        darr = np.full(sliced_size(len_docs, pairs), np.nan, dtype=np.float64)
+    lengths = np.array([len(idoc) for idoc in idocs], dtype=np.int64)
+    total_cost = nan_pairs_cost(lengths, darr, pairs=pairs)
+    pbar = (
+        tqdm(desc="Building dendrogram", total=total_cost, unit="", unit_scale=True, leave=False)
+        if progress
+        else DummyProgressBar()
+    )
     try:
-        with Pool(workers, initializer=_init_distance_worker, initargs=(idocs, distance_function)) as pool:
-            for ij, v in pool.imap_unordered(calc_dld, jobs):
-                dld_tbl[ij] = v
-                pbar.update(1)
+        if backend == "thread":
+            return calc_condensed_distances_threaded(
+                idocs,
+                workers,
+                distance_function=distance_function,
+                pbar=pbar,
+                darr=darr,
+                checkpoint=checkpoint,
+                pairs=pairs,
+            )
+
+        assert backend == "process"
+        batches = schedule_cost_batches(
+            lengths, darr, max(1, workers) * PROCESS_BATCHES_PER_WORKER, total_cost=total_cost, pairs=pairs
+        )
+        if not batches:
+            return darr
+        batch_costs = dict((b.k_begin, b.cost) for b in batches)
+        start, _stop, step = pairs.indices(condensed_size(len_docs))
+        with SharedCorpus(idocs) as corpus, Pool(
+            workers, initializer=_init_shared_distance_worker, initargs=(corpus.handle, distance_function)
+        ) as pool:
+            # the indices of a batch are made when the pool takes it; the workers take condensed indices
+            tasks = (start + batch_pair_indices(darr, b) * step for b in batches)
+            for ks, distances in pool.imap_unordered(calc_dld_batch, tasks):
+                ts = (ks - start) // step
+                darr[ts] = distances
+                pbar.update(batch_costs[int(ts[0])])
+                if checkpoint is not None:
+                    checkpoint.tick(darr)
+        return darr
     except KeyboardInterrupt:
         print("\nWarning: Distance calculation interrupted.", file=sys.stderr)
+        if checkpoint is not None and backend != "thread":  # the thread backend saves it before joining
+            checkpoint.flush(darr)
+        raise
+    except Exception:
+        if checkpoint is not None and backend != "thread":
+            checkpoint.flush(darr)
         raise
     finally:
         pbar.close()
 
-    dmat = np.zeros([len_docs, len_docs])
-    for i in range(len_docs):
-        for j in range(len_docs):
-            if i < j:
-                dmat[i, j] = dld_tbl[(i, j)]
-            elif i == j:
-                dmat[i, j] = 0
-            else:
-                assert i > j
-                dmat[i, j] = dld_tbl[(j, i)]
-    darr = distance.squareform(dmat)
-    result = linkage(darr, method="average")
+
+def calc_dendrogram(
+    idocs,
+    progress=False,
+    workers=None,
+    distance_function=distance_int_list,
+    backend="process",
+    darr=None,
+    previous=None,
+    digests=None,
+    checkpoint=None,
+    linkage_function=None,
+):
+    """Calculate the linkage of dendrogram.
+
+    `darr` is a condensed distance vector to be filled in place, in which non-NaN items are reused. With a
+    `previous` artifact and the content hashes `digests` of `idocs`, the distances of the documents found in the
+    previous artifact are reused, so that only the pairs including new or changed documents are calculated.
+    `checkpoint` is passed to `calc_condensed_distances()`. `linkage_function` (see `select_linkage_function()`)
+    computes the linkage from the distances (default: average linkage of SciPy).
+    """
+    if previous is not None:
+        assert digests is not None
+        if darr is None:
+            darr = np.full(condensed_size(len(idocs)), np.nan, dtype=np.float64)
+        fill_from_artifact(darr, digests, previous)
+    darr = calc_condensed_distances(
+        idocs,
+        progress=progress,
+        workers=workers,
+        distance_function=distance_function,
+        backend=backend,
+        darr=darr,
+        checkpoint=checkpoint,
+    )
+    if linkage_function is None:
+        linkage_function = select_linkage_function()
+    result = linkage_function(darr, len(idocs))
     return result
 
 
 def print_dendrogram(result, labels, format_leaf_node, max_depth=None, tree_picture_table=None):
+    if isinstance(result, DendrogramArtifact):
+        if labels is None:
+            labels = [LabelNode(*items) for items in result.labels]
+        result = result.linkage
     index_to_node = labels[:]
     n = None
     for li in result:
@@ -227,6 +497,18 @@ def print_dendrogram(result, labels, format_leaf_node, max_depth=None, tree_pict
     )
 
 
+def parse_shard(s: str) -> Tuple[int, int]:
+    """Parse a shard designation `K/N` (1 <= K <= N)."""
+    try:
+        k_str, n_str = s.split("/")
+        k, n = int(k_str), int(n_str)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid shard: %s (expected K/N)" % repr(s))
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError("invalid shard: %s (expected 1 <= K <= N)" % repr(s))
+    return k, n
+
+
 def gen_parser():
     parser = argparse.ArgumentParser(
         description="Draw dendrogram of similarity among text files."
@@ -256,6 +538,34 @@ def gen_parser():
         '--no-numba', action='store_true',
         help='Use the pure-Python distance implementation instead of Numba.'
     )
+    parser.add_argument(
+        '--distance-engine', choices=DISTANCE_ENGINES,
+        help='Algorithm of distance calculation (default: bitparallel, or dp with --no-numba).'
+    )
+    parser.add_argument(
+        '--approx', action='store_true',
+        help='Draw dendrogram from distances estimated by MinHash sketches of token shingles, instead of edit distances.'
+    )
+    parser.add_argument(
+        '--refine', type=int, metavar='K',
+        help='Two-phase mode (implies --approx). Calculate the exact distances of each file and its K nearest files by the estimates.'
+    )
+    parser.add_argument(
+        '--refine-threshold', type=float, metavar='D',
+        help='Two-phase mode (implies --approx). Calculate the exact distances of the pairs whose estimated distances are D or less.'
+    )
+    parser.add_argument(
+        '--linkage-method', choices=LINKAGE_METHODS,
+        help='Linkage method of dendrogram (default: average, or single with --linkage-engine knn-mst).'
+    )
+    parser.add_argument(
+        '--linkage-engine', choices=LINKAGE_ENGINES, default='scipy',
+        help='Algorithm of linkage: scipy, nn-chain (in place over the distances in a memory-mapped file), or knn-mst (single linkage over a kNN graph, without the distance matrix; implies --linkage-method single) (default: scipy).'
+    )
+    parser.add_argument(
+        '--linkage-neighbors', type=int, metavar='K',
+        help='Number of neighbors of each file in the kNN graph of --linkage-engine knn-mst (default: %d).' % DEFAULT_LINKAGE_NEIGHBORS
+    )
 
     # Other options
     parser.add_argument(
@@ -296,7 +606,11 @@ def gen_parser():
     )
     parser.add_argument(
         '-j', '--workers', type=int, metavar='NUM',
-        help='Parallel execution. Number of worker processes.'
+        help='Parallel execution. Number of worker processes (or threads).'
+    )
+    parser.add_argument(
+        '--parallel-backend', choices=PARALLEL_BACKENDS, default='process',
+        help='Run the distance calculation of dendrogram in worker processes, or in threads of a Numba kernel (default: process).'
     )
     parser.add_argument(
         '--progress', action='store_true',
@@ -310,6 +624,74 @@ def gen_parser():
         '-N', '--neighbor-list', type=int, metavar='NUM',
         help='List NUM neighbors of the first file, in order of increasing distance. `0` for +inf.'
     )
+    parser.add_argument(
+        '--distance-cache', metavar='FILE',
+        help='Reuse distances across runs, stored in an on-disk cache (SQLite) keyed by the contents of files.'
+    )
+    parser.add_argument(
+        '--distance-cache-size', type=int, metavar='NUM', default=DEFAULT_DISTANCE_CACHE_SIZE,
+        help='Maximum number of entries of the distance cache (default: %d).' % DEFAULT_DISTANCE_CACHE_SIZE
+    )
+    parser.add_argument(
+        '--token-cache', metavar='FILE',
+        help='Reuse tokenized files across runs, stored in an on-disk cache (SQLite) keyed by the contents of files.'
+    )
+    parser.add_argument(
+        '--token-cache-size', type=int, metavar='NUM', default=DEFAULT_TOKEN_CACHE_SIZE,
+        help='Maximum number of files of the token cache (default: %d).' % DEFAULT_TOKEN_CACHE_SIZE
+    )
+    parser.add_argument(
+        '--save-matrix', metavar='FILE',
+        help='Save the distance matrix, the file names, and the linkage of dendrogram into FILE (.npz).'
+    )
+    parser.add_argument(
+        '--load-matrix', metavar='FILE',
+        help='Draw the dendrogram saved by --save-matrix, without reading any input files.'
+    )
+    parser.add_argument(
+        '--reuse-matrix', metavar='FILE',
+        help='Reuse the distances saved by --save-matrix for the files whose contents are unchanged.'
+    )
+    parser.add_argument(
+        '--shard', type=parse_shard, metavar='K/N',
+        help='Calculate only the K-th of N slices of the pairs of files, and save it into the file of --save-matrix.'
+    )
+    parser.add_argument(
+        '--merge-shards', action='store_true',
+        help='Draw the dendrogram from the shard files (given as input files) saved by --shard.'
+    )
+    parser.add_argument(
+        '--checkpoint', metavar='FILE',
+        help='Save the distances calculated so far into FILE periodically and on interruption (removed on completion).'
+    )
+    parser.add_argument(
+        '--checkpoint-interval', type=float, metavar='SEC', default=DEFAULT_CHECKPOINT_INTERVAL,
+        help='Interval of saving the checkpoint (default: %g seconds).' % DEFAULT_CHECKPOINT_INTERVAL
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='Continue the calculation from the file of --checkpoint, if it exists.'
+    )
+    parser.add_argument(
+        '--knn-graph', type=int, metavar='K',
+        help='Find the K (>=1) nearest neighbors of every file, and write the edges as CSV.'
+    )
+    parser.add_argument(
+        '--knn-output', metavar='FILE',
+        help='Write the edges of --knn-graph into FILE (.npz for NumPy arrays, otherwise CSV) instead of stdout.'
+    )
+    parser.add_argument(
+        '--serve', action='store_true',
+        help='Server mode. Read the input files as a corpus, and answer neighbor queries in JSON lines from stdin.'
+    )
+    parser.add_argument(
+        '--socket', metavar='FILE',
+        help='Answer the queries of server mode on the Unix socket FILE, instead of stdin.'
+    )
+    parser.add_argument(
+        '--stats', action='store_true',
+        help='Show statistics of the calculation, e.g. the number of distance calculations.'
+    )
     parser.add_argument(
         '-p', '--pyplot', action='store_true',
         help='Plot dendrogram with `matplotlib.pyplot`.'
@@ -330,31 +712,115 @@ def gen_parser():
     return parser
 
 
+def tokenization_mode(args) -> str:
+    if args.char_by_char:
+        return "char"
+    if args.line_by_line:
+        return "line"
+    if args.tokenize:
+        return "tokenize"
+    return "char-type"
+
+
+def _open_distance_cache(args):
+    if not args.distance_cache:
+        return nullcontext(None)
+    return DistanceCache(args.distance_cache, max_entries=args.distance_cache_size)
+
+
+def _lookup_query_distances(cache: Optional[DistanceCache], digests, mode: str) -> Optional[Dict[int, int]]:
+    if cache is None:
+        return None
+    return cache.lookup_query(digests, 0, mode)
+
+
+def _store_query_distances(
+    cache: Optional[DistanceCache], digests, mode: str, known: Optional[Dict[int, int]], cached_indices
+) -> None:
+    if cache is None:
+        return
+    assert known is not None
+    cache.store(((digests[0], digests[i], d) for i, d in known.items() if i not in cached_indices), mode)
+
+
 def _run_dendrogram_mode(
-    docs: List[List[str]],
+    idocs: List[List[int]],
+    word_to_index: Dict[str, int],
     labels: List[LabelNode],
     args,
     format_leaf_node: Callable[[LabelNode], str],
     tree_picture_table,
-    distance_function: Callable[[List[int], List[int]], int],
+    distance_function: DistanceFunction,
 ) -> None:
-    idocs, _word_to_index = convert_to_int_docs(docs)
+    mode = tokenization_mode(args)
+
+    with _open_distance_cache(args) as cache:
+        _run_dendrogram_mode_i(
+            idocs, word_to_index, labels, args, format_leaf_node, tree_picture_table, distance_function, cache, mode
+        )
+        if cache is not None and args.stats:
+            print("> Stats: distance cache: %s" % cache.format_stats(), file=sys.stderr)
+
 
+def _run_dendrogram_mode_i(
+    idocs: List[List[int]],
+    word_to_index: Dict[str, int],
+    labels: List[LabelNode],
+    args,
+    format_leaf_node: Callable[[LabelNode], str],
+    tree_picture_table,
+    distance_function: DistanceFunction,
+    cache: Optional[DistanceCache],
+    mode: str,
+) -> None:
     if args.neighbor_list is not None and args.neighbor_list != -1:
         label_strs = [label.format() for label in labels]
-        do_listing_in_order_of_increasing_distance(
-            label_strs,
-            idocs,
-            neighbors=args.neighbor_list,
-            separator=args.field_separator or LABEL_HEADER,
-            progress=args.progress,
-            distance_function=distance_function,
-        )
+        stats = SearchStats()
+        digests = int_doc_digests(idocs, word_to_index) if cache is not None else None
+        known = _lookup_query_distances(cache, digests, mode)
+        cached_indices = set(known) if known is not None else set()
+        idocs = to_int_arrays(idocs)
+        with open_query_distance_map(idocs, args.workers, distance_function, args.parallel_backend) as (
+            map_distances,
+            batch_size,
+        ):
+            do_listing_in_order_of_increasing_distance(
+                label_strs,
+                idocs,
+                neighbors=args.neighbor_list,
+                separator=args.field_separator or LABEL_HEADER,
+                progress=args.progress,
+                distance_function=distance_function,
+                stats=stats,
+                known_distances=known,
+                map_distances=map_distances,
+                batch_size=batch_size,
+            )
+        _store_query_distances(cache, digests, mode, known, cached_indices)
+        if args.stats:
+            print("> Stats: neighbor search: %s" % stats.format(), file=sys.stderr)
         return
 
     idocs, labels = merge_identical_idocs(idocs, labels)
+    idocs = to_int_arrays(idocs)
+
+    if args.shard:
+        _run_shard(idocs, int_doc_digests(idocs, word_to_index), labels, args, distance_function, cache, mode)
+        return
 
+    need_digests = cache is not None or bool(args.save_matrix) or bool(args.reuse_matrix) or bool(args.checkpoint)
     if len(idocs) <= 1:
+        if args.save_matrix:
+            save_artifact(
+                args.save_matrix,
+                DendrogramArtifact(
+                    labels=[label.items for label in labels],
+                    distances=np.zeros(0),
+                    linkage=np.zeros((0, 4)),
+                    digests=int_doc_digests(idocs, word_to_index),
+                    mode=mode,
+                ),
+            )
         if args.pyplot:
             print("All documents are equivalent to each other.")
         else:
@@ -362,21 +828,443 @@ def _run_dendrogram_mode(
             print_tree(root_node, extract_child_nodes, format_leaf_node, tree_picture_table=tree_picture_table)
         return
 
+    digests = int_doc_digests(idocs, word_to_index) if need_digests else None
     if args.neighbors is not None and args.neighbors > 0 and len(idocs) > args.neighbors + 1:
-        idocs, labels = select_neighbors(
-            idocs, labels, args.neighbors, progress=args.progress, distance_function=distance_function
+        stats = SearchStats()
+        known = _lookup_query_distances(cache, digests, mode)
+        cached_indices = set(known) if known is not None else set()
+        with open_query_distance_map(idocs, args.workers, distance_function, args.parallel_backend) as (
+            map_distances,
+            batch_size,
+        ):
+            idocs, labels = select_neighbors(
+                idocs,
+                labels,
+                args.neighbors,
+                progress=args.progress,
+                distance_function=distance_function,
+                stats=stats,
+                known_distances=known,
+                map_distances=map_distances,
+                batch_size=batch_size,
+            )
+        _store_query_distances(cache, digests, mode, known, cached_indices)
+        if args.stats:
+            print("> Stats: neighbor search: %s" % stats.format(), file=sys.stderr)
+        digests = int_doc_digests(idocs, word_to_index) if need_digests else None
+
+    if args.linkage_engine == "knn-mst":
+        _run_knn_mst_linkage(idocs, labels, args, format_leaf_node, tree_picture_table, distance_function, mode)
+        return
+    if args.approx:
+        _run_approx_dendrogram(
+            idocs, labels, digests, args, format_leaf_node, tree_picture_table, distance_function, mode
+        )
+        return
+
+    len_docs = len(idocs)
+    # nn-chain merges in place in the memory-mapped distance vector, unless the distances are saved
+    in_place = args.linkage_engine == "nn-chain" and not args.save_matrix
+    if in_place:
+        darr_context = condensed_memmap(len_docs)
+    else:
+        darr_context = nullcontext(np.full(condensed_size(len_docs), np.nan, dtype=np.float64))
+    with darr_context as darr:
+        _prefill_distances(darr, digests, args, cache, mode)
+        todo = np.isnan(darr) if cache is not None else None  # the pairs to store into the cache
+        checkpoint = _resume_and_open_checkpoint(darr, digests, args, mode, "all")
+        calc_condensed_distances(
+            idocs,
+            progress=args.progress,
+            workers=args.workers,
+            distance_function=distance_function,
+            backend=args.parallel_backend,
+            darr=darr,
+            checkpoint=checkpoint,
+        )
+        _store_pair_distances(cache, darr, digests, todo, mode)
+        result = _linkage_function(args, in_place)(darr, len_docs)
+        _remove_checkpoint(args)
+
+        artifact = DendrogramArtifact(
+            labels=[label.items for label in labels],
+            distances=darr,
+            linkage=result,
+            digests=digests if digests is not None else [],
+            mode=mode,
+        )
+        if args.save_matrix:
+            save_artifact(args.save_matrix, artifact)
+    _render_dendrogram(artifact, args, format_leaf_node, tree_picture_table)
+
+
+def _linkage_function(args, in_place: bool = False) -> LinkageFunction:
+    linkage_function = select_linkage_function(
+        args.linkage_method, args.linkage_engine, use_numba=not args.no_numba, in_place=in_place
+    )
+    assert linkage_function is not None
+    return linkage_function
+
+
+def _run_knn_mst_linkage(
+    idocs: List[np.ndarray],
+    labels: List[LabelNode],
+    args,
+    format_leaf_node: Callable[[LabelNode], str],
+    tree_picture_table,
+    distance_function: DistanceFunction,
+    mode: str,
+) -> None:
+    from .knn import build_knn_graph
+
+    stats = SearchStats()
+    k = min(args.linkage_neighbors, len(idocs) - 1)
+    pbar = tqdm(desc="Building kNN graph", total=len(idocs), leave=False) if args.progress else DummyProgressBar()
+    try:
+        graph = build_knn_graph(
+            idocs,
+            k,
+            distance_function=distance_function,
+            workers=args.workers,
+            backend=args.parallel_backend,
+            pbar=pbar,
+            stats=stats,
         )
+    finally:
+        pbar.close()
+    if args.stats:
+        print("> Stats: kNN graph: %s" % stats.format(), file=sys.stderr)
+    artifact = DendrogramArtifact(
+        labels=[label.items for label in labels],
+        distances=np.zeros(0),
+        linkage=knn_mst_linkage(len(idocs), graph),
+        digests=[],
+        mode=mode,
+    )
+    _render_dendrogram(artifact, args, format_leaf_node, tree_picture_table)
+
+
+def _run_approx_dendrogram(
+    idocs: List[np.ndarray],
+    labels: List[LabelNode],
+    digests,
+    args,
+    format_leaf_node: Callable[[LabelNode], str],
+    tree_picture_table,
+    distance_function: DistanceFunction,
+    mode: str,
+) -> None:
+    from .sketch import (
+        approx_condensed_distances,
+        calibrate_estimates,
+        compute_sketches,
+        measure_accuracy,
+        refine_pair_indices,
+        sample_exact_distances,
+    )
+
+    sketches = compute_sketches(idocs)
+    pbar = (
+        tqdm(desc="Estimating distances", total=condensed_size(len(idocs)), leave=False)
+        if args.progress
+        else DummyProgressBar()
+    )
+    try:
+        darr = approx_condensed_distances(sketches, pbar=pbar)
+    finally:
+        pbar.close()
+    sampled, sampled_exact = sample_exact_distances(idocs, distance_function)
+    accuracy = measure_accuracy(darr[sampled], sampled_exact)
+    if accuracy is not None:
+        print("> Approx: %s" % accuracy.format(), file=sys.stderr)
+
+    if args.refine is not None or args.refine_threshold is not None:
+        # the exact distances of the refined and the sampled pairs replace the estimates, and the other estimates
+        # are calibrated to the scale of the exact distances, so that they can be mixed in a linkage
+        ks = refine_pair_indices(darr, len(idocs), args.refine or 0, args.refine_threshold)
+        ks = ks[~np.isin(ks, sampled)]
+        refined_estimates = darr[ks]
+        darr[ks] = np.nan
+        calc_condensed_distances(
+            idocs,
+            progress=args.progress,
+            workers=args.workers,
+            distance_function=distance_function,
+            backend=args.parallel_backend,
+            darr=darr,
+        )
+        refined_exact = darr[ks]
+        darr[:] = calibrate_estimates(
+            darr,
+            np.concatenate([darr[sampled], refined_estimates]),
+            np.concatenate([sampled_exact, refined_exact]),
+        )
+        darr[ks] = refined_exact
+        darr[sampled] = sampled_exact
+        exact_calls = len(ks) + len(sampled)
+        print(
+            "> Refine: %d exact distance calculations of %d pairs (%.2f%%)"
+            % (exact_calls, len(darr), 100.0 * exact_calls / max(1, len(darr))),
+            file=sys.stderr,
+        )
+
+    artifact = DendrogramArtifact(
+        labels=[label.items for label in labels],
+        distances=darr,
+        linkage=_linkage_function(args)(darr, len(idocs)),
+        digests=digests if digests is not None else [],
+        mode=mode + ":approx",
+    )
+    if args.save_matrix:
+        save_artifact(args.save_matrix, artifact)
+    _render_dendrogram(artifact, args, format_leaf_node, tree_picture_table)
+
+
+def _prefill_distances(
+    darr: np.ndarray, digests, args, cache: Optional[DistanceCache], mode: str, pairs: slice = ALL_PAIRS
+) -> None:
+    """Fill `darr`, the condensed vector or a vector of `pairs`, with the distances found in --reuse-matrix and
+    the distance cache.
+    """
+    if args.reuse_matrix:
+        previous = _load_artifact_or_exit(args.reuse_matrix)
+        if previous.mode != mode:
+            sys.exit(
+                "Error: The matrix file %s was made in another tokenization mode: %s"
+                % (repr(args.reuse_matrix), previous.mode)
+            )
+        reused = fill_from_artifact(darr, digests, previous, pairs)
+        if args.stats:
+            print("> Stats: reused matrix: %d of %d pairs" % (reused, len(darr)), file=sys.stderr)
+    if cache is not None:
+        len_docs = len(digests)
+        start, _stop, step = pairs.indices(condensed_size(len_docs))
+        for i, j, d in cache.lookup_pairs(digests, mode):
+            t, r = divmod(condensed_index(len_docs, i, j) - start, step)
+            if t >= 0 and r == 0:
+                darr[t] = d
+
+
+def _resume_and_open_checkpoint(
+    darr: np.ndarray, digests, args, mode: str, scope: str
+) -> Optional[PeriodicCheckpoint]:
+    """With --resume, fill `darr` with the distances of the checkpoint file, if it exists. Returns the
+    checkpoint to be saved during the calculation, or None without --checkpoint.
+    """
+    if not args.checkpoint:
+        return None
+    if args.resume and os.path.exists(args.checkpoint):
+        try:
+            previous = load_checkpoint(args.checkpoint)
+        except (OSError, ValueError) as e:
+            sys.exit("Error in loading a checkpoint file: %s\n%s" % (repr(args.checkpoint), e))
+        if not previous.matches(digests, mode, scope) or previous.distances.shape != darr.shape:
+            sys.exit(
+                "Error: The checkpoint file %s was made from other files, tokenization mode, or shard."
+                % repr(args.checkpoint)
+            )
+        found = ~np.isnan(previous.distances)
+        darr[found] = previous.distances[found]
+        if args.stats:
+            print(
+                "> Stats: resumed checkpoint: %d of %d pairs" % (int(np.count_nonzero(found)), len(darr)),
+                file=sys.stderr,
+            )
+
+    def save(a: np.ndarray) -> None:
+        save_checkpoint(args.checkpoint, Checkpoint(digests=list(digests), mode=mode, scope=scope, distances=a))
+
+    return PeriodicCheckpoint(save, interval=args.checkpoint_interval)
+
+
+def _remove_checkpoint(args) -> None:
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+
+def _store_pair_distances(
+    cache: Optional[DistanceCache],
+    darr: np.ndarray,
+    digests,
+    todo: Optional[np.ndarray],
+    mode: str,
+    pairs: slice = ALL_PAIRS,
+) -> None:
+    if cache is None:
+        return
+    assert todo is not None
+    items = iter_condensed_pairs(len(digests), todo, pairs)
+    cache.store(((digests[i], digests[j], darr[t]) for t, i, j in items), mode)
 
-    result = calc_dendrogram(
-        idocs, progress=args.progress, workers=args.workers, distance_function=distance_function
+
+def _run_shard(
+    idocs: List[np.ndarray],
+    digests: List[str],
+    labels: List[LabelNode],
+    args,
+    distance_function: DistanceFunction,
+    cache: Optional[DistanceCache],
+    mode: str,
+) -> None:
+    """Calculate the pairs of the shard --shard K/N and write them into the file of --save-matrix."""
+    shard, shard_count = args.shard
+    order = shard_order(digests)
+    idocs = [idocs[p] for p in order]
+    labels = [labels[p] for p in order]
+    digests = [digests[p] for p in order]
+
+    # only the vector of the pairs of the shard is allocated
+    pairs = slice(shard - 1, None, shard_count)
+    darr = np.full(sliced_size(len(idocs), pairs), np.nan, dtype=np.float64)
+    _prefill_distances(darr, digests, args, cache, mode, pairs)
+    todo = np.isnan(darr) if cache is not None else None  # the pairs to store into the cache
+    checkpoint = _resume_and_open_checkpoint(darr, digests, args, mode, "%d/%d" % (shard, shard_count))
+    calc_condensed_distances(
+        idocs,
+        progress=args.progress,
+        workers=args.workers,
+        distance_function=distance_function,
+        backend=args.parallel_backend,
+        darr=darr,
+        checkpoint=checkpoint,
+        pairs=pairs,
     )
+    _store_pair_distances(cache, darr, digests, todo, mode, pairs)
+
+    save_shard(
+        args.save_matrix,
+        ShardArtifact(
+            labels=[label.items for label in labels],
+            digests=digests,
+            mode=mode,
+            shard=shard,
+            shard_count=shard_count,
+            distances=darr,
+            positions=np.array(order, dtype=np.int64),
+        ),
+    )
+    _remove_checkpoint(args)
+    if args.stats:
+        pair_count = condensed_size(len(idocs))
+        print("> Stats: shard %d/%d: %d of %d pairs" % (shard, shard_count, len(darr), pair_count), file=sys.stderr)
+
+
+def _run_merge_shards_mode(args, format_leaf_node: Callable[[LabelNode], str], tree_picture_table) -> None:
+    shards = []
+    for path in args.files:
+        try:
+            shards.append(load_shard(path))
+        except (OSError, ValueError) as e:
+            sys.exit("Error in loading a shard file: %s\n%s" % (repr(path), e))
+    try:
+        labels, digests, mode, darr = merge_shards(shards)
+    except ValueError as e:
+        sys.exit("Error: Option --merge-shards: %s." % e)
+
+    artifact = DendrogramArtifact(
+        labels=labels,
+        distances=darr,
+        linkage=_linkage_function(args)(darr, len(labels)) if len(labels) > 1 else np.zeros((0, 4)),
+        digests=digests,
+        mode=mode,
+    )
+    if args.save_matrix:
+        save_artifact(args.save_matrix, artifact)
+    _render_artifact(artifact, args, format_leaf_node, tree_picture_table)
+
+
+def _render_artifact(
+    artifact: DendrogramArtifact, args, format_leaf_node: Callable[[LabelNode], str], tree_picture_table
+) -> None:
+    if len(artifact.labels) <= 1:
+        if args.pyplot:
+            print("All documents are equivalent to each other.")
+        else:
+            root_node = LabelNode(*artifact.labels[0])
+            print_tree(root_node, extract_child_nodes, format_leaf_node, tree_picture_table=tree_picture_table)
+        return
+    _render_dendrogram(artifact, args, format_leaf_node, tree_picture_table)
+
+
+def _render_dendrogram(
+    artifact: DendrogramArtifact, args, format_leaf_node: Callable[[LabelNode], str], tree_picture_table
+) -> None:
     if args.pyplot:
-        label_strs = [label.format() for label in labels]
-        pyplot_dendrogram(result, label_strs, font=args.pyplot_font)
+        pyplot_dendrogram(artifact, font=args.pyplot_font)
     else:
         print_dendrogram(
-            result, labels, format_leaf_node, max_depth=args.max_depth, tree_picture_table=tree_picture_table
+            artifact, None, format_leaf_node, max_depth=args.max_depth, tree_picture_table=tree_picture_table
+        )
+
+
+def _load_artifact_or_exit(path: str) -> DendrogramArtifact:
+    try:
+        return load_artifact(path)
+    except (OSError, ValueError) as e:
+        sys.exit("Error in loading a matrix file: %s\n%s" % (repr(path), e))
+
+
+def _run_load_matrix_mode(
+    args, format_leaf_node: Callable[[LabelNode], str], tree_picture_table
+) -> None:
+    artifact = _load_artifact_or_exit(args.load_matrix)
+    _render_artifact(artifact, args, format_leaf_node, tree_picture_table)
+
+
+def _run_server_mode(files: List[str], args, distance_function: DistanceFunction) -> None:
+    from .server import CorpusIndex, serve_lines, serve_unix_socket
+
+    temp_dir_context = tempfile.TemporaryDirectory() if args.prep else nullcontext(None)
+    with temp_dir_context as temp_dir:
+
+        def read_doc(filename: str) -> List[str]:
+            return _read_doc(filename, args, temp_dir)
+
+        def split_text(text: str, filename: str) -> List[str]:
+            return _split_doc(text, filename, args)
+
+        index = CorpusIndex(files, read_doc, distance_function=distance_function)
+        _report_tokenize_stats(take_tokenize_stats(), args)
+        print("> Ready: %d files" % len(index), file=sys.stderr)
+        if args.socket:
+            try:
+                serve_unix_socket(index, args.socket, split_text)
+            except KeyboardInterrupt:
+                pass
+        else:
+            serve_lines(index, sys.stdin, sys.stdout, split_text)
+
+
+def _run_knn_graph_mode(
+    labels: List[LabelNode], idocs: List[List[int]], args, distance_function: DistanceFunction
+) -> None:
+    from .knn import build_knn_graph, save_knn_graph, write_knn_graph_csv
+
+    idocs = to_int_arrays(idocs)
+    label_strs = [label.format() for label in labels]
+    stats = SearchStats()
+    pbar = tqdm(desc="Building kNN graph", total=len(idocs), leave=False) if args.progress else DummyProgressBar()
+    try:
+        graph = build_knn_graph(
+            idocs,
+            args.knn_graph,
+            distance_function=distance_function,
+            workers=args.workers,
+            backend=args.parallel_backend,
+            pbar=pbar,
+            stats=stats,
         )
+    finally:
+        pbar.close()
+    if args.knn_output and args.knn_output.endswith(".npz"):
+        save_knn_graph(args.knn_output, graph, label_strs)
+    elif args.knn_output:
+        with open(args.knn_output, "w", newline="") as outp:
+            write_knn_graph_csv(outp, graph, label_strs)
+    else:
+        write_knn_graph_csv(sys.stdout, graph, label_strs)
+    if args.stats:
+        print("> Stats: kNN graph: %s" % stats.format(), file=sys.stderr)
 
 
 def _run_file_modes(
@@ -384,39 +1272,153 @@ def _run_file_modes(
     args,
     format_leaf_node: Callable[[LabelNode], str],
     tree_picture_table,
-    distance_function: Callable[[List[int], List[int]], int],
+    distance_function: DistanceFunction,
 ) -> None:
     if args.show_words:
         for _filename, words in _iter_documents(files, args):
             for word in words:
                 print(word)
+        _report_tokenize_stats(take_tokenize_stats(), args)
         return
 
-    labels: List[LabelNode] = []
-    docs: List[List[str]] = []
-    for filename, doc in _iter_documents(files, args):
-        labels.append(LabelNode(filename))
-        docs.append(doc)
-
     if args.diff:
-        if len(docs) != 2:
+        if len(files) != 2:
             sys.exit("Error: Option -d requires exactly two files.")
-        do_diff(docs[0], docs[1], sep='\n' if args.line_by_line else '')
+        docs = [doc for _filename, doc in _iter_documents(files, args)]
+        _report_tokenize_stats(take_tokenize_stats(), args)
+        do_diff(docs[0], docs[1], sep='\n' if args.line_by_line else '', use_numba=not args.no_numba)
+        return
+
+    labels = [LabelNode(filename) for filename in files]
+    idocs, word_to_index = _read_int_docs(files, args)
+
+    if args.knn_graph is not None:
+        _run_knn_graph_mode(labels, idocs, args, distance_function)
         return
 
-    _run_dendrogram_mode(docs, labels, args, format_leaf_node, tree_picture_table, distance_function)
+    _run_dendrogram_mode(idocs, word_to_index, labels, args, format_leaf_node, tree_picture_table, distance_function)
 
 
 def main():
     parser = gen_parser()
     args = parser.parse_args()
-    if not args.files:
+    if not args.files and not args.load_matrix:
         parser.print_help()
         return
-
-    distance_function = distance_int_list_python if args.no_numba else distance_int_list
+    if args.load_matrix and (args.files or args.save_matrix):
+        sys.exit("Error: Option --load-matrix does not take input files or --save-matrix.")
+    if args.load_matrix and (args.diff or args.show_words or args.neighbors is not None or args.neighbor_list is not None):
+        sys.exit("Error: Option --load-matrix is valid only for drawing dendrogram.")
+    if args.shard and not args.save_matrix:
+        sys.exit("Error: Option --shard requires --save-matrix.")
+    if (args.shard or args.merge_shards) and (
+        args.load_matrix or args.diff or args.show_words or args.neighbors is not None or args.neighbor_list is not None
+    ):
+        sys.exit("Error: Options --shard and --merge-shards are valid only for drawing dendrogram.")
+    if args.merge_shards and (args.shard or args.reuse_matrix or args.checkpoint or args.distance_cache):
+        sys.exit("Error: Option --merge-shards does not take --shard, --reuse-matrix, --checkpoint, or --distance-cache.")
+    if args.neighbor_list is not None and (args.save_matrix or args.reuse_matrix):
+        sys.exit("Error: Option -N does not take --save-matrix or --reuse-matrix.")
+    if args.socket and not args.serve:
+        sys.exit("Error: Option --socket requires --serve.")
+    if args.serve and (
+        args.load_matrix
+        or args.merge_shards
+        or args.shard
+        or args.checkpoint
+        or args.save_matrix
+        or args.reuse_matrix
+        or args.diff
+        or args.show_words
+        or args.pyplot
+        or args.neighbors is not None
+        or args.neighbor_list is not None
+        or args.workers is not None
+        or args.distance_cache
+    ):
+        sys.exit("Error: Option --serve does not take options of the other modes, -j, or --distance-cache.")
+    if args.token_cache and (args.load_matrix or args.merge_shards or args.diff or args.show_words or args.serve):
+        sys.exit("Error: Option --token-cache is valid only for the modes of dendrogram, neighbors, and kNN graph.")
+    if args.token_cache_size < 1:
+        sys.exit("Error: Option --token-cache-size requires NUM >= 1.")
+    if args.knn_output and args.knn_graph is None:
+        sys.exit("Error: Option --knn-output requires --knn-graph.")
+    if args.knn_graph is not None:
+        if args.knn_graph < 1:
+            sys.exit("Error: Option --knn-graph requires K >= 1.")
+        if (
+            args.load_matrix
+            or args.merge_shards
+            or args.shard
+            or args.checkpoint
+            or args.save_matrix
+            or args.reuse_matrix
+            or args.diff
+            or args.show_words
+            or args.pyplot
+            or args.serve
+            or args.neighbors is not None
+            or args.neighbor_list is not None
+            or args.distance_cache
+            or args.approx
+            or args.refine is not None
+            or args.refine_threshold is not None
+            or args.linkage_method is not None
+            or args.linkage_engine != "scipy"
+            or args.linkage_neighbors is not None
+        ):
+            sys.exit("Error: Option --knn-graph does not take options of the other modes.")
+    if args.linkage_method is None:
+        args.linkage_method = "single" if args.linkage_engine == "knn-mst" else "average"
+    if args.linkage_neighbors is None:
+        args.linkage_neighbors = DEFAULT_LINKAGE_NEIGHBORS
+    try:
+        select_linkage_function(args.linkage_method, args.linkage_engine)
+    except ValueError as e:
+        sys.exit("Error: Option --linkage-engine: %s." % e)
+    if args.linkage_engine == "knn-mst":
+        if args.linkage_neighbors < 1:
+            sys.exit("Error: Option --linkage-neighbors requires K >= 1.")
+        if (
+            args.merge_shards
+            or args.shard
+            or args.checkpoint
+            or args.save_matrix
+            or args.reuse_matrix
+            or args.distance_cache
+        ):
+            sys.exit("Error: Option --linkage-engine knn-mst does not use the distance matrix or the distance cache.")
+    if args.refine is not None or args.refine_threshold is not None:
+        if (args.refine is not None and args.refine < 0) or (args.refine_threshold is not None and args.refine_threshold < 0):
+            sys.exit("Error: Options --refine and --refine-threshold require non-negative values.")
+        args.approx = True
+    if args.approx and (
+        args.linkage_engine == "knn-mst"
+        or args.merge_shards
+        or args.shard
+        or args.checkpoint
+        or args.reuse_matrix
+        or args.distance_cache
+        or args.load_matrix
+        or args.diff
+        or args.show_words
+        or args.neighbor_list is not None
+    ):
+        sys.exit("Error: Option --approx is valid only for drawing dendrogram, without exact distances to reuse.")
+    if args.resume and not args.checkpoint:
+        sys.exit("Error: Option --resume requires --checkpoint.")
+    if args.checkpoint and (args.load_matrix or args.diff or args.show_words or args.neighbor_list is not None):
+        sys.exit("Error: Option --checkpoint is valid only for drawing dendrogram.")
+
+    engine = args.distance_engine or ("dp" if args.no_numba else "bitparallel")
+    distance_function = select_distance_function(engine, use_numba=not args.no_numba)
     if args.pyplot and args.max_depth is not None:
         sys.exit("Error: Options --pyplot and --max-depth are mutually exclusive.")
+    if args.parallel_backend == "thread":
+        try:
+            check_thread_backend(distance_function)
+        except ValueError as e:
+            sys.exit("Error: Option --parallel-backend thread: %s." % e)
     if not args.pyplot and args.pyplot_font:
         sys.exit("Error: Option --pyplot-font is valid only with --pyplot.")
 
@@ -440,5 +1442,15 @@ def main():
         else None
     )
 
+    if args.load_matrix:
+        _run_load_matrix_mode(args, format_leaf_node, tree_picture_table)
+        return
+    if args.merge_shards:
+        _run_merge_shards_mode(args, format_leaf_node, tree_picture_table)
+        return
+
     files = args.files if (args.diff or args.no_uniq_files) else uniq(args.files)
+    if args.serve:
+        _run_server_mode(files, args, distance_function)
+        return
     _run_file_modes(files, args, format_leaf_node, tree_picture_table, distance_function)
@@ -0,0 +1,149 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import heapq
+
+import numpy as np
+
+from .dld import DistanceFunction, distance_int_list
+from .lower_bounds import DocSignature, lower_bound
+
+
+@dataclass
+class SearchStats:
+    exact_calls: int = 0  # calls of the distance function
+    pruned: int = 0  # candidates rejected by lower bounds, without calling the distance function
+
+    def format(self) -> str:
+        return "%d exact distance calculations, %d avoided by lower bounds" % (self.exact_calls, self.pruned)
+
+
+DistanceMap = Callable[[List[int], List[Optional[int]]], List[int]]
+
+
+def find_neighbors(
+    idocs: Sequence[Sequence[int]],
+    neighbors: int,
+    distance_function: DistanceFunction = distance_int_list,
+    pbar=None,
+    signatures: Optional[Sequence[DocSignature]] = None,
+    stats: Optional[SearchStats] = None,
+    known_distances: Optional[Dict[int, int]] = None,
+    map_distances: Optional[DistanceMap] = None,
+    batch_size: int = 1,
+    on_final: Optional[Callable[[int, int], None]] = None,
+    lower_bounds: Optional[Sequence[int]] = None,
+    query: int = 0,
+) -> List[Tuple[int, int]]:
+    """Return (distance, index) of the document `query` (the first one by default) and its nearest `neighbors`
+    documents, sorted.
+
+    Ties are broken by index. `neighbors <= 0` means all documents. While the top-k heap is full, the distance
+    of its worst entry bounds the distance calculation of the remaining candidates. With `signatures`, the
+    candidates are visited in increasing order of their lower bounds, and those whose lower bound exceeds the
+    worst entry are rejected without calculating the distance. `lower_bounds` gives the lower bounds by index
+    directly (e.g. from `LowerBoundIndex`), in place of `signatures`.
+
+    `known_distances` maps candidate indices to their distances from the query document, e.g. ones found in
+    a cache. It is updated with the exact distances calculated in the search.
+
+    The candidates are calculated `batch_size` at a time by `map_distances(indices, max_dists)` (by default,
+    `distance_function` in this process), e.g. in parallel, and the results are merged into the heap. With
+    `on_final`, `on_final(distance, index)` is called for each entry of the result in order, as soon as its rank
+    is final, i.e. its distance is less than the lower bounds of the remaining candidates.
+    """
+    if stats is None:
+        stats = SearchStats()
+    if known_distances is None:
+        known_distances = dict()
+    if map_distances is None:
+
+        def map_distances(indices: List[int], max_dists: List[Optional[int]]) -> List[int]:
+            q = idocs[query]
+            return [
+                distance_function(q, idocs[i]) if m is None else distance_function(q, idocs[i], m)
+                for i, m in zip(indices, max_dists)
+            ]
+
+    # candidates in increasing order of (lower bound, index), as arrays, since a search often visits only a few
+    candidate_indices = np.delete(np.arange(len(idocs), dtype=np.int64), query)
+    if lower_bounds is not None:
+        candidate_bounds = np.asarray(lower_bounds, dtype=np.int64)[candidate_indices]
+    elif signatures is not None:
+        sig = signatures[query]
+        bounds = [lower_bound(sig, signatures[i]) for i in candidate_indices.tolist()]
+        candidate_bounds = np.array(bounds, dtype=np.int64)
+    else:
+        candidate_bounds = np.zeros(len(candidate_indices), dtype=np.int64)
+    order = np.argsort(candidate_bounds, kind="stable")
+    candidate_bounds = candidate_bounds[order]
+    candidate_indices = candidate_indices[order]
+    candidate_count = len(candidate_indices)
+
+    heap: List[Tuple[int, int]] = []  # (-distance, -index), the worst neighbor at the top
+    pending: List[Tuple[int, int]] = [(0, query)]  # (distance, index) of entries not passed to `on_final` yet
+    evicted = set()
+
+    def emit_final(next_lower_bound: Optional[int]) -> None:
+        while pending and (next_lower_bound is None or pending[0][0] < next_lower_bound):
+            d, i = heapq.heappop(pending)
+            if i not in evicted:
+                on_final(d, i)
+
+    ci = 0
+    while ci < candidate_count:
+        indices: List[int] = []
+        max_dists: List[Optional[int]] = []
+        found: List[Tuple[int, int]] = []  # (index, distance) of the batch
+        heap_full = neighbors > 0 and len(heap) == neighbors
+        if heap_full:
+            worst_d, worst_i = -heap[0][0], -heap[0][1]
+            if candidate_bounds[ci] > worst_d:
+                # the following candidates have even larger lower bounds
+                stats.pruned += candidate_count - ci
+                if pbar is not None:
+                    pbar.update(candidate_count - ci)
+                break  # while ci
+        # until the heap gets full, a batch has just enough candidates to fill it, which are calculated without bounds
+        size = batch_size if heap_full or neighbors <= 0 else neighbors - len(heap)
+        batch_end = min(candidate_count, ci + size)
+        for lb, i in zip(candidate_bounds[ci:batch_end].tolist(), candidate_indices[ci:batch_end].tolist()):
+            max_dist: Optional[int] = None
+            if heap_full:
+                max_dist = worst_d if i < worst_i else worst_d - 1  # ties are broken by index
+                if lb > max_dist:
+                    stats.pruned += 1
+                    continue  # for lb, i
+            d = known_distances.get(i)
+            if d is not None:
+                found.append((i, d))
+            else:
+                indices.append(i)
+                max_dists.append(max_dist)
+        if indices:
+            ds = map_distances(indices, max_dists)
+            stats.exact_calls += len(indices)
+            for i, m, d in zip(indices, max_dists, ds):
+                if m is None or d <= m:
+                    known_distances[i] = d
+                found.append((i, d))
+        for i, d in sorted(found):
+            if neighbors <= 0 or len(heap) < neighbors:
+                heapq.heappush(heap, (-d, -i))
+            elif (d, i) < (-heap[0][0], -heap[0][1]):
+                _nd, ni = heapq.heapreplace(heap, (-d, -i))
+                evicted.add(-ni)
+            else:
+                continue  # for i, d
+            heapq.heappush(pending, (d, i))
+        if pbar is not None:
+            pbar.update(batch_end - ci)
+        ci = batch_end
+        if on_final is not None and ci < candidate_count:
+            emit_final(int(candidate_bounds[ci]))
+
+    if on_final is not None:
+        emit_final(None)
+    dds = [(0, query)]
+    dds.extend(sorted((-nd, -ni) for nd, ni in heap))
+    return dds
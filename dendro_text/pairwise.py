@@ -0,0 +1,301 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from math import isqrt
+from typing import Callable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import time
+
+import numpy as np
+
+from . import dld
+from .dld import DistanceFunction, pack_int_docs
+
+# Pairwise distances are stored in a condensed vector (the format of `scipy.spatial.distance.squareform`):
+# the distance of the pair (i, j), i < j, of n documents is at the index `condensed_index(n, i, j)`.
+# The functions taking `pairs`, a slice of the condensed indices (e.g. the pairs of a shard), work on a vector of
+# the pairs of the slice only: its item t is the pair at the condensed index start + t * step.
+
+ALL_PAIRS = slice(None)
+
+
+def condensed_size(n: int) -> int:
+    return n * (n - 1) // 2
+
+
+def condensed_index(n: int, i: int, j: int) -> int:
+    assert 0 <= i < j < n
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def condensed_pair(n: int, k: int) -> Tuple[int, int]:
+    """Inverse of `condensed_index`."""
+    assert 0 <= k < condensed_size(n)
+    # the row i is the largest one where condensed_index(n, i, i + 1) <= k
+    i = n - 2 - (isqrt(8 * (condensed_size(n) - 1 - k) + 1) - 1) // 2
+    j = k - condensed_index(n, i, i + 1) + i + 1
+    return i, j
+
+
+def condensed_pairs(n: int, ks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized `condensed_pair`."""
+    ks = np.asarray(ks, dtype=np.int64)
+    r = condensed_size(n) - 1 - ks
+    t = ((np.sqrt(8 * r.astype(np.float64) + 1) - 1) // 2).astype(np.int64)
+    # correct the rounding errors of the floating-point square root
+    t -= (t * (t + 1) // 2 > r).astype(np.int64)
+    t += ((t + 1) * (t + 2) // 2 <= r).astype(np.int64)
+    i = n - 2 - t
+    j = ks - (n * i - i * (i + 1) // 2) + i + 1
+    return i, j
+
+
+def condensed_row(n: int, i: int) -> np.ndarray:
+    """Condensed indices of the pairs of i and each of the other documents, in order of the other document."""
+    others = np.delete(np.arange(n, dtype=np.int64), i)
+    a = np.minimum(others, i)
+    b = np.maximum(others, i)
+    return n * a - a * (a + 1) // 2 + (b - a - 1)
+
+
+def sliced_size(n: int, pairs: slice) -> int:
+    """Number of the pairs of n documents in the slice `pairs` of the condensed indices."""
+    return len(range(*pairs.indices(condensed_size(n))))
+
+
+def _iter_row_ranges(n: int, pairs: slice, t_begin: int, t_end: int) -> Iterator[Tuple[int, int, int, int]]:
+    """Yield (i, b, e, j0) of the rows overlapping the items [t_begin, t_end) of a vector of `pairs`: the items
+    [b, e) are the pairs (i, j0 + (t - b) * step).
+    """
+    start, _stop, step = pairs.indices(condensed_size(n))
+    if t_begin >= t_end:
+        return
+    i = condensed_pair(n, start + t_begin * step)[0]
+    while i < n - 1:
+        k0 = condensed_index(n, i, i + 1)
+        b = max(t_begin, -((start - k0) // step))  # the first item at k0 or after
+        if b >= t_end:
+            break  # while i
+        e = min(t_end, -((start - k0 - (n - 1 - i)) // step))
+        yield i, b, e, i + 1 + (start + b * step - k0)
+        i += 1
+
+
+def iter_condensed_pairs(n: int, mask: np.ndarray, pairs: slice = ALL_PAIRS) -> Iterator[Tuple[int, int, int]]:
+    """Yield (t, i, j) of the items of a vector of `pairs` (a condensed vector by default) where `mask` is true,
+    row by row.
+    """
+    step = pairs.indices(condensed_size(n))[2]
+    for i, b, e, j0 in _iter_row_ranges(n, pairs, 0, len(mask)):
+        for dt in np.flatnonzero(mask[b:e]).tolist():
+            yield b + dt, i, j0 + dt * step
+
+
+def pair_costs(lengths: np.ndarray, ks: np.ndarray) -> np.ndarray:
+    """Estimated costs of the distance calculation of the pairs at the condensed indices `ks`, which grow with the
+    product of the lengths of the two documents (+1 for empty documents).
+    """
+    lengths = np.asarray(lengths, dtype=np.float64)
+    i, j = condensed_pairs(len(lengths), ks)
+    return (lengths[i] + 1.0) * (lengths[j] + 1.0)
+
+
+def _iter_nan_rows(
+    darr: np.ndarray, n: int, k_begin: int, k_end: int, pairs: slice = ALL_PAIRS
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """Yield (i, ks, js) of the rows overlapping the items [k_begin, k_end) of `darr`, a vector of `pairs`, where
+    the pairs (i, js) at the items ks are NaN. The arrays are of the size of a row at most.
+    """
+    step = pairs.indices(condensed_size(n))[2]
+    for i, b, e, j0 in _iter_row_ranges(n, pairs, k_begin, k_end):
+        offsets = np.flatnonzero(np.isnan(darr[b:e]))
+        yield i, b + offsets, j0 + offsets * step
+
+
+def nan_pairs_cost(
+    lengths: np.ndarray, darr: np.ndarray, k_begin: int = 0, k_end: Optional[int] = None, pairs: slice = ALL_PAIRS
+) -> float:
+    """Sum of the costs (`pair_costs()`) of the NaN items [k_begin, k_end) of `darr`, a vector of `pairs`,
+    calculated row by row, without arrays of the size of the vector.
+    """
+    weights = np.asarray(lengths, dtype=np.float64) + 1.0
+    k_end = len(darr) if k_end is None else k_end
+    total = 0.0
+    for i, _ks, js in _iter_nan_rows(darr, len(weights), k_begin, k_end, pairs):
+        total += weights[i] * float(weights[js].sum())
+    return total
+
+
+MAX_BATCH_PAIRS = 100000
+
+
+class CostBatch(NamedTuple):
+    """A range [k_begin, k_end) of the items of a vector, with the number and the costs of the NaN pairs in it."""
+
+    k_begin: int
+    k_end: int
+    pairs: int
+    cost: float
+
+
+def schedule_cost_batches(
+    lengths: np.ndarray,
+    darr: np.ndarray,
+    batch_count: int,
+    max_batch_pairs: int = MAX_BATCH_PAIRS,
+    total_cost: Optional[float] = None,
+    pairs: slice = ALL_PAIRS,
+) -> List[CostBatch]:
+    """Divide the NaN pairs of `darr`, a vector of `pairs`, into ranges of about the same cost (or of at most
+    `max_batch_pairs` pairs), in decreasing order of cost.
+
+    The ranges are cut row by row, so that no array of the size of the vector is made. An expensive pair makes
+    its range longer in cost than the others, which is sent first, so that workers do not wait for a straggler
+    at the end.
+    """
+    weights = np.asarray(lengths, dtype=np.float64) + 1.0
+    n = len(weights)
+    if total_cost is None:
+        total_cost = nan_pairs_cost(lengths, darr, pairs=pairs)
+    if total_cost <= 0.0:
+        return []
+    target = total_cost / max(1, batch_count)
+
+    batches: List[CostBatch] = []
+    begin = -1
+    last_end = -1
+    cost = 0.0
+    count = 0
+    for i, ks, js in _iter_nan_rows(darr, n, 0, len(darr), pairs):
+        if len(ks) == 0:
+            continue  # for i
+        cumulative = np.cumsum(weights[js]) * weights[i]
+        p = 0
+        base = 0.0
+        while p < len(ks):
+            if begin < 0:
+                begin = int(ks[p])
+            # take the pairs up to the one reaching the target cost, within the size limit
+            q = int(np.searchsorted(cumulative, base + (target - cost), side="left")) + 1
+            q = max(p + 1, min(q, len(ks), p + max_batch_pairs - count))
+            cost += float(cumulative[q - 1]) - base
+            count += q - p
+            base = float(cumulative[q - 1])
+            last_end = int(ks[q - 1]) + 1
+            if cost >= target or count >= max_batch_pairs:
+                batches.append(CostBatch(begin, last_end, count, cost))
+                begin, cost, count = -1, 0.0, 0
+            p = q
+    if begin >= 0:
+        batches.append(CostBatch(begin, last_end, count, cost))
+    batches.sort(key=lambda b: -b.cost)
+    return batches
+
+
+def batch_pair_indices(darr: np.ndarray, batch: CostBatch) -> np.ndarray:
+    """Indices of the NaN items of `darr` in the batch (the condensed indices, for a condensed vector)."""
+    return batch.k_begin + np.flatnonzero(np.isnan(darr[batch.k_begin : batch.k_end]))
+
+
+DEFAULT_CHECKPOINT_INTERVAL = 60.0  # seconds
+
+
+class PeriodicCheckpoint:
+    """Save a condensed distance vector in calculation with `save(darr)`, at most once per `interval` seconds."""
+
+    def __init__(self, save: Callable[[np.ndarray], None], interval: float = DEFAULT_CHECKPOINT_INTERVAL):
+        self.save = save
+        self.interval = interval
+        self.last_saved = time.monotonic()
+
+    def tick(self, darr: np.ndarray) -> None:
+        if time.monotonic() - self.last_saved >= self.interval:
+            self.flush(darr)
+
+    def flush(self, darr: np.ndarray) -> None:
+        self.save(darr)
+        self.last_saved = time.monotonic()
+
+
+THREAD_BATCHES_PER_WORKER = 16
+
+
+def check_thread_backend(distance_function: DistanceFunction) -> None:
+    """Raise ValueError when the thread backend can not calculate the distances of `distance_function`."""
+    _numba_kernel_mode(distance_function)
+
+
+def _numba_kernel_mode(distance_function: DistanceFunction) -> bool:
+    """Return `use_dp` argument of the Numba kernel that computes the same distances as `distance_function`."""
+    if dld.condensed_distances_i is None:
+        raise ValueError("the thread backend requires Numba")
+    if distance_function is dld.distance_int_list_numba:
+        return True
+    if distance_function in (dld.distance_int_list_bitparallel_numba, dld.distance_int_list):
+        return False
+    raise ValueError("the thread backend requires a distance engine compiled by Numba")
+
+
+def calc_condensed_distances_threaded(
+    idocs: Sequence[Sequence[int]],
+    workers: int,
+    distance_function: DistanceFunction = dld.distance_int_list,
+    pbar=None,
+    darr: Optional[np.ndarray] = None,
+    checkpoint: Optional[PeriodicCheckpoint] = None,
+    pairs: slice = ALL_PAIRS,
+) -> np.ndarray:
+    """Fill a condensed distance vector (or a vector of `pairs`) in place with threads running a nogil Numba
+    kernel.
+
+    The documents are shared by the threads as one flat token buffer and an offsets array. When `darr` is
+    given, only its NaN items are calculated. `pbar` is updated with the costs (`nan_pairs_cost()`) of the
+    calculated pairs. The kernel writes into `darr` in place, so `checkpoint` is ticked every `interval` seconds
+    while the batches run. On an interruption or an error, the running batches are stopped and `checkpoint` is
+    saved before the threads are joined.
+    """
+    use_dp = _numba_kernel_mode(distance_function)
+    tokens, offsets = pack_int_docs(idocs)
+    n = len(idocs)
+    total = sliced_size(n, pairs)
+    start, _stop, step = pairs.indices(condensed_size(n))
+    if darr is None:
+        darr = np.full(total, np.nan, dtype=np.float64)
+    assert darr.shape == (total,)
+    if total == 0:
+        return darr
+
+    batch_count = min(total, max(1, workers) * THREAD_BATCHES_PER_WORKER)
+    bounds = [total * b // batch_count for b in range(batch_count + 1)]
+    batches: List[Tuple[int, int]] = [(bounds[b], bounds[b + 1]) for b in range(batch_count) if bounds[b] < bounds[b + 1]]
+
+    lengths = np.diff(offsets)
+
+    def run_batch(k_begin: int, k_end: int) -> float:
+        cost = nan_pairs_cost(lengths, darr, k_begin, k_end, pairs)
+        if cost == 0.0:
+            return 0.0
+        i, j = condensed_pair(n, start + k_begin * step)
+        dld.condensed_distances_i(tokens, offsets, k_begin, k_end, i, j, step, use_dp, darr, stop)
+        return cost
+
+    stop = np.zeros(1, dtype=np.bool_)
+    timeout = checkpoint.interval if checkpoint is not None else None
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(run_batch, k_begin, k_end) for k_begin, k_end in batches]
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    cost = future.result()
+                    if pbar is not None:
+                        pbar.update(cost)
+                if checkpoint is not None:
+                    checkpoint.tick(darr)
+        except BaseException:
+            stop[0] = True
+            for future in futures:
+                future.cancel()
+            if checkpoint is not None:
+                checkpoint.flush(darr)
+            raise
+    return darr
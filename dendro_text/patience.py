@@ -0,0 +1,130 @@
+from bisect import bisect_left
+from typing import Dict, List as PList, Sequence, Tuple
+
+import numpy as np
+
+from .dld import EditOp, edit_sequence_int_list
+
+# Anchored diff for large inputs (patience diff): the documents are divided into units (lines), the units that
+# occur exactly once in both documents and are in the same order (the longest increasing subsequence of them)
+# become anchors, and the same is repeated in the regions between the anchors. The edit script is calculated
+# only inside the regions that are left. The script is not minimal in general, but follows the lines that
+# certainly correspond, as `diff --patience` does.
+
+ANCHORED_DIFF_CELLS = 1 << 24  # do_diff() uses the anchored diff for inputs of more table cells
+
+
+def _longest_increasing(pairs: PList[Tuple[int, int]]) -> PList[Tuple[int, int]]:
+    """The longest subsequence of `pairs` (sorted by the first items) whose second items increase."""
+    tails: PList[int] = []  # the second item of the last pair of the best subsequence of each length
+    tail_indices: PList[int] = []
+    previous = [-1] * len(pairs)
+    for k, (_i, j) in enumerate(pairs):
+        p = bisect_left(tails, j)
+        if p == len(tails):
+            tails.append(j)
+            tail_indices.append(k)
+        else:
+            tails[p] = j
+            tail_indices[p] = k
+        previous[k] = tail_indices[p - 1] if p > 0 else -1
+    r = []
+    k = tail_indices[-1] if tail_indices else -1
+    while k >= 0:
+        r.append(pairs[k])
+        k = previous[k]
+    r.reverse()
+    return r
+
+
+def patience_anchors(keys1: Sequence[int], keys2: Sequence[int]) -> PList[Tuple[int, int]]:
+    """Pairs (i, j) of the units keys1[i] == keys2[j] matched by patience diff, in increasing order."""
+    anchors: PList[Tuple[int, int]] = []
+    regions = [(0, len(keys1), 0, len(keys2))]
+    while regions:
+        a0, a1, b0, b1 = regions.pop()
+        while a0 < a1 and b0 < b1 and keys1[a0] == keys2[b0]:
+            anchors.append((a0, b0))
+            a0 += 1
+            b0 += 1
+        while a0 < a1 and b0 < b1 and keys1[a1 - 1] == keys2[b1 - 1]:
+            a1 -= 1
+            b1 -= 1
+            anchors.append((a1, b1))
+        if a0 == a1 or b0 == b1:
+            continue  # while regions
+
+        counts: Dict[int, PList[int]] = dict()  # key -> [count in keys1, count in keys2, position in keys2]
+        for i in range(a0, a1):
+            counts.setdefault(keys1[i], [0, 0, -1])[0] += 1
+        for j in range(b0, b1):
+            c = counts.get(keys2[j])
+            if c is not None:
+                c[1] += 1
+                c[2] = j
+        uniques = []
+        for i in range(a0, a1):
+            c = counts[keys1[i]]
+            if c[0] == 1 and c[1] == 1:
+                uniques.append((i, c[2]))
+        found = _longest_increasing(uniques)
+        if not found:
+            continue  # while regions
+        anchors.extend(found)
+        bounds = [(a0 - 1, b0 - 1)] + found + [(a1, b1)]
+        for (pi, pj), (ni, nj) in zip(bounds, bounds[1:]):
+            if pi + 1 < ni and pj + 1 < nj:
+                regions.append((pi + 1, ni, pj + 1, nj))
+    anchors.sort()
+    return anchors
+
+
+def line_starts(doc: Sequence[str], sep: str) -> np.ndarray:
+    """Token indices at which the units (lines) of a tokenized document start. A line ends with a token including a
+    newline; each token is a unit when the tokens are joined with a newline (-l) or no token includes a newline.
+    """
+    if "\n" in sep:
+        return np.arange(len(doc), dtype=np.int64)
+    ends = [k + 1 for k, w in enumerate(doc) if "\n" in w]
+    if not ends:
+        return np.arange(len(doc), dtype=np.int64)
+    if ends[-1] == len(doc):
+        ends.pop()
+    return np.array([0] + ends, dtype=np.int64) if doc else np.zeros(0, dtype=np.int64)
+
+
+def unit_keys(idoc: np.ndarray, starts: np.ndarray, key_table: Dict[bytes, int]) -> PList[int]:
+    """Ids of the units `idoc[starts[k]:starts[k + 1]]`, interned in `key_table`."""
+    ends = np.append(starts[1:], len(idoc))
+    data = np.ascontiguousarray(idoc, dtype=np.int64)
+    return [key_table.setdefault(data[b:e].tobytes(), len(key_table)) for b, e in zip(starts.tolist(), ends.tolist())]
+
+
+def anchored_edit_sequence_int_list(
+    s1: Sequence[int], s2: Sequence[int], starts1: np.ndarray, starts2: np.ndarray, use_numba: bool = True
+) -> PList[int]:
+    """Edit script of s1 to s2 (as `edit_sequence_int_list()`), in which the units (starting at the token indices
+    `starts1` / `starts2`) matched by patience diff are kept, and only the regions between them are compared.
+    """
+    a = np.asarray(s1, dtype=np.int64)
+    b = np.asarray(s2, dtype=np.int64)
+    starts1 = np.asarray(starts1, dtype=np.int64)
+    starts2 = np.asarray(starts2, dtype=np.int64)
+    key_table: Dict[bytes, int] = dict()
+    keys1 = unit_keys(a, starts1, key_table)
+    keys2 = unit_keys(b, starts2, key_table)
+    ends1 = np.append(starts1[1:], len(a))
+    no_edit = int(EditOp.NO_EDIT)
+
+    edit_seq: PList[int] = []
+    p1 = p2 = 0
+    for i, j in patience_anchors(keys1, keys2):
+        t1, t2 = int(starts1[i]), int(starts2[j])
+        if p1 < t1 or p2 < t2:
+            edit_seq.extend(edit_sequence_int_list(a[p1:t1], b[p2:t2], use_numba=use_numba))
+        unit_length = int(ends1[i]) - t1
+        edit_seq.extend([no_edit] * unit_length)
+        p1, p2 = t1 + unit_length, t2 + unit_length
+    if p1 < len(a) or p2 < len(b):
+        edit_seq.extend(edit_sequence_int_list(a[p1:], b[p2:], use_numba=use_numba))
+    return edit_seq
@@ -0,0 +1,210 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, IO, List, Optional, Tuple
+
+import io
+import json
+import os
+import socketserver
+import stat
+import sys
+import time
+
+import numpy as np
+
+from .dld import DistanceFunction, distance_int_list
+from .lower_bounds import DocSignature, LowerBoundIndex, compute_signature
+from .neighbors import SearchStats, find_neighbors
+
+# Server mode: the corpus is read, tokenized, and interned once, and neighbor queries are answered from memory.
+#
+# Requests and responses are JSON objects, one per line:
+#
+#   {"id": 1, "query": "path/to/file", "neighbors": 10}
+#   {"id": 2, "text": "...", "filename": "x.py", "neighbors": 10}   (filename selects the lexer of -t)
+#   {"id": 3, "command": "refresh"}
+#
+#   {"id": 1, "neighbors": [{"file": "corpus/a.py", "distance": 12}, ...]}
+#   {"id": 3, "refreshed": 2}
+#   {"id": 4, "error": "..."}
+#
+# Changed corpus files are found by their modification times and sizes, checked at most once per
+# REFRESH_INTERVAL seconds before a query (or on the "refresh" command), and only they are read again.
+
+REFRESH_INTERVAL = 1.0  # seconds
+DEFAULT_QUERY_NEIGHBORS = 10
+
+ReadDocFunction = Callable[[str], List[str]]
+
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@dataclass
+class _Entry:
+    path: str
+    stamp: Optional[Tuple[int, int]]  # None for a missing file
+    readable: bool
+    idoc: np.ndarray
+    signature: DocSignature
+
+
+class CorpusIndex:
+    """Interned documents of the corpus files, their signatures, and the lower-bound index of them."""
+
+    def __init__(
+        self,
+        files: List[str],
+        read_doc: ReadDocFunction,
+        distance_function: DistanceFunction = distance_int_list,
+        refresh_interval: float = REFRESH_INTERVAL,
+    ):
+        self.read_doc = read_doc
+        self.distance_function = distance_function
+        self.refresh_interval = refresh_interval
+        self.word_to_index: Dict[str, int] = dict()
+        self.entries = [self._load(path) for path in files]
+        self._rebuild()
+
+    def _intern(self, doc: List[str], extend_vocabulary: bool) -> np.ndarray:
+        """Token ids of `doc`. Without `extend_vocabulary`, unknown words get temporary ids for this document."""
+        if extend_vocabulary:
+            for w in doc:
+                self.word_to_index.setdefault(w, len(self.word_to_index) + 1)
+            return np.array([self.word_to_index[w] for w in doc], dtype=np.int32)
+        unknown: Dict[str, int] = dict()
+        base = len(self.word_to_index) + 1
+        ids = [self.word_to_index.get(w) or unknown.setdefault(w, base + len(unknown)) for w in doc]
+        return np.array(ids, dtype=np.int32)
+
+    def _load(self, path: str) -> _Entry:
+        stamp = _file_stamp(path)
+        doc: List[str] = []
+        readable = False
+        if stamp is not None:
+            try:
+                doc = self.read_doc(path)
+                readable = True
+            except (OSError, UnicodeDecodeError, SystemExit):
+                pass  # excluded from the results until it changes
+        idoc = self._intern(doc, extend_vocabulary=True)
+        return _Entry(path, stamp, readable, idoc, compute_signature(idoc))
+
+    def _rebuild(self) -> None:
+        self.active = [e for e in self.entries if e.readable]
+        self.lower_bound_index = LowerBoundIndex([e.signature for e in self.active])
+        self.last_refreshed = time.monotonic()
+
+    def refresh(self) -> int:
+        """Read the files changed since they were read. Returns the number of them."""
+        changed = 0
+        for k, entry in enumerate(self.entries):
+            if _file_stamp(entry.path) != entry.stamp:
+                self.entries[k] = self._load(entry.path)
+                changed += 1
+        if changed:
+            self._rebuild()
+        self.last_refreshed = time.monotonic()
+        return changed
+
+    def refresh_if_due(self) -> int:
+        if time.monotonic() - self.last_refreshed < self.refresh_interval:
+            return 0
+        return self.refresh()
+
+    def __len__(self) -> int:
+        return len(self.active)
+
+    def query(
+        self, doc: List[str], neighbors: int = DEFAULT_QUERY_NEIGHBORS, stats: Optional[SearchStats] = None
+    ) -> List[Tuple[int, str]]:
+        """Return (distance, file) of the nearest `neighbors` corpus files of `doc`, sorted. Ties are broken by the
+        order of the files. `neighbors <= 0` means all files.
+        """
+        q = self._intern(doc, extend_vocabulary=False)
+        idocs = [q] + [e.idoc for e in self.active]
+        lower_bounds = np.concatenate([[0], self.lower_bound_index.lower_bounds(compute_signature(q))])
+        dds = find_neighbors(
+            idocs, neighbors, distance_function=self.distance_function, stats=stats, lower_bounds=lower_bounds
+        )
+        return [(d, self.active[i - 1].path) for d, i in dds[1:]]
+
+
+def handle_request(index: CorpusIndex, request: Any, split_text: Callable[[str, str], List[str]]) -> Dict[str, Any]:
+    response: Dict[str, Any] = dict()
+    try:
+        if not isinstance(request, dict):
+            raise ValueError("request is not a JSON object")
+        if "id" in request:
+            response["id"] = request["id"]
+        if request.get("command") == "refresh":
+            response["refreshed"] = index.refresh()
+            return response
+        if "command" in request:
+            raise ValueError("unknown command: %s" % repr(request["command"]))
+
+        neighbors = int(request.get("neighbors", DEFAULT_QUERY_NEIGHBORS))
+        if "query" in request:
+            try:
+                doc = index.read_doc(str(request["query"]))
+            except (OSError, UnicodeDecodeError, SystemExit) as e:
+                raise ValueError("can not read %s: %s" % (repr(request["query"]), e))
+        elif "text" in request:
+            doc = split_text(str(request["text"]), str(request.get("filename", "")))
+        else:
+            raise ValueError("request has neither query nor text")
+        index.refresh_if_due()
+        response["neighbors"] = [{"file": f, "distance": d} for d, f in index.query(doc, neighbors)]
+    except (ValueError, TypeError) as e:
+        response["error"] = str(e)
+    return response
+
+
+def serve_lines(index: CorpusIndex, inp: IO[str], outp: IO[str], split_text: Callable[[str, str], List[str]]) -> None:
+    """Answer the requests of `inp`, one JSON object per line, until the end of input."""
+    for line in inp:
+        if not line.strip():
+            continue  # for line
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response: Dict[str, Any] = {"error": "invalid JSON: %s" % e}
+        else:
+            response = handle_request(index, request, split_text)
+        outp.write(json.dumps(response, ensure_ascii=False) + "\n")
+        outp.flush()
+
+
+def serve_unix_socket(index: CorpusIndex, path: str, split_text: Callable[[str, str], List[str]]) -> None:
+    """Answer the requests of the connections to the Unix socket `path`, one connection at a time."""
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            inp = io.TextIOWrapper(self.rfile, encoding="utf-8")
+            outp = io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True)
+            try:
+                serve_lines(index, inp, outp, split_text)
+            finally:
+                inp.detach()
+                outp.detach()
+
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        pass
+    else:
+        if not stat.S_ISSOCK(mode):
+            sys.exit("Error: Option --socket: %s is not a socket." % repr(path))
+        os.remove(path)  # left by a previous server
+    with socketserver.UnixStreamServer(path, Handler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,73 @@
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import os
+import tempfile
+
+import numpy as np
+
+from .dld import INT_DOC_DTYPE, unpack_int_docs
+
+# The interned documents shared by worker processes without pickling and copying them into each worker.
+# A temporary file holds the offsets (int64, one more than the documents) followed by the flat token buffer
+# (int32), as `dld.pack_int_docs()`; the processes map it into memory read-only, so they share the pages of the
+# OS page cache. A memory-mapped file is used rather than `multiprocessing.shared_memory`, whose resource
+# tracker removes or warns about blocks attached by forked workers.
+
+OFFSET_DTYPE = np.int64
+
+
+@dataclass(frozen=True)
+class SharedCorpusHandle:
+    """Picklable reference to a shared corpus, to be passed to worker processes."""
+
+    path: str
+    doc_count: int
+    token_count: int
+
+
+def _views(handle: SharedCorpusHandle, mode: str) -> Tuple[np.ndarray, np.ndarray]:
+    offsets_size = (handle.doc_count + 1) * np.dtype(OFFSET_DTYPE).itemsize
+    offsets = np.memmap(handle.path, dtype=OFFSET_DTYPE, mode=mode, shape=(handle.doc_count + 1,))
+    if handle.token_count == 0:
+        return np.zeros(0, dtype=INT_DOC_DTYPE), offsets
+    tokens = np.memmap(handle.path, dtype=INT_DOC_DTYPE, mode=mode, offset=offsets_size, shape=(handle.token_count,))
+    return tokens, offsets
+
+
+class SharedCorpus:
+    """Owner of the file of a shared corpus. The file is removed by `close()`."""
+
+    def __init__(self, idocs: Sequence[Sequence[int]], dir: Optional[str] = None):
+        lengths = np.array([len(idoc) for idoc in idocs], dtype=OFFSET_DTYPE)
+        fd, path = tempfile.mkstemp(prefix="dendro_text-", suffix=".corpus", dir=dir)
+        os.close(fd)
+        self.handle = SharedCorpusHandle(path, len(idocs), int(lengths.sum()))
+        size = (len(idocs) + 1) * np.dtype(OFFSET_DTYPE).itemsize
+        size += self.handle.token_count * np.dtype(INT_DOC_DTYPE).itemsize
+        with open(path, "wb") as outp:
+            outp.truncate(size)
+        tokens, offsets = _views(self.handle, "r+")
+        offsets[0] = 0
+        np.cumsum(lengths, out=offsets[1:])
+        for i, idoc in enumerate(idocs):
+            tokens[offsets[i] : offsets[i + 1]] = idoc
+        for a in (tokens, offsets):
+            if isinstance(a, np.memmap):
+                a.flush()
+
+    def close(self) -> None:
+        if os.path.exists(self.handle.path):
+            os.remove(self.handle.path)
+
+    def __enter__(self) -> "SharedCorpus":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def attach_shared_corpus(handle: SharedCorpusHandle) -> List[np.ndarray]:
+    """Return the documents of a shared corpus as read-only zero-copy views, in a worker process."""
+    tokens, offsets = _views(handle, "r")
+    return unpack_int_docs(tokens, np.asarray(offsets))
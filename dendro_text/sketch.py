@@ -0,0 +1,185 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from .dld import DistanceFunction, distance_int_list
+from .pairwise import condensed_pair, condensed_row, condensed_size
+
+# Approximate distances from MinHash sketches of token shingles (q-grams of token ids).
+#
+# The sketches estimate the Jaccard similarity J of the shingle multisets of two documents. If a fraction p of the
+# tokens is edited, a shingle survives with probability (1 - p)^q, so the shared fraction of shingles
+# s = 2J / (1 + J) (Dice coefficient) gives p = 1 - s^(1/q), and the distance is estimated as p * max(len_a, len_b),
+# at least |len_a - len_b|. It is a rough estimate: exact for identical documents, and an overestimate for
+# unrelated documents (p = 1 gives the length, while the edit distance of unrelated texts is shorter).
+
+SKETCH_SIZE = 64
+SHINGLE_SIZE = 4
+ACCURACY_SAMPLE_SIZE = 200
+CALIBRATION_BINS = 20
+
+_EMPTY_HASH = np.uint32(0xFFFFFFFF)
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_HASH_CHUNK = 1 << 16  # shingles hashed at once
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    # the finalizer of SplitMix64
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _shingle_keys(idoc: np.ndarray, shingle_size: int) -> np.ndarray:
+    tokens = np.asarray(idoc, dtype=np.uint64)
+    if len(tokens) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    q = min(shingle_size, len(tokens))
+    count = len(tokens) - q + 1
+    keys = np.zeros(count, dtype=np.uint64)
+    for t in range(q):
+        keys = _mix64(keys * _SHINGLE_MULTIPLIER + tokens[t : t + count])
+    # the m-th occurrence of a shingle is another key, so that the sketches compare multisets of shingles
+    keys.sort()
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    occurrences = np.arange(count) - np.repeat(starts, np.diff(np.append(starts, count)))
+    return _mix64(keys ^ occurrences.astype(np.uint64))
+
+
+@dataclass(frozen=True)
+class Sketches:
+    """MinHash sketches (one row of SKETCH_SIZE hash minimums per document) and the lengths of the documents."""
+
+    minhashes: np.ndarray
+    lengths: np.ndarray
+    shingle_size: int
+
+
+def compute_sketches(
+    idocs: Sequence[Sequence[int]], sketch_size: int = SKETCH_SIZE, shingle_size: int = SHINGLE_SIZE
+) -> Sketches:
+    seeds = _mix64(np.arange(1, sketch_size + 1, dtype=np.uint64))
+    minhashes = np.full((len(idocs), sketch_size), _EMPTY_HASH, dtype=np.uint32)
+    for k, idoc in enumerate(idocs):
+        keys = _shingle_keys(np.asarray(idoc), shingle_size)
+        for b in range(0, len(keys), _HASH_CHUNK):
+            chunk = keys[b : b + _HASH_CHUNK]
+            hashes = (_mix64(chunk[np.newaxis, :] ^ seeds[:, np.newaxis]) >> np.uint64(32)).astype(np.uint32)
+            np.minimum(minhashes[k], hashes.min(axis=1), out=minhashes[k])
+    lengths = np.array([len(idoc) for idoc in idocs], dtype=np.int64)
+    return Sketches(minhashes, lengths, shingle_size)
+
+
+def estimate_distances(sketches: Sketches, i: int, js: np.ndarray) -> np.ndarray:
+    """Estimated distances between the document i and the documents `js`."""
+    la = sketches.lengths[i]
+    lb = sketches.lengths[js]
+    jaccard = (sketches.minhashes[js] == sketches.minhashes[i]).mean(axis=1)
+    shared = 2 * jaccard / (1 + jaccard)
+    edited = 1.0 - shared ** (1.0 / sketches.shingle_size)
+    longer = np.maximum(la, lb)
+    d = np.maximum(np.abs(la - lb), edited * longer)
+    return np.where((la == 0) | (lb == 0), longer, np.minimum(d, longer)).astype(np.float64)
+
+
+def approx_condensed_distances(sketches: Sketches, pbar=None) -> np.ndarray:
+    """Condensed vector of the estimated distances of all pairs. `pbar` is updated by the pairs."""
+    n = len(sketches.lengths)
+    darr = np.empty(condensed_size(n), dtype=np.float64)
+    k = 0
+    for i in range(n - 1):
+        js = np.arange(i + 1, n)
+        darr[k : k + len(js)] = estimate_distances(sketches, i, js)
+        k += len(js)
+        if pbar is not None:
+            pbar.update(len(js))
+    return darr
+
+
+def refine_pair_indices(darr: np.ndarray, n: int, neighbors: int = 0, threshold: Optional[float] = None) -> np.ndarray:
+    """Condensed indices (sorted) of the pairs to be calculated exactly in the two-phase mode: the pairs of each
+    document and its `neighbors` nearest documents by the estimated distances `darr`, and the pairs whose estimated
+    distances are `threshold` or less.
+    """
+    selected = np.zeros(len(darr), dtype=bool)
+    if threshold is not None:
+        selected |= darr <= threshold
+    k = min(neighbors, n - 1)
+    if k > 0:
+        for i in range(n):
+            row = condensed_row(n, i)
+            selected[row[np.argpartition(darr[row], k - 1)[:k]]] = True
+    return np.flatnonzero(selected)
+
+
+@dataclass
+class ApproxAccuracy:
+    pairs: int
+    mean_abs_error: float
+    mean_rel_error: float
+    correlation: float
+
+    def format(self) -> str:
+        return "%d sampled pairs: mean absolute error %.1f, mean relative error %.1f%%, correlation %.3f" % (
+            self.pairs,
+            self.mean_abs_error,
+            self.mean_rel_error * 100,
+            self.correlation,
+        )
+
+
+def sample_exact_distances(
+    idocs: Sequence[Sequence[int]],
+    distance_function: DistanceFunction = distance_int_list,
+    sample_size: int = ACCURACY_SAMPLE_SIZE,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Condensed indices (sorted) of randomly sampled pairs and their exact distances."""
+    n = len(idocs)
+    rng = np.random.default_rng(seed)
+    ks = np.sort(rng.choice(condensed_size(n), size=min(sample_size, condensed_size(n)), replace=False))
+    exact = np.empty(len(ks), dtype=np.float64)
+    for p, k in enumerate(ks.tolist()):
+        i, j = condensed_pair(n, k)
+        exact[p] = distance_function(idocs[i], idocs[j])
+    return ks, exact
+
+
+def measure_accuracy(estimated: np.ndarray, exact: np.ndarray) -> Optional[ApproxAccuracy]:
+    if len(exact) == 0:
+        return None
+    errors = np.abs(estimated - exact)
+    rel_errors = errors / np.maximum(exact, 1)
+    if len(exact) >= 2 and np.std(estimated) > 0 and np.std(exact) > 0:
+        correlation = float(np.corrcoef(estimated, exact)[0, 1])
+    else:
+        correlation = float("nan")
+    return ApproxAccuracy(len(exact), float(errors.mean()), float(rel_errors.mean()), correlation)
+
+
+def sample_accuracy(
+    idocs: Sequence[Sequence[int]],
+    darr: np.ndarray,
+    distance_function: DistanceFunction = distance_int_list,
+    sample_size: int = ACCURACY_SAMPLE_SIZE,
+    seed: int = 0,
+) -> Optional[ApproxAccuracy]:
+    """Compare the estimated distances `darr` with the exact distances of randomly sampled pairs."""
+    ks, exact = sample_exact_distances(idocs, distance_function, sample_size, seed)
+    return measure_accuracy(darr[ks], exact)
+
+
+def calibrate_estimates(
+    darr: np.ndarray, estimated: np.ndarray, exact: np.ndarray, bins: int = CALIBRATION_BINS
+) -> np.ndarray:
+    """Map the estimated distances `darr` to the scale of exact distances, by a monotone piecewise-linear function
+    through the medians of the exact distances of the pairs (`estimated`, `exact`), binned by the estimates.
+    """
+    if len(exact) == 0:
+        return darr.copy()
+    order = np.argsort(estimated, kind="stable")
+    groups = np.array_split(order, min(bins, len(order)))
+    xs = np.array([estimated[g].mean() for g in groups])
+    ys = np.maximum.accumulate(np.array([np.median(exact[g]) for g in groups]))
+    return np.interp(darr, xs, ys)
@@ -1,10 +1,16 @@
-from typing import List, Tuple, Union
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Pattern, Tuple, Union
 
 from bisect import bisect
+import fnmatch
 import os
 import re
-import sys
+import threading
+import time
 
+import numpy as np
+import pygments
+import pygments.lexer
 import pygments.lexers
 import pygments.token
 import pygments.util
@@ -80,7 +86,8 @@ def char_type(c: str) -> Union[str, None]:
     return bcn[2]
 
 
-def text_split_by_char_type(text: str) -> List[str]:
+def text_split_by_char_type_python(text: str) -> List[str]:
+    """Reference implementation of `text_split_by_char_type()`, calling `char_type()` for every character."""
     last_c_type = None
     r = [""]
     for c in text:
@@ -94,25 +101,179 @@ def text_split_by_char_type(text: str) -> List[str]:
     return r
 
 
-def text_split(text: str, filename: str) -> List[str]:
-    lexer = None
+def _setup_class_tables():
+    # Class ids of `char_type()`: 0 for None (can not determine), the others are given by the names, so that
+    # adjacent blocks of the same normalized name are one class, as the comparison of the names.
+    class_ids = {None: 0}
+    for name in ["BL ctrl", "BO punct", "BL alpha", "BL num", "BL space", "BL print"]:
+        class_ids[name] = len(class_ids)
+    for _cp_from, _cp_to, name in _block_cp_names:
+        class_ids.setdefault(name, len(class_ids))
+
+    bmp_classes = np.zeros(0x10000, dtype=np.uint16)  # code point -> class id in the BMP
+    for cp_from, cp_to, name in _block_cp_names:
+        if cp_from < 0x10000:
+            bmp_classes[cp_from : min(cp_to, 0xFFFF) + 1] = class_ids[name]
+    for cp in range(0x80):
+        bmp_classes[cp] = class_ids[char_type(chr(cp))]
+
+    # block ranges above the BMP, for a binary search
+    blocks = [(cp_from, cp_to, class_ids[name]) for cp_from, cp_to, name in _block_cp_names if cp_to >= 0x10000]
+    block_froms = np.array([b[0] for b in blocks], dtype=np.int64)
+    block_tos = np.array([b[1] for b in blocks], dtype=np.int64)
+    block_classes = np.array([b[2] for b in blocks], dtype=np.uint16)
+    return bmp_classes, block_froms, block_tos, block_classes
+
+
+_bmp_classes, _block_froms, _block_tos, _block_classes = _setup_class_tables()
+
+
+def _char_classes(text: str) -> np.ndarray:
+    codes = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32).astype(np.int64)
+    classes = _bmp_classes[np.minimum(codes, 0xFFFF)]
+    astral = np.flatnonzero(codes > 0xFFFF)
+    if len(astral) > 0:
+        cps = codes[astral]
+        i = np.searchsorted(_block_froms, cps, side="right") - 1
+        found = (i >= 0) & (cps <= _block_tos[np.maximum(i, 0)])
+        classes[astral] = np.where(found, _block_classes[np.maximum(i, 0)], 0)
+    return classes
+
+
+def text_split_by_char_type(text: str) -> List[str]:
+    """Split the text into runs of characters of the same `char_type()`."""
+    if not text:
+        return [""]
+    classes = _char_classes(text)
+    bounds = np.flatnonzero(classes[1:] != classes[:-1]) + 1
+    starts = [0] + bounds.tolist()
+    ends = bounds.tolist() + [len(text)]
+    return [text[b:e] for b, e in zip(starts, ends)]
+
+
+@dataclass
+class TokenizeStats:
+    """Counters of `text_split()`: lexer lookups in the registry of Pygments (the others are found in the cache
+    of lexers), the time of the lookups and of tokenizing, and the files without a lexer by cache key.
+    """
+
+    files: int = 0
+    lexer_lookups: int = 0
+    lookup_time: float = 0.0
+    tokenize_time: float = 0.0
+    unknown_lexers: Dict[str, int] = field(default_factory=dict)
+
+    def merge(self, other: "TokenizeStats") -> None:
+        self.files += other.files
+        self.lexer_lookups += other.lexer_lookups
+        self.lookup_time += other.lookup_time
+        self.tokenize_time += other.tokenize_time
+        for key, count in other.unknown_lexers.items():
+            self.unknown_lexers[key] = self.unknown_lexers.get(key, 0) + count
+
+    def format(self) -> str:
+        return "%d files, %d lexer lookups (%.2f s), tokenizing %.2f s" % (
+            self.files,
+            self.lexer_lookups,
+            self.lookup_time,
+            self.tokenize_time,
+        )
+
+    def format_unknown_lexers(self) -> str:
+        keys = sorted(self.unknown_lexers, key=lambda k: (-self.unknown_lexers[k], k))
+        return "Lexer not found for %d files (%s), split by character type" % (
+            sum(self.unknown_lexers.values()),
+            ", ".join("%s: %d" % (k, self.unknown_lexers[k]) for k in keys),
+        )
+
+
+_tokenize_stats = TokenizeStats()
+_tokenize_stats_lock = threading.Lock()
+
+
+def take_tokenize_stats() -> TokenizeStats:
+    """Return the counters of `text_split()` in this process since the last call, and reset them."""
+    global _tokenize_stats
+    with _tokenize_stats_lock:
+        stats = _tokenize_stats
+        _tokenize_stats = TokenizeStats()
+    return stats
+
+
+_lexer_cache: Dict[str, Optional[pygments.lexer.Lexer]] = dict()
+_special_filename_re: Optional[Pattern[str]] = None
+
+
+def _lexer_cache_key(filename: str) -> str:
+    # Lexers are cached by the extension ("*.py"), except for the file names matching a filename pattern of a
+    # lexer other than "*.ext" (e.g. "Makefile.*", "CMakeLists.txt", "*.css.j2"), which are cached by the name.
+    global _special_filename_re
+    if _special_filename_re is None:
+        simple = re.compile(r"\*\.[^*?\[\].]+\Z")
+        patterns = [p for _n, _a, fns, _m in pygments.lexers.get_all_lexers(plugins=True) for p in fns]
+        special = [fnmatch.translate(p) for p in patterns if not simple.match(p)]
+        _special_filename_re = re.compile("|".join(special) if special else r"(?!)")
+    name = os.path.basename(filename)
+    ext = os.path.splitext(name)[1]
+    if not ext or _special_filename_re.match(name):
+        return name
+    return "*" + ext
+
+
+def _find_lexer(filename: str, stats: TokenizeStats) -> Optional[pygments.lexer.Lexer]:
+    key = _lexer_cache_key(filename)
+    if key in _lexer_cache:
+        return _lexer_cache[key]
+    stats.lexer_lookups += 1
     try:
         lexer = pygments.lexers.get_lexer_for_filename(filename)
     except pygments.util.ClassNotFound:
-        print("> Warning: Lexer not found for file: %s" % filename, file=sys.stderr)
-        return text_split_by_char_type(text)  # fall back
-
-    tokens = lexer.get_tokens(text)
-    words = []
-    for t in tokens:
-        token_type = t[0]
-        token_str = t[1]
-        if token_type in pygments.token.Text:
-            pass
-        elif token_type in pygments.token.String or token_type in pygments.token.Comment:
-            words.extend(token_str.split())
-        else:
-            words.append(token_str)
+        lexer = None
+    _lexer_cache[key] = lexer
+    return lexer
+
+
+def lexer_name(filename: str) -> str:
+    """Name and version of the lexer of `text_split()` for the file name (for the keys of the token cache)."""
+    stats = TokenizeStats()
+    t0 = time.perf_counter()
+    lexer = _find_lexer(filename, stats)
+    stats.lookup_time = time.perf_counter() - t0
+    with _tokenize_stats_lock:
+        _tokenize_stats.merge(stats)
+    return "%s/%s" % (lexer.name if lexer is not None else "-", pygments.__version__)
+
+
+def text_split(text: str, filename: str) -> List[str]:
+    """Split the text into the tokens of the Pygments lexer for the file name, dropping whitespace and splitting
+    strings and comments by whitespace. Lexers are looked up once per extension, and reused. Without a lexer, the
+    text is split by character type; the files are counted in the `TokenizeStats` (see `take_tokenize_stats()`)
+    instead of a warning for each file.
+    """
+    stats = TokenizeStats(files=1)
+    t0 = time.perf_counter()
+    lexer = _find_lexer(filename, stats)
+    t1 = time.perf_counter()
+    stats.lookup_time = t1 - t0
+    if lexer is None:
+        key = _lexer_cache_key(filename)
+        stats.unknown_lexers[key] = 1
+        words = text_split_by_char_type(text)  # fall back
+    else:
+        tokens = lexer.get_tokens(text)
+        words = []
+        for t in tokens:
+            token_type = t[0]
+            token_str = t[1]
+            if token_type in pygments.token.Text:
+                pass
+            elif token_type in pygments.token.String or token_type in pygments.token.Comment:
+                words.extend(token_str.split())
+            else:
+                words.append(token_str)
+    stats.tokenize_time = time.perf_counter() - t1
+    with _tokenize_stats_lock:
+        _tokenize_stats.merge(stats)
     return words
 
 
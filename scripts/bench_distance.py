@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Compare the speed of the distance engines on long token sequences.
+
+Usage:
+  python scripts/bench_distance.py [LENGTH...]
+"""
+
+import random
+import sys
+import time
+
+from dendro_text import dld
+
+
+def gen_pair(length, vocabulary_size=200, edit_ratio=0.1, seed=0):
+    rand = random.Random(seed)
+    s1 = [rand.randrange(1, vocabulary_size + 1) for _ in range(length)]
+    s2 = s1[:]
+    for _ in range(int(length * edit_ratio)):
+        i = rand.randrange(len(s2))
+        op = rand.randrange(3)
+        if op == 0:
+            s2[i] = rand.randrange(1, vocabulary_size + 1)
+        elif op == 1:
+            del s2[i]
+        else:
+            s2.insert(i, rand.randrange(1, vocabulary_size + 1))
+    return s1, s2
+
+
+def measure(distance_function, s1, s2, repeat=3):
+    distance_function(s1[:10], s2[:10])  # warm up, e.g. JIT compilation
+    best = None
+    d = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        d = distance_function(s1, s2)
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return d, best
+
+
+def main():
+    lengths = [int(a) for a in sys.argv[1:]] or [1000, 4000, 16000]
+    engines = [
+        ("dp/python", dld.distance_int_list_python),
+        ("bitparallel/python", dld.distance_int_list_bitparallel_python),
+    ]
+    if dld.distance_int_list_numba is not None:
+        engines.append(("dp/numba", dld.distance_int_list_numba))
+        engines.append(("bitparallel/numba", dld.distance_int_list_bitparallel_numba))
+
+    baseline_name = "dp/numba" if dld.distance_int_list_numba is not None else "dp/python"
+
+    print("length\tengine\tdistance\tseconds\tspeedup (vs %s)" % baseline_name)
+    for length in lengths:
+        s1, s2 = gen_pair(length)
+        results = []
+        for name, distance_function in engines:
+            if name == "dp/python" and name != baseline_name and length > 4000:
+                continue  # too slow to be measured repeatedly
+            d, elapsed = measure(distance_function, s1, s2)
+            results.append((name, d, elapsed))
+        baseline = [elapsed for name, d, elapsed in results if name == baseline_name][0]
+        for name, d, elapsed in results:
+            print("%d\t%s\t%d\t%.4f\t%.1fx" % (length, name, d, elapsed, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
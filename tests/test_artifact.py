@@ -0,0 +1,192 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import numpy as np
+
+from dendro_text.artifact import (
+    Checkpoint,
+    DendrogramArtifact,
+    ShardArtifact,
+    fill_from_artifact,
+    load_artifact,
+    load_checkpoint,
+    load_shard,
+    merge_shards,
+    save_artifact,
+    save_checkpoint,
+    save_shard,
+    shard_order,
+)
+from dendro_text.main import LabelNode, calc_dendrogram, gen_leaf_node_formatter, print_dendrogram
+
+
+class TestArtifact(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "matrix.npz")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_save_and_load(self):
+        idocs = [[1], [1, 2], [3, 4, 5]]
+        darr = np.array([1.0, 3.0, 3.0])
+        artifact = DendrogramArtifact(
+            labels=[("a.txt",), ("b.txt", "c.txt"), ("d.txt",)],
+            distances=darr,
+            linkage=calc_dendrogram(idocs),
+            digests=["x", "y", "z"],
+            mode="char",
+        )
+        save_artifact(self.path, artifact)
+        loaded = load_artifact(self.path)
+
+        self.assertEqual(loaded.labels, artifact.labels)
+        self.assertEqual(loaded.distances.tolist(), darr.tolist())
+        self.assertEqual(loaded.linkage.tolist(), artifact.linkage.tolist())
+        self.assertEqual(loaded.digests, ["x", "y", "z"])
+        self.assertEqual(loaded.mode, "char")
+        self.assertEqual(loaded.label_strs(), ["a.txt", "b.txt,c.txt", "d.txt"])
+
+    def test_print_dendrogram_accepts_artifact(self):
+        idocs = [[1], [1, 2], [3, 4, 5]]
+        labels = [LabelNode("a"), LabelNode("b"), LabelNode("c")]
+        result = calc_dendrogram(idocs)
+        artifact = DendrogramArtifact(
+            labels=[label.items for label in labels], distances=np.zeros(3), linkage=result, digests=[], mode="char"
+        )
+        format_leaf_node = gen_leaf_node_formatter(",", " ")
+
+        root_nodes = []
+        for args in [(result, labels), (artifact, None)]:
+            with patch("dendro_text.main.print_tree") as print_tree:
+                print_dendrogram(*args, format_leaf_node)
+            root_nodes.append(print_tree.call_args[0][0])
+        self.assertEqual(root_nodes[0], root_nodes[1])
+        self.assertEqual(root_nodes[0], [[LabelNode("b"), LabelNode("a")], LabelNode("c")])
+
+    def test_fill_from_artifact_by_content_hash(self):
+        # documents a, b, c of the previous run: d(a, b) = 1, d(a, c) = 2, d(b, c) = 3
+        previous = DendrogramArtifact(
+            labels=[("a",), ("b",), ("c",)],
+            distances=np.array([1.0, 2.0, 3.0]),
+            linkage=np.zeros((2, 4)),
+            digests=["ha", "hb", "hc"],
+            mode="char",
+        )
+        # b is removed, d is added, and the order changes
+        darr = np.full(3, np.nan)
+        copied = fill_from_artifact(darr, ["hc", "hd", "ha"], previous)
+        self.assertEqual(copied, 1)
+        self.assertEqual(darr[1], 2.0)  # (c, a)
+        self.assertTrue(np.isnan(darr[0]) and np.isnan(darr[2]))
+        # a vector of the slice of the pairs: (c, d) and (d, a), then (c, a)
+        darr = np.full(2, np.nan)
+        self.assertEqual(fill_from_artifact(darr, ["hc", "hd", "ha"], previous, slice(0, None, 2)), 0)
+        darr = np.full(1, np.nan)
+        self.assertEqual(fill_from_artifact(darr, ["hc", "hd", "ha"], previous, slice(1, None, 2)), 1)
+        self.assertEqual(darr.tolist(), [2.0])
+
+    def test_calc_dendrogram_reuses_previous_distances(self):
+        idocs = [[1], [1, 2], [3, 4, 5]]
+        previous = DendrogramArtifact(
+            labels=[("a",), ("b",)], distances=np.array([100.0]), linkage=np.zeros((1, 4)), digests=["h1", "h2"], mode=""
+        )
+        darr = np.full(3, np.nan)
+        calc_dendrogram(idocs, darr=darr, previous=previous, digests=["h1", "h2", "h3"])
+        self.assertEqual(darr.tolist(), [100.0, 3.0, 3.0])
+
+    def test_load_rejects_other_files(self):
+        np.savez(self.path, something=np.zeros(1))
+        with self.assertRaises(ValueError):
+            load_artifact(self.path)
+
+
+
+class TestShard(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_shards(self, shard_count):
+        # documents a, b, c, d in the input order, with the distances of the pairs of the condensed vector below
+        digests = ["h3", "h1", "h4", "h2"]
+        full = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0])  # (a,b), (a,c), (a,d), (b,c), (b,d), (c,d)
+        order = shard_order(digests)
+        self.assertEqual(order, [1, 3, 0, 2])
+        n = len(digests)
+        sorted_darr = np.empty_like(full)
+        previous = DendrogramArtifact(
+            labels=[("a",), ("b",), ("c",), ("d",)], distances=full, linkage=np.zeros((0, 4)), digests=digests, mode=""
+        )
+        fill_from_artifact(sorted_darr, [digests[p] for p in order], previous)
+        shards = []
+        for k in range(1, shard_count + 1):
+            shards.append(
+                ShardArtifact(
+                    labels=[(("a",), ("b",), ("c",), ("d",))[p] for p in order],
+                    digests=[digests[p] for p in order],
+                    mode="char",
+                    shard=k,
+                    shard_count=shard_count,
+                    distances=sorted_darr[k - 1 :: shard_count],
+                    positions=np.array(order),
+                )
+            )
+        self.assertEqual(sum(len(s.distances) for s in shards), n * (n - 1) // 2)
+        return full, shards
+
+    def test_save_and_load(self):
+        _full, shards = self.make_shards(2)
+        path = os.path.join(self.temp_dir.name, "shard.npz")
+        save_shard(path, shards[1])
+        loaded = load_shard(path)
+        self.assertEqual(loaded.labels, shards[1].labels)
+        self.assertEqual(loaded.digests, shards[1].digests)
+        self.assertEqual((loaded.mode, loaded.shard, loaded.shard_count), ("char", 2, 2))
+        self.assertEqual(loaded.distances.tolist(), shards[1].distances.tolist())
+        self.assertEqual(loaded.positions.tolist(), shards[1].positions.tolist())
+        with self.assertRaises(ValueError):
+            load_artifact(path)
+
+    def test_merge_restores_input_order(self):
+        full, shards = self.make_shards(3)
+        labels, digests, mode, darr = merge_shards(shards[::-1])
+        self.assertEqual(labels, [("a",), ("b",), ("c",), ("d",)])
+        self.assertEqual(digests, ["h3", "h1", "h4", "h2"])
+        self.assertEqual(mode, "char")
+        self.assertEqual(darr.tolist(), full.tolist())
+
+    def test_merge_rejects_incomplete_shards(self):
+        _full, shards = self.make_shards(3)
+        with self.assertRaises(ValueError):
+            merge_shards(shards[:2])
+        with self.assertRaises(ValueError):
+            merge_shards(shards + shards[:1])
+        other = ShardArtifact(**{**shards[2].__dict__, "mode": "line"})
+        with self.assertRaises(ValueError):
+            merge_shards(shards[:2] + [other])
+
+
+
+class TestCheckpoint(unittest.TestCase):
+    def test_save_and_load(self):
+        with TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "checkpoint.npz")
+            checkpoint = Checkpoint(digests=["x", "y", "z"], mode="char", scope="all", distances=np.array([1.0, np.nan, 2.0]))
+            save_checkpoint(path, checkpoint)
+            self.assertEqual(os.listdir(temp_dir), ["checkpoint.npz"])
+            loaded = load_checkpoint(path)
+        self.assertTrue(loaded.matches(["x", "y", "z"], "char", "all"))
+        self.assertFalse(loaded.matches(["y", "x", "z"], "char", "all"))
+        self.assertFalse(loaded.matches(["x", "y", "z"], "line", "all"))
+        self.assertFalse(loaded.matches(["x", "y", "z"], "char", "1/2"))
+        np.testing.assert_array_equal(loaded.distances, checkpoint.distances)
+
+
+if __name__ == "__main__":
+    unittest.main()
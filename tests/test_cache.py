@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from dendro_text.cache import (
+    DistanceCache,
+    TokenCache,
+    decode_token_doc,
+    encode_token_doc,
+    int_doc_digests,
+    token_cache_key,
+    token_digest,
+)
+from dendro_text.commands import convert_to_int_docs
+
+
+class TestTokenDigest(unittest.TestCase):
+    def test_digest_depends_on_token_split(self):
+        self.assertNotEqual(token_digest(["ab", "c"]), token_digest(["a", "bc"]))
+        self.assertEqual(token_digest(["ab", "c"]), token_digest(["ab", "c"]))
+
+    def test_int_doc_digests_do_not_depend_on_vocabulary(self):
+        idocs1, word_to_index1 = convert_to_int_docs([["b", "c"], ["a"]])
+        idocs2, word_to_index2 = convert_to_int_docs([["b", "c"], ["z"]])
+        self.assertNotEqual(idocs1[0], idocs2[0])
+        self.assertEqual(int_doc_digests(idocs1, word_to_index1)[0], int_doc_digests(idocs2, word_to_index2)[0])
+        self.assertEqual(int_doc_digests(idocs1, word_to_index1)[0], token_digest(["b", "c"]))
+
+
+class TestDistanceCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_store_and_lookup_across_instances(self):
+        with DistanceCache(self.path) as cache:
+            cache.store([("b", "a", 3), ("a", "c", 5)], "char")
+            self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+        with DistanceCache(self.path) as cache:
+            self.assertEqual(sorted(cache.lookup_pairs(["c", "a", "b"], "char")), [(0, 1, 5), (1, 2, 3)])
+            self.assertEqual(cache.lookup_query(["a", "b", "c", "d"], 0, "char"), {1: 3, 2: 5})
+            self.assertEqual(list(cache.lookup_pairs(["a", "b"], "line")), [])
+            self.assertEqual((cache.hits, cache.misses), (4, 3))
+            # the pairs of the same content are not counted
+            self.assertEqual(sorted(cache.lookup_pairs(["a", "b", "a"], "char")), [(0, 1, 3), (1, 2, 3)])
+            self.assertEqual(cache.lookup_query(["a", "a", "d"], 0, "char"), {})
+            self.assertEqual((cache.hits, cache.misses), (6, 4))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        with DistanceCache(self.path, max_entries=2) as cache:
+            cache.store([("a", "b", 1)], "char")
+        with DistanceCache(self.path, max_entries=2) as cache:
+            cache.store([("a", "c", 2)], "char")
+        with DistanceCache(self.path, max_entries=2) as cache:
+            self.assertEqual(list(cache.lookup_pairs(["a", "b"], "char")), [(0, 1, 1)])  # makes a-b recently used
+            cache.store([("b", "c", 3)], "char")
+            self.assertEqual(sorted(cache.lookup_pairs(["a", "b", "c"], "char")), [(0, 1, 1), (1, 2, 3)])
+            self.assertEqual(cache.evicted, 1)
+
+    def test_entries_of_this_run_are_not_evicted(self):
+        with DistanceCache(self.path, max_entries=2) as cache:
+            cache.store([("a", "b", 1), ("a", "c", 2), ("b", "c", 3)], "char")
+            self.assertEqual((cache.evicted, cache.format_stats()), (0, "0 hits, 0 misses, 0 evicted, 3 entries"))
+        with DistanceCache(self.path, max_entries=2) as cache:
+            self.assertEqual(cache.lookup_query(["a", "b", "d"], 0, "char"), {1: 1})
+            cache.store([("a", "d", 4)], "char")
+            self.assertEqual(cache.evicted, 2)
+            self.assertEqual(sorted(cache.lookup_pairs(["a", "b", "c", "d"], "char")), [(0, 1, 1), (0, 3, 4)])
+
+    def test_cache_of_another_format_is_dropped(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE distances (key_a TEXT, key_b TEXT, mode TEXT, distance INTEGER)")
+        conn.commit()
+        conn.close()
+        with DistanceCache(self.path) as cache:
+            cache.store([("a", "b", 1)], "char")
+            self.assertEqual(list(cache.lookup_pairs(["a", "b"], "char")), [(0, 1, 1)])
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "tokens.sqlite")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_encode_and_decode(self):
+        words = ["", "a\x00b", "日本", "\udc80", "😀", "line\n"]
+        ids = np.array([1, 0, 2, 2, 3, 4, 5, 1], dtype=np.int64)
+        decoded_words, decoded_ids = decode_token_doc(encode_token_doc(words, ids))
+        self.assertEqual(decoded_words, words)
+        self.assertEqual(decoded_ids.tolist(), ids.tolist())
+        self.assertEqual(decode_token_doc(encode_token_doc([], np.zeros(0)))[0], [])
+
+    def test_key_depends_on_mode_lexer_and_prep(self):
+        key = token_cache_key("0123", "tokenize", "Python/2.19", [])
+        self.assertNotEqual(key, token_cache_key("0123", "char-type", "Python/2.19", []))
+        self.assertNotEqual(key, token_cache_key("0123", "tokenize", "Python/2.20", []))
+        self.assertNotEqual(key, token_cache_key("0123", "tokenize", "Python/2.19", ["cat"]))
+        self.assertNotEqual(key, token_cache_key("4567", "tokenize", "Python/2.19", []))
+
+    def test_store_lookup_and_evict(self):
+        with TokenCache(self.path, max_entries=2) as cache:
+            cache.store([("k1", ["a", "b"], np.array([0, 1, 0])), ("k2", ["c"], np.array([0]))])
+        with TokenCache(self.path, max_entries=2) as cache:
+            found = cache.lookup(["k0", "k2"])  # makes k2 recently used
+            self.assertEqual(list(found), [1])
+            self.assertEqual((found[1][0], found[1][1].tolist()), (["c"], [0]))
+            cache.store([("k3", ["d"], np.array([0]))])
+            self.assertEqual(sorted(cache.lookup(["k1", "k2", "k3"])), [1, 2])
+            self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
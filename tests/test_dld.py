@@ -1,9 +1,22 @@
 import os
+import random
 import subprocess
 import sys
 import unittest
 
-from dendro_text.dld import EditOp, distance_int_list, distance_int_list_python, edit_sequence_int_list
+import dendro_text.dld as dld
+from dendro_text.dld import (
+    EditOp,
+    distance_int_list,
+    distance_int_list_banded_python,
+    distance_int_list_bitparallel_python,
+    distance_int_list_python,
+    edit_sequence_int_list,
+    edit_sequence_int_list_python,
+    pack_int_docs,
+    select_distance_function,
+    to_int_arrays,
+)
 
 
 class TestDistanceIntList(unittest.TestCase):
@@ -54,6 +67,84 @@ class TestDistanceIntList(unittest.TestCase):
         self.assertEqual(dld.distance_int_list([1, 2, 3], [1, 3]), 1)
 
 
+class TestBitParallelDistance(unittest.TestCase):
+    def gen_examples(self):
+        rand = random.Random(0)
+        examples = [([], []), ([1], []), ([], [1]), ([1, 2], [2, 1])]
+        for _ in range(200):
+            vocabulary_size = rand.choice([2, 5, 50])
+            s1 = [rand.randrange(1, vocabulary_size + 1) for _ in range(rand.randrange(0, 150))]
+            s2 = [rand.randrange(1, vocabulary_size + 1) for _ in range(rand.randrange(0, 150))]
+            examples.append((s1, s2))
+        return examples
+
+    def test_python_engine_matches_reference(self):
+        for s1, s2 in self.gen_examples():
+            with self.subTest(s1=s1, s2=s2):
+                self.assertEqual(distance_int_list_bitparallel_python(s1, s2), distance_int_list_python(s1, s2))
+
+    def test_numba_engine_matches_reference_if_available(self):
+        if dld.distance_int_list_bitparallel_numba is None:
+            self.skipTest("Numba is not installed")
+        for s1, s2 in self.gen_examples():
+            with self.subTest(s1=s1, s2=s2):
+                self.assertEqual(dld.distance_int_list_bitparallel_numba(s1, s2), distance_int_list_python(s1, s2))
+
+    def test_select_distance_function(self):
+        self.assertIs(select_distance_function("dp", use_numba=False), distance_int_list_python)
+        self.assertIs(select_distance_function("bitparallel", use_numba=False), distance_int_list_bitparallel_python)
+        with self.assertRaises(ValueError):
+            select_distance_function("unknown")
+
+
+class TestBoundedDistance(unittest.TestCase):
+    def test_bounded_distance_is_exact_within_bound(self):
+        rand = random.Random(1)
+        distance_functions = [
+            select_distance_function(engine, use_numba=use_numba)
+            for engine in dld.DISTANCE_ENGINES
+            for use_numba in [False, True]
+        ]
+        for _ in range(100):
+            s1 = [rand.randrange(1, 4) for _ in range(rand.randrange(0, 100))]
+            s2 = [rand.randrange(1, 4) for _ in range(rand.randrange(0, 100))]
+            d = distance_int_list_python(s1, s2)
+            for max_dist in [0, 1, d - 1, d, d + 1]:
+                if max_dist < 0:
+                    continue
+                expected = d if d <= max_dist else max_dist + 1
+                for distance_function in distance_functions:
+                    with self.subTest(s1=s1, s2=s2, max_dist=max_dist, distance_function=distance_function):
+                        self.assertEqual(distance_function(s1, s2, max_dist), expected)
+
+    def test_banded_distance(self):
+        self.assertEqual(distance_int_list_banded_python([1, 2, 3], [1, 3], 1), 1)
+        self.assertEqual(distance_int_list_banded_python([1, 2, 3], [4, 5, 6], 1), 2)
+        self.assertEqual(distance_int_list_banded_python([1] * 10, [], 3), 4)
+
+
+class TestIntArrays(unittest.TestCase):
+    def test_pack_int_docs(self):
+        tokens, offsets = pack_int_docs([[1, 2], [], [3]])
+        self.assertEqual(tokens.tolist(), [1, 2, 3])
+        self.assertEqual(offsets.tolist(), [0, 2, 2, 3])
+
+    def test_to_int_arrays_share_one_buffer(self):
+        arrays = to_int_arrays([[1, 2], [], [3]])
+        self.assertEqual([a.tolist() for a in arrays], [[1, 2], [], [3]])
+        self.assertTrue(all(a.dtype == dld.INT_DOC_DTYPE for a in arrays))
+        self.assertIs(arrays[0].base, arrays[2].base)
+
+    def test_engines_accept_int_arrays(self):
+        s1, s2 = to_int_arrays([[1, 2, 3, 2], [1, 4, 2]])
+        for engine in dld.DISTANCE_ENGINES:
+            for use_numba in [False, True]:
+                with self.subTest(engine=engine, use_numba=use_numba):
+                    distance_function = select_distance_function(engine, use_numba=use_numba)
+                    self.assertEqual(distance_function(s1, s2), 2)
+                    self.assertEqual(distance_function(s1[:0], s2), 3)
+
+
 class TestPurePythonFallback(unittest.TestCase):
     def test_fallback_when_numba_import_fails(self):
         project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -129,6 +220,43 @@ class TestEditSequenceIntList(unittest.TestCase):
         s = edit_sequence_int_list(list2, list1m3)
         self.assertSequenceEqual(s, [2, 0, 3, 3, 3])
 
+    def test_same_as_full_table_for_small_inputs(self):
+        rng = random.Random(3)
+        for _ in range(300):
+            list1 = [rng.randint(1, 3) for _ in range(rng.randint(0, 12))]
+            list2 = [rng.randint(1, 3) for _ in range(rng.randint(0, 12))]
+            expected = edit_sequence_int_list_python(list1, list2)
+            for use_numba in [False, True]:
+                self.assertEqual(edit_sequence_int_list(list1, list2, use_numba=use_numba), expected)
+
+    def check_edit_sequence(self, list1, list2, edit_sequence):
+        i = j = 0
+        for op in edit_sequence:
+            if op in (EditOp.NO_EDIT, EditOp.SUB):
+                self.assertEqual(list1[i] == list2[j], op == EditOp.NO_EDIT)
+            i += op != EditOp.INS
+            j += op != EditOp.DEL
+        self.assertEqual((i, j), (len(list1), len(list2)))
+        self.assertEqual(sum(op != EditOp.NO_EDIT for op in edit_sequence), distance_int_list(list1, list2))
+
+    def test_linear_memory_engine(self):
+        rng = random.Random(5)
+        saved = dld.EDIT_TABLE_CELLS
+        dld.EDIT_TABLE_CELLS = 50  # read by the pure-Python version only
+        try:
+            for _ in range(100):
+                list1 = [rng.randint(1, 3) for _ in range(rng.randint(0, 60))]
+                list2 = [rng.randint(1, 3) for _ in range(rng.randint(0, 60))]
+                self.check_edit_sequence(list1, list2, edit_sequence_int_list(list1, list2, use_numba=False))
+        finally:
+            dld.EDIT_TABLE_CELLS = saved
+        list1 = [rng.randint(1, 4) for _ in range(2000)]
+        list2 = list1[:]
+        for _ in range(200):
+            list2.insert(rng.randint(0, len(list2)), rng.randint(1, 5))
+            del list2[rng.randrange(len(list2))]
+        self.check_edit_sequence(list1, list2, edit_sequence_int_list(list1, list2))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,77 @@
+import functools
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from dendro_text.cache import TokenCache
+from dendro_text.commands import convert_to_int_docs
+from dendro_text.ingest import read_int_docs
+from dendro_text.ts import TokenizeStats, text_split, text_split_by_char_type
+
+
+def read_doc(filename):
+    with open(filename) as inp:
+        return text_split_by_char_type(inp.read())
+
+
+def read_doc_tokenized(filename):
+    with open(filename) as inp:
+        return text_split(inp.read(), filename.replace(".txt", ".unknown-extension"))
+
+
+def read_doc_or_exit(filename, bad):
+    if filename == bad:
+        raise SystemExit("Error in reading a file: %s" % repr(filename))
+    return read_doc(filename)
+
+
+class TestReadIntDocs(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.files = []
+        for i in range(23):
+            filename = os.path.join(self.temp_dir.name, "%02d.txt" % i)
+            with open(filename, "w") as outp:
+                outp.write(" ".join("w%d" % ((i * k) % 17) for k in range(i)) + "\n" + "日本語" * (i % 3))
+            self.files.append(filename)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_same_as_convert_to_int_docs(self):
+        expected = convert_to_int_docs([read_doc(f) for f in self.files])
+        for workers, backend in [(None, "process"), (3, "process"), (3, "thread")]:
+            self.assertEqual(read_int_docs(self.files, read_doc, workers=workers, backend=backend), expected)
+        self.assertEqual(read_int_docs([], read_doc, workers=3), ([], {}))
+
+    def test_tokenize_stats_of_workers(self):
+        for workers, backend in [(None, "process"), (3, "process"), (3, "thread")]:
+            stats = TokenizeStats()
+            read_int_docs(self.files, read_doc_tokenized, workers=workers, backend=backend, stats=stats)
+            self.assertEqual(stats.files, len(self.files))
+            self.assertEqual(stats.unknown_lexers, {"*.unknown-extension": len(self.files)})
+
+    def test_token_cache(self):
+        expected = convert_to_int_docs([read_doc(f) for f in self.files])
+        keys = ["key-%s" % os.path.basename(f) for f in self.files]
+        path = os.path.join(self.temp_dir.name, "tokens.sqlite")
+        with TokenCache(path) as cache:
+            read = functools.partial(read_doc_or_exit, bad=None)
+            result = read_int_docs(self.files[::2], read, workers=3, token_cache=cache, cache_keys=keys[::2])
+            self.assertEqual(result, convert_to_int_docs([read_doc(f) for f in self.files[::2]]))
+        with TokenCache(path) as cache:
+            # the cached files are not read again
+            read = functools.partial(read_doc_or_exit, bad=self.files[0])
+            self.assertEqual(read_int_docs(self.files, read, workers=3, token_cache=cache, cache_keys=keys), expected)
+            self.assertEqual((cache.hits, cache.misses), (12, 11))
+
+    def test_error_in_worker_exits(self):
+        read = functools.partial(read_doc_or_exit, bad=self.files[5])
+        for workers, backend in [(None, "process"), (3, "process"), (3, "thread")]:
+            with self.assertRaises(SystemExit) as cm:
+                read_int_docs(self.files, read, workers=workers, backend=backend)
+            self.assertIn("Error in reading a file", str(cm.exception.code))
+
+
+if __name__ == "__main__":
+    unittest.main()
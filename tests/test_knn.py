@@ -0,0 +1,60 @@
+import io
+import os
+import random
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from dendro_text.dld import distance_int_list, distance_int_list_python, to_int_arrays
+from dendro_text.knn import KnnGraph, build_knn_graph, save_knn_graph, write_knn_graph_csv
+from dendro_text.neighbors import SearchStats
+
+
+def brute_force_knn(idocs, k):
+    edges = []
+    for q in range(len(idocs)):
+        dds = sorted((distance_int_list_python(idocs[q], idocs[i]), i) for i in range(len(idocs)) if i != q)
+        edges.extend((q, i, d) for d, i in dds[:k])
+    return edges
+
+
+def graph_edges(graph):
+    return list(zip(graph.sources.tolist(), graph.targets.tolist(), graph.distances.tolist()))
+
+
+class TestKnnGraph(unittest.TestCase):
+    def test_same_as_brute_force(self):
+        rand = random.Random(0)
+        idocs = to_int_arrays([[rand.randrange(1, 5) for _ in range(rand.randrange(0, 30))] for _ in range(40)])
+        for k in [1, 3, 50]:
+            with self.subTest(k=k):
+                stats = SearchStats()
+                graph = build_knn_graph(idocs, k, distance_function=distance_int_list_python, stats=stats)
+                self.assertEqual(graph_edges(graph), brute_force_knn(idocs, k))
+                self.assertEqual(stats.exact_calls + stats.pruned, 40 * 39)
+
+    def test_parallel_backends(self):
+        rand = random.Random(1)
+        idocs = to_int_arrays([[rand.randrange(1, 5) for _ in range(rand.randrange(0, 30))] for _ in range(30)])
+        expected = brute_force_knn(idocs, 2)
+        for backend in ["process", "thread"]:
+            with self.subTest(backend=backend):
+                graph = build_knn_graph(idocs, 2, distance_function=distance_int_list, workers=2, backend=backend)
+                self.assertEqual(graph_edges(graph), expected)
+
+    def test_output(self):
+        graph = KnnGraph(np.array([0, 1]), np.array([1, 0]), np.array([3, 3]))
+        outp = io.StringIO()
+        write_knn_graph_csv(outp, graph, ["a.txt", "b,c.txt"])
+        self.assertEqual(outp.getvalue(), 'source,target,distance\na.txt,"b,c.txt",3\n"b,c.txt",a.txt,3\n')
+        with TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "graph.npz")
+            save_knn_graph(path, graph, ["a.txt", "b,c.txt"])
+            with np.load(path) as data:
+                self.assertEqual(data["targets"].tolist(), [1, 0])
+                self.assertEqual(data["labels"].tolist(), ["a.txt", "b,c.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main()
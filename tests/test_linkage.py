@@ -0,0 +1,96 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from scipy.cluster.hierarchy import linkage
+from scipy.spatial.distance import squareform
+
+from dendro_text import linkage as dlinkage
+from dendro_text.knn import KnnGraph
+from dendro_text.linkage import condensed_memmap, knn_mst_linkage, nn_chain_linkage, select_linkage_function
+from dendro_text.main import calc_dendrogram
+
+
+def random_condensed(rng, n):
+    # small integer distances, to have many ties as edit distances do
+    return rng.integers(0, 6, size=n * (n - 1) // 2).astype(np.float64)
+
+
+def full_graph(darr):
+    square = squareform(darr)
+    n = len(square)
+    sources, targets = np.nonzero(~np.eye(n, dtype=bool))
+    return KnnGraph(sources.astype(np.int32), targets.astype(np.int32), square[sources, targets].astype(np.int64))
+
+
+class TestNnChainLinkage(unittest.TestCase):
+    def check_same_as_scipy(self, use_numba):
+        rng = np.random.default_rng(1)
+        for n in [2, 3, 7, 20, 41]:
+            darr = random_condensed(rng, n)
+            saved = darr.copy()
+            for method in ["average", "complete", "weighted"]:
+                z = nn_chain_linkage(darr, n, method, use_numba=use_numba)
+                np.testing.assert_array_equal(z, linkage(darr, method=method))
+            z = nn_chain_linkage(darr, n, "single", use_numba=use_numba)
+            np.testing.assert_array_equal(z[:, 2], linkage(darr, method="single")[:, 2])
+            np.testing.assert_array_equal(darr, saved)
+
+    def test_same_as_scipy(self):
+        self.check_same_as_scipy(use_numba=False)
+
+    def test_numba_same_as_scipy_if_available(self):
+        if dlinkage._nn_chain_i is None:
+            self.skipTest("Numba is not installed")
+        self.check_same_as_scipy(use_numba=True)
+
+    def test_in_place_on_condensed_memmap(self):
+        rng = np.random.default_rng(3)
+        n = 20
+        darr = random_condensed(rng, n)
+        with TemporaryDirectory() as temp_dir:
+            with condensed_memmap(n, dir=temp_dir) as d:
+                self.assertIsInstance(d, np.memmap)
+                self.assertTrue(np.isnan(d).all())
+                d[:] = darr
+                z = nn_chain_linkage(d, n, "average", in_place=True)
+                self.assertFalse(np.array_equal(d, darr))  # the merged clusters are written into it
+            self.assertEqual(os.listdir(temp_dir), [])
+        np.testing.assert_array_equal(z, linkage(darr, method="average"))
+
+    def test_calc_dendrogram_with_linkage_function(self):
+        idocs = [[1, 2, 3], [1, 2], [4, 5, 6, 7], [1, 3], [4, 5]]
+        expected = calc_dendrogram(idocs)
+        result = calc_dendrogram(idocs, linkage_function=select_linkage_function("average", "nn-chain"))
+        np.testing.assert_array_equal(result, expected)
+
+
+class TestKnnMstLinkage(unittest.TestCase):
+    def test_complete_graph_gives_single_linkage(self):
+        rng = np.random.default_rng(2)
+        for n in [2, 5, 30]:
+            darr = random_condensed(rng, n)
+            z = knn_mst_linkage(n, full_graph(darr))
+            expected = linkage(darr, method="single")
+            np.testing.assert_array_equal(z[:, 2], expected[:, 2])  # merges at tied distances may be reordered
+
+    def test_disconnected_groups_are_joined(self):
+        graph = KnnGraph(
+            np.array([0, 1, 2, 3], dtype=np.int32),
+            np.array([1, 0, 3, 2], dtype=np.int32),
+            np.array([2, 2, 5, 5], dtype=np.int64),
+        )
+        z = knn_mst_linkage(5, graph)
+        self.assertEqual(z.tolist(), [[0, 1, 2, 2], [2, 3, 5, 2], [5, 6, 6, 4], [4, 7, 6, 5]])
+
+    def test_unsupported_method(self):
+        self.assertIsNone(select_linkage_function("single", "knn-mst"))
+        with self.assertRaises(ValueError):
+            select_linkage_function("average", "knn-mst")
+        with self.assertRaises(ValueError):
+            select_linkage_function("ward", "scipy")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import random
+import unittest
+
+from dendro_text.dld import distance_int_list_python
+from dendro_text.lower_bounds import LowerBoundIndex, compute_signature, compute_signatures, lower_bound
+
+
+class TestLowerBound(unittest.TestCase):
+    def test_lower_bound_does_not_exceed_distance(self):
+        rand = random.Random(0)
+        for _ in range(300):
+            vocabulary_size = rand.choice([2, 5, 20])
+            s1 = [rand.randrange(1, vocabulary_size + 1) for _ in range(rand.randrange(0, 40))]
+            s2 = [rand.randrange(1, vocabulary_size + 1) for _ in range(rand.randrange(0, 40))]
+            with self.subTest(s1=s1, s2=s2):
+                self.assertLessEqual(
+                    lower_bound(compute_signature(s1), compute_signature(s2)), distance_int_list_python(s1, s2)
+                )
+
+    def test_bounds(self):
+        self.assertEqual(lower_bound(compute_signature([1, 2, 3]), compute_signature([1, 2, 3])), 0)
+        self.assertEqual(lower_bound(compute_signature([1, 1, 1, 1]), compute_signature([])), 4)  # length
+        self.assertEqual(lower_bound(compute_signature([1, 2, 3]), compute_signature([4, 5, 6])), 3)  # histogram
+        # the same tokens in a different order (distance 5): only the q-gram profiles differ
+        s1 = [1, 2, 1, 2, 3, 4, 3, 4]
+        s2 = [1, 3, 2, 4, 1, 3, 2, 4]
+        self.assertEqual(lower_bound(compute_signature(s1), compute_signature(s2)), 4)
+
+
+class TestLowerBoundIndex(unittest.TestCase):
+    def test_same_as_lower_bound(self):
+        rand = random.Random(0)
+        idocs = [[rand.randrange(1, 8) for _ in range(rand.randrange(0, 40))] for _ in range(60)]
+        signatures = compute_signatures(idocs)
+        index = LowerBoundIndex(signatures)
+        for query in idocs[:10] + [[], [99, 1]]:
+            sig = compute_signature(query)
+            self.assertEqual(index.lower_bounds(sig).tolist(), [lower_bound(sig, s) for s in signatures])
+
+    def test_empty_corpus(self):
+        self.assertEqual(LowerBoundIndex([]).lower_bounds(compute_signature([1])).tolist(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,33 @@
+import tracemalloc
 import unittest
 from contextlib import redirect_stderr
 from io import StringIO
 from tempfile import TemporaryDirectory
 from unittest.mock import patch
 
+import numpy as np
+
 from dendro_text.main import (
     LabelNode,
     _init_distance_worker,
     _iter_documents,
+    calc_condensed_distances,
     calc_dendrogram,
-    calc_dld,
-    convert_to_int_docs,
+    calc_dld_batch,
     gen_parser,
+    main,
+    open_query_distance_map,
     select_neighbors,
     uniq,
 )
+from dendro_text import dld
+from dendro_text.commands import convert_to_int_docs
+from dendro_text.dld import distance_int_list, distance_int_list_python
+from dendro_text.pairwise import PeriodicCheckpoint, condensed_size
+
+
+def zero_distance(left, right):
+    return 0
 
 
 class TestMainHelpers(unittest.TestCase):
@@ -32,9 +45,23 @@ class TestMainHelpers(unittest.TestCase):
         self.assertEqual(idocs, [[], [1]])
         self.assertEqual(word_to_index, {"a": 1})
 
-    def test_calc_dld_returns_pair_and_distance(self):
-        _init_distance_worker([[1, 2], [1, 3]], lambda left, right: 1)
-        self.assertEqual(calc_dld((0, 1)), ((0, 1), 1))
+    def test_query_distance_map_on_both_backends(self):
+        idocs = [[1, 2], [1], [1, 2, 3], [4], [], [2]]
+        expected = [1, 1, 2, 2, 1]
+        for backend, distance_function in [("process", distance_int_list_python), ("thread", distance_int_list)]:
+            with self.subTest(backend=backend):
+                with open_query_distance_map(idocs, 2, distance_function, backend) as (map_distances, batch_size):
+                    self.assertGreater(batch_size, 1)
+                    self.assertEqual(map_distances([1, 2, 3, 4, 5], [None] * 5), expected)
+                    self.assertEqual(map_distances([3, 4], [0, None]), [1, 2])
+        with open_query_distance_map(idocs, 1) as (map_distances, batch_size):
+            self.assertEqual((map_distances, batch_size), (None, 1))
+
+    def test_calc_dld_batch_returns_arrays(self):
+        _init_distance_worker([[1], [1, 2], [3, 4, 5]], distance_int_list_python)
+        ks, distances = calc_dld_batch(np.array([2, 0]))
+        self.assertEqual(ks.tolist(), [2, 0])
+        self.assertEqual(distances.tolist(), [3, 1])
 
     def test_select_neighbors_keeps_first_document_and_sorts_by_distance(self):
         idocs = [[1], [1, 2], [1, 2, 3], [4, 5, 6]]
@@ -76,6 +103,42 @@ class TestMainHelpers(unittest.TestCase):
             with self.assertRaises(SystemExit):
                 gen_parser().parse_args(["--char-by-char", "--line-by-line", "input.txt"])
 
+    def test_main_rejects_options_ignored_by_the_mode(self):
+        for options in [
+            ["--knn-graph", "2", "--distance-cache", "cache.db"],
+            ["--knn-graph", "2", "--approx"],
+            ["--knn-graph", "2", "--refine", "3"],
+            ["--knn-graph", "2", "--linkage-engine", "nn-chain"],
+            ["--knn-graph", "2", "--linkage-method", "single"],
+            ["--knn-graph", "2", "--linkage-neighbors", "8"],
+            ["--merge-shards", "--distance-cache", "cache.db"],
+            ["-N", "2", "--save-matrix", "matrix.npz"],
+            ["--serve", "-j", "2"],
+            ["--serve", "--distance-cache", "cache.db"],
+        ]:
+            with patch("sys.argv", ["dendro-text"] + options + ["a.txt", "b.txt"]):
+                with self.assertRaises(SystemExit) as cm:
+                    main()
+            self.assertTrue(str(cm.exception.code).startswith("Error: Option"), options)
+
+    def test_knn_mst_engine_implies_single_linkage(self):
+        with TemporaryDirectory() as temp_dir:
+            files = []
+            for text in ["abcfg", "abccfg", "abdefg"]:
+                files.append(f"{temp_dir}/{text}.txt")
+                with open(files[-1], "w") as output:
+                    output.write(text)
+            with patch("sys.argv", ["dendro-text", "--linkage-engine", "knn-mst"] + files):
+                with patch("dendro_text.main.print_dendrogram") as print_dendrogram:
+                    main()
+            self.assertEqual(len(print_dendrogram.call_args.args[0].linkage), 2)  # the merges of the 3 files
+
+            argv = ["dendro-text", "--linkage-engine", "knn-mst", "--linkage-method", "average"] + files
+            with patch("sys.argv", argv):
+                with self.assertRaises(SystemExit) as cm:
+                    main()
+            self.assertIn("single linkage", str(cm.exception.code))
+
     def test_iter_documents_applies_preprocessors_in_a_managed_context(self):
         with TemporaryDirectory() as temp_dir:
             filename = f"{temp_dir}/input.txt"
@@ -87,6 +150,30 @@ class TestMainHelpers(unittest.TestCase):
 
         self.assertEqual(documents, [(filename, ["A", " ", "B", " ", "C", "\n"])])
 
+    def test_calc_condensed_distances_in_squareform_order(self):
+        idocs = [[1], [1, 2], [3, 4, 5], []]
+        darr = calc_condensed_distances(idocs, workers=2)
+        self.assertEqual(darr.tolist(), [1, 3, 1, 3, 2, 3])
+        darr = calc_condensed_distances(idocs, workers=2, pairs=slice(1, None, 2))
+        self.assertEqual(darr.tolist(), [3, 3, 3])
+
+    def test_calc_condensed_distances_peak_memory_is_about_the_vector(self):
+        rng = np.random.default_rng(0)
+        idocs = [rng.integers(1, 5, size=rng.integers(0, 4)).tolist() for _ in range(800)]
+        cases = [("process", zero_distance)]
+        if dld.condensed_distances_i is not None:
+            cases.append(("thread", distance_int_list))
+        for backend, distance_function in cases:
+            with self.subTest(backend=backend):
+                calc_condensed_distances(idocs[:10], workers=2, distance_function=distance_function, backend=backend)
+                tracemalloc.start()
+                try:
+                    calc_condensed_distances(idocs, workers=2, distance_function=distance_function, backend=backend)
+                    _current, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                self.assertLess(peak, 1.5 * condensed_size(len(idocs)) * 8)
+
     def test_calc_dendrogram_reraises_keyboard_interrupt(self):
         class InterruptingPool:
             def __init__(self, *args, **kwargs):
@@ -104,6 +191,33 @@ class TestMainHelpers(unittest.TestCase):
                 calc_dendrogram([[1], [2]])
         self.assertIn("Distance calculation interrupted", stderr.getvalue())
 
+    def test_calc_condensed_distances_saves_checkpoint_on_interrupt(self):
+        class InterruptingPool:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def __enter__(self):
+                raise KeyboardInterrupt
+
+            def __exit__(self, exc_type, exc_value, traceback):
+                return False
+
+        saved = []
+        checkpoint = PeriodicCheckpoint(lambda a: saved.append(a.copy()), interval=3600)
+        darr = np.array([5.0, np.nan, np.nan])
+        with patch("dendro_text.main.Pool", InterruptingPool), redirect_stderr(StringIO()):
+            with self.assertRaises(KeyboardInterrupt):
+                calc_condensed_distances([[1], [2], [3]], darr=darr, checkpoint=checkpoint)
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(saved[0][0], 5.0)
+
+    def test_calc_condensed_distances_ticks_checkpoint(self):
+        saved = []
+        checkpoint = PeriodicCheckpoint(lambda a: saved.append(a.copy()), interval=0)
+        darr = calc_condensed_distances([[1], [1, 2], [3, 4, 5]], checkpoint=checkpoint)
+        self.assertEqual(len(saved), 3)
+        self.assertEqual(saved[-1].tolist(), darr.tolist())
+
 
 class TestListingOutput(unittest.TestCase):
     def test_select_neighbors_does_not_mutate_inputs(self):
@@ -0,0 +1,86 @@
+import random
+import unittest
+
+from dendro_text.dld import distance_int_list_python
+from dendro_text.lower_bounds import compute_signatures
+from dendro_text.neighbors import SearchStats, find_neighbors
+
+
+class TestFindNeighbors(unittest.TestCase):
+    def test_same_as_sorting_all_distances(self):
+        rand = random.Random(0)
+        for _ in range(50):
+            idocs = [[rand.randrange(1, 4) for _ in range(rand.randrange(0, 15))] for _ in range(rand.randrange(1, 20))]
+            all_dds = sorted([(0, 0)] + [(distance_int_list_python(idocs[0], idoc), i) for i, idoc in enumerate(idocs) if i > 0])
+            for neighbors in [0, 1, 3, 30]:
+                with self.subTest(idocs=idocs, neighbors=neighbors):
+                    expected = all_dds if neighbors == 0 else all_dds[: neighbors + 1]
+                    self.assertEqual(find_neighbors(idocs, neighbors), expected)
+
+    def test_pruning_by_lower_bounds_keeps_result(self):
+        rand = random.Random(1)
+        for _ in range(50):
+            idocs = [[rand.randrange(1, 6) for _ in range(rand.randrange(0, 20))] for _ in range(rand.randrange(1, 20))]
+            signatures = compute_signatures(idocs)
+            for neighbors in [1, 3, 30]:
+                with self.subTest(idocs=idocs, neighbors=neighbors):
+                    stats = SearchStats()
+                    dds = find_neighbors(idocs, neighbors, signatures=signatures, stats=stats)
+                    self.assertEqual(dds, find_neighbors(idocs, neighbors))
+                    self.assertEqual(stats.exact_calls + stats.pruned, len(idocs) - 1)
+
+    def test_far_candidates_are_pruned(self):
+        idocs = [[1, 2, 3], [1, 2, 3, 4], [5, 6, 7, 8, 9], [5] * 20]
+        stats = SearchStats()
+        dds = find_neighbors(idocs, 1, signatures=compute_signatures(idocs), stats=stats)
+        self.assertEqual(dds, [(0, 0), (1, 1)])
+        self.assertEqual((stats.exact_calls, stats.pruned), (1, 2))
+
+    def test_ties_are_broken_by_index(self):
+        idocs = [[1], [2], [3], [1, 1]]
+        self.assertEqual(find_neighbors(idocs, 2), [(0, 0), (1, 1), (1, 2)])
+
+    def test_bound_is_passed_when_heap_is_full(self):
+        calls = []
+
+        def distance_function(s1, s2, max_dist=None):
+            calls.append(max_dist)
+            return distance_int_list_python(s1, s2, max_dist)
+
+        find_neighbors([[1], [1, 2], [3, 4, 5], [1]], 1, distance_function=distance_function)
+        self.assertEqual(calls, [None, 0, 0])
+
+    def test_batches_keep_result(self):
+        rand = random.Random(2)
+        for _ in range(30):
+            idocs = [[rand.randrange(1, 6) for _ in range(rand.randrange(0, 20))] for _ in range(rand.randrange(1, 30))]
+            signatures = compute_signatures(idocs)
+            for neighbors in [0, 1, 3, 30]:
+                for batch_size in [2, 7]:
+                    with self.subTest(idocs=idocs, neighbors=neighbors, batch_size=batch_size):
+                        dds = find_neighbors(idocs, neighbors, signatures=signatures, batch_size=batch_size)
+                        self.assertEqual(dds, find_neighbors(idocs, neighbors))
+
+    def test_rows_are_passed_as_soon_as_final(self):
+        idocs = [[1, 2, 3], [1, 2, 3, 4], [1, 2], [5, 6, 7, 8, 9], [5] * 20]
+        events = []
+
+        def map_distances(indices, max_dists):
+            events.append(("map", indices))
+            return [distance_int_list_python(idocs[0], idocs[i], m) for i, m in zip(indices, max_dists)]
+
+        dds = find_neighbors(
+            idocs,
+            0,
+            signatures=compute_signatures(idocs),
+            map_distances=map_distances,
+            batch_size=2,
+            on_final=lambda d, i: events.append(("final", (d, i))),
+        )
+        self.assertEqual([e[1] for e in events if e[0] == "final"], dds)
+        # the nearest ones are final before the far candidates are calculated
+        self.assertEqual(events[:3], [("map", [1, 2]), ("final", (0, 0)), ("final", (1, 1))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import random
+import time
+import unittest
+
+import numpy as np
+
+import dendro_text.dld as dld
+from dendro_text.dld import distance_int_list_python
+from dendro_text.pairwise import (
+    PeriodicCheckpoint,
+    batch_pair_indices,
+    calc_condensed_distances_threaded,
+    check_thread_backend,
+    condensed_index,
+    condensed_pair,
+    condensed_row,
+    condensed_size,
+    iter_condensed_pairs,
+    nan_pairs_cost,
+    pair_costs,
+    schedule_cost_batches,
+    sliced_size,
+)
+
+
+class TestCondensedIndex(unittest.TestCase):
+    def test_index_and_pair_are_inverse(self):
+        for n in range(2, 30):
+            pairs = [(i, j) for i in range(n) for j in range(i + 1, n)]
+            self.assertEqual(len(pairs), condensed_size(n))
+            for k, (i, j) in enumerate(pairs):
+                self.assertEqual(condensed_index(n, i, j), k)
+                self.assertEqual(condensed_pair(n, k), (i, j))
+
+    def test_large_n(self):
+        n = 50000
+        for k in [0, 1, condensed_size(n) // 3, condensed_size(n) - 1]:
+            i, j = condensed_pair(n, k)
+            self.assertEqual(condensed_index(n, i, j), k)
+
+    def test_row(self):
+        n = 6
+        for i in range(n):
+            expected = [condensed_index(n, min(i, j), max(i, j)) for j in range(n) if j != i]
+            self.assertEqual(condensed_row(n, i).tolist(), expected)
+
+
+class TestCostBatches(unittest.TestCase):
+    def test_pair_costs(self):
+        lengths = np.array([0, 1, 3])
+        self.assertEqual(pair_costs(lengths, np.arange(3)).tolist(), [2.0, 4.0, 8.0])
+
+    def test_nan_pairs_cost(self):
+        rand = random.Random(1)
+        lengths = np.array([rand.randrange(0, 20) for _ in range(30)])
+        darr = np.where(np.array([rand.random() < 0.5 for _ in range(condensed_size(30))]), np.nan, 1.0)
+        ks = np.flatnonzero(np.isnan(darr))
+        self.assertAlmostEqual(nan_pairs_cost(lengths, darr), pair_costs(lengths, ks).sum())
+        for k_begin, k_end in [(0, 1), (3, 100), (17, 17), (200, len(darr))]:
+            expected = pair_costs(lengths, ks[(ks >= k_begin) & (ks < k_end)]).sum()
+            self.assertAlmostEqual(nan_pairs_cost(lengths, darr, k_begin, k_end), expected)
+
+    def test_batches_cover_pairs_most_expensive_first(self):
+        rand = random.Random(0)
+        lengths = np.array([rand.randrange(0, 100) for _ in range(40)])
+        lengths[7] = 5000  # expensive pairs
+        darr = np.zeros(condensed_size(40))
+        ks = np.array([k for k in range(condensed_size(40)) if rand.random() < 0.7])
+        darr[ks] = np.nan
+        batches = schedule_cost_batches(lengths, darr, 10, max_batch_pairs=50)
+        parts = [batch_pair_indices(darr, b) for b in batches]
+        self.assertEqual(sorted(np.concatenate(parts).tolist()), ks.tolist())
+        for b, part in zip(batches, parts):
+            self.assertEqual(b.pairs, len(part))
+            self.assertLessEqual(len(part), 50)
+            self.assertAlmostEqual(b.cost, pair_costs(lengths, part).sum())
+        costs = [b.cost for b in batches]
+        self.assertEqual(costs, sorted(costs, reverse=True))
+        self.assertEqual(schedule_cost_batches(lengths, np.zeros(condensed_size(40)), 10), [])
+
+    def test_vectors_of_a_slice_of_pairs(self):
+        rand = random.Random(2)
+        for n, pairs in [(30, slice(2, None, 3)), (12, slice(0, None, 7)), (9, slice(5, None, 100)), (1, slice(0, None, 2))]:
+            with self.subTest(n=n, pairs=pairs):
+                lengths = np.array([rand.randrange(0, 20) for _ in range(n)])
+                ks = np.arange(condensed_size(n))[pairs]
+                self.assertEqual(sliced_size(n, pairs), len(ks))
+                darr = np.where(np.array([rand.random() < 0.5 for _ in ks], dtype=bool), np.nan, 1.0)
+                nan_ks = ks[np.isnan(darr)]
+                self.assertAlmostEqual(nan_pairs_cost(lengths, darr, pairs=pairs), pair_costs(lengths, nan_ks).sum())
+                self.assertAlmostEqual(
+                    nan_pairs_cost(lengths, darr, 1, len(darr) - 1, pairs=pairs),
+                    pair_costs(lengths, ks[1:-1][np.isnan(darr[1:-1])]).sum(),
+                )
+                expected = [(t, *condensed_pair(n, int(k))) for t, k in enumerate(ks) if np.isnan(darr[t])]
+                self.assertEqual(list(iter_condensed_pairs(n, np.isnan(darr), pairs)), expected)
+                batches = schedule_cost_batches(lengths, darr, 4, max_batch_pairs=5, pairs=pairs)
+                parts = [batch_pair_indices(darr, b) for b in batches]
+                self.assertEqual(sorted(np.concatenate(parts + [[]]).tolist()), np.flatnonzero(np.isnan(darr)).tolist())
+                for b, part in zip(batches, parts):
+                    self.assertAlmostEqual(b.cost, pair_costs(lengths, ks[part]).sum())
+
+
+class TestThreadBackend(unittest.TestCase):
+    def test_rejects_pure_python_engine(self):
+        with self.assertRaises(ValueError):
+            check_thread_backend(distance_int_list_python)
+
+    def test_same_distances_as_reference(self):
+        if dld.condensed_distances_i is None:
+            self.skipTest("Numba is not installed")
+        rand = random.Random(0)
+        idocs = dld.to_int_arrays([[rand.randrange(1, 5) for _ in range(rand.randrange(0, 90))] for _ in range(23)])
+        expected = [distance_int_list_python(idocs[i], idocs[j]) for i in range(23) for j in range(i + 1, 23)]
+        for distance_function in [dld.distance_int_list, dld.distance_int_list_numba]:
+            for workers in [1, 3]:
+                with self.subTest(distance_function=distance_function, workers=workers):
+                    darr = calc_condensed_distances_threaded(idocs, workers, distance_function=distance_function)
+                    self.assertEqual(darr.tolist(), expected)
+                    pairs = slice(1, None, 4)
+                    darr = calc_condensed_distances_threaded(idocs, workers, distance_function, pairs=pairs)
+                    self.assertEqual(darr.tolist(), expected[pairs])
+
+    def test_checkpoint_ticks_while_a_batch_runs(self):
+        if dld.condensed_distances_i is None:
+            self.skipTest("Numba is not installed")
+        rng = np.random.default_rng(0)
+        idocs = dld.to_int_arrays([rng.integers(1, 5, size=15000).tolist() for _ in range(2)])  # a single pair
+        saved = []
+        checkpoint = PeriodicCheckpoint(lambda a: saved.append(bool(np.isnan(a[0]))), interval=0.05)
+        darr = calc_condensed_distances_threaded(idocs, 1, dld.distance_int_list_numba, checkpoint=checkpoint)
+        self.assertFalse(np.isnan(darr[0]))
+        self.assertGreaterEqual(saved.count(True), 2)
+
+    def test_interrupt_stops_running_batches(self):
+        if dld.condensed_distances_i is None:
+            self.skipTest("Numba is not installed")
+        rng = np.random.default_rng(0)
+        idocs = dld.to_int_arrays([rng.integers(1, 5, size=3000).tolist() for _ in range(60)])
+        calc_condensed_distances_threaded(idocs[:2], 1, dld.distance_int_list_numba)  # compile
+        saved = []
+
+        def save(a):
+            saved.append(int(np.count_nonzero(np.isnan(a))))
+            if len(saved) == 1:
+                raise KeyboardInterrupt
+
+        darr = np.full(condensed_size(len(idocs)), np.nan)
+        checkpoint = PeriodicCheckpoint(save, interval=0.05)
+        start = time.monotonic()
+        with self.assertRaises(KeyboardInterrupt):
+            calc_condensed_distances_threaded(idocs, 2, dld.distance_int_list_numba, darr=darr, checkpoint=checkpoint)
+        self.assertLess(time.monotonic() - start, 1.0)  # a batch takes a few seconds
+        self.assertEqual(len(saved), 2)  # the tick and the save on the interruption
+        self.assertGreater(saved[1], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from dendro_text.dld import EditOp, edit_sequence_int_list_python
+from dendro_text.patience import anchored_edit_sequence_int_list, line_starts, patience_anchors
+
+
+def apply_edit_sequence(s1, s2, es):
+    li = ri = 0
+    r1, r2 = [], []
+    for e in es:
+        if e in (EditOp.NO_EDIT, EditOp.SUB, EditOp.DEL):
+            r1.append(s1[li])
+            li += 1
+        if e in (EditOp.NO_EDIT, EditOp.SUB, EditOp.INS):
+            r2.append(s2[ri])
+            ri += 1
+        if e == EditOp.NO_EDIT:
+            assert r1[-1] == r2[-1]
+    return r1, r2
+
+
+class TestPatience(unittest.TestCase):
+    def test_patience_anchors(self):
+        self.assertEqual(patience_anchors([1, 2, 3], [1, 2, 3]), [(0, 0), (1, 1), (2, 2)])
+        self.assertEqual(patience_anchors([], [1]), [])
+        # the unique 5 and 6 are crossed (6 is taken with 7), and 9 is unique in the gap between 6 and 7
+        self.assertEqual(patience_anchors([0, 9, 5, 6, 9, 7, 4], [8, 6, 5, 9, 7, 9, 3]), [(3, 1), (4, 3), (5, 4)])
+        self.assertEqual(patience_anchors([5, 1, 2, 1, 6], [7, 1, 4, 1, 8]), [])  # 1 is not unique
+
+    def test_line_starts(self):
+        self.assertEqual(line_starts(["a", " ", "b", "\n", "c", "\n\n", "d"], "").tolist(), [0, 4, 6])
+        self.assertEqual(line_starts(["a", "\n"], "").tolist(), [0])
+        self.assertEqual(line_starts(["a", "b"], "").tolist(), [0, 1])
+        self.assertEqual(line_starts(["a", "b"], "\n").tolist(), [0, 1])
+        self.assertEqual(line_starts([], "").tolist(), [])
+
+    def test_anchored_edit_sequence(self):
+        rng = np.random.default_rng(0)
+        lines = [rng.integers(1, 6, size=rng.integers(1, 5)).tolist() + [0] for _ in range(40)]
+        for _ in range(20):
+            d1 = [lines[k] for k in rng.integers(0, len(lines), size=30)]
+            d2 = [line if rng.random() < 0.8 else lines[rng.integers(0, len(lines))] for line in d1]
+            s1 = [t for line in d1 for t in line]
+            s2 = [t for line in d2 for t in line]
+            starts1 = np.cumsum([0] + [len(line) for line in d1[:-1]])
+            starts2 = np.cumsum([0] + [len(line) for line in d2[:-1]])
+            es = anchored_edit_sequence_int_list(s1, s2, starts1, starts2, use_numba=False)
+            self.assertEqual(apply_edit_sequence(s1, s2, es), (s1, s2))
+            minimal = edit_sequence_int_list_python(s1, s2)
+            self.assertGreaterEqual(sum(e != EditOp.NO_EDIT for e in es), sum(e != EditOp.NO_EDIT for e in minimal))
+
+    def test_same_as_edit_sequence_without_anchors(self):
+        s1, s2 = [1, 2, 3, 4], [1, 3, 5, 4]
+        es = anchored_edit_sequence_int_list(s1, s2, np.array([0]), np.array([0]), use_numba=False)
+        self.assertEqual(es, edit_sequence_int_list_python(s1, s2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 
 from io import StringIO
+from unittest import mock
 
 from dendro_text.commands import do_diff
 
@@ -36,6 +37,16 @@ class TestDoDiff(unittest.TestCase):
         sio.seek(0)
         self.assertEqual(sio.read(), "a-<xy>+<bc>d")
 
+    def test_anchored_diff_for_large_inputs(self):
+        ldoc = ['a', '\n', 'b', '\n', 'c', '\n', 'b', '\n']
+        rdoc = ['a', '\n', 'x', '\n', 'c', '\n', 'b', '\n']
+
+        with mock.patch('dendro_text.commands.ANCHORED_DIFF_CELLS', 0):
+            sio = StringIO()
+            do_diff(ldoc, rdoc, write=sio.write, lbegend=('-<', '>'), rbegend=('+<', '>'))
+        sio.seek(0)
+        self.assertEqual(sio.read(), "a\n-<b>+<x>\nc\nb\n")
+
 
 if __name__ == "__main__":
     unittest.main()
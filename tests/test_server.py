@@ -0,0 +1,82 @@
+import io
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from dendro_text.dld import distance_int_list_python
+from dendro_text.server import CorpusIndex, handle_request, serve_lines, serve_unix_socket
+
+
+def read_chars(path):
+    with open(path) as inp:
+        return list(inp.read())
+
+
+def split_chars(text, _filename):
+    return list(text)
+
+
+class TestCorpusIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.files = []
+        for name, text in [("a.txt", "abcdefg"), ("b.txt", "abcxefg"), ("c.txt", "zzzz"), ("d.txt", "abcdef")]:
+            path = os.path.join(self.temp_dir.name, name)
+            with open(path, "w") as outp:
+                outp.write(text)
+            self.files.append(path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_query_same_as_distances(self):
+        index = CorpusIndex(self.files, read_chars, distance_function=distance_int_list_python)
+        query = list("abcdxfg")
+        expected = sorted(
+            (distance_int_list_python(query, read_chars(f)), k) for k, f in enumerate(self.files)
+        )
+        self.assertEqual(index.query(query, 0), [(d, self.files[k]) for d, k in expected])
+        self.assertEqual(index.query(query, 2), [(d, self.files[k]) for d, k in expected[:2]])
+
+    def test_refresh_reads_changed_files(self):
+        index = CorpusIndex(self.files, read_chars, refresh_interval=0)
+        self.assertEqual(index.query(list("zzzz"), 1), [(0, self.files[2])])
+        with open(self.files[0], "w") as outp:
+            outp.write("zzzz!")  # different size
+        os.remove(self.files[3])
+        self.assertEqual(index.refresh(), 2)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.query(list("zzzz!"), 1), [(0, self.files[0])])
+
+    def test_requests(self):
+        index = CorpusIndex(self.files, read_chars)
+        response = handle_request(index, {"id": 5, "query": self.files[1], "neighbors": 1}, split_chars)
+        self.assertEqual(response, {"id": 5, "neighbors": [{"file": self.files[1], "distance": 0}]})
+        response = handle_request(index, {"text": "abcdef", "neighbors": 1}, split_chars)
+        self.assertEqual(response, {"neighbors": [{"file": self.files[3], "distance": 0}]})
+        self.assertIn("error", handle_request(index, {"query": "/nonexistent"}, split_chars))
+        self.assertIn("error", handle_request(index, {"command": "stop"}, split_chars))
+        self.assertIn("error", handle_request(index, [1], split_chars))
+        self.assertEqual(handle_request(index, {"command": "refresh"}, split_chars), {"refreshed": 0})
+
+    def test_serve_lines(self):
+        index = CorpusIndex(self.files, read_chars)
+        inp = io.StringIO('{"id": 1, "text": "zzz", "neighbors": 1}\n\nnot json\n')
+        outp = io.StringIO()
+        serve_lines(index, inp, outp, split_chars)
+        responses = [json.loads(line) for line in outp.getvalue().splitlines()]
+        self.assertEqual(responses[0], {"id": 1, "neighbors": [{"file": self.files[2], "distance": 1}]})
+        self.assertIn("error", responses[1])
+        self.assertEqual(len(responses), 2)
+
+    def test_socket_path_not_a_socket(self):
+        index = CorpusIndex(self.files, read_chars)
+        with self.assertRaises(SystemExit) as cm:
+            serve_unix_socket(index, self.files[0], split_chars)
+        self.assertIn("is not a socket", str(cm.exception.code))
+        self.assertTrue(os.path.exists(self.files[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
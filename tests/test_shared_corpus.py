@@ -0,0 +1,39 @@
+import os
+import unittest
+
+import numpy as np
+
+from dendro_text.dld import distance_int_list_python
+from dendro_text.main import _init_shared_distance_worker, calc_condensed_distances, calc_dld_batch
+from dendro_text.shared_corpus import SharedCorpus, attach_shared_corpus
+
+
+class TestSharedCorpus(unittest.TestCase):
+    def test_attach_gives_same_documents(self):
+        idocs = [[1, 2, 3], [], [4], [5, 6]]
+        with SharedCorpus(idocs) as corpus:
+            attached = attach_shared_corpus(corpus.handle)
+            self.assertEqual([a.tolist() for a in attached], idocs)
+            self.assertFalse(attached[0].flags.writeable)
+            path = corpus.handle.path
+        self.assertFalse(os.path.exists(path))
+
+    def test_empty_documents(self):
+        with SharedCorpus([[], []]) as corpus:
+            self.assertEqual([a.tolist() for a in attach_shared_corpus(corpus.handle)], [[], []])
+
+    def test_worker_calculates_distances_of_shared_corpus(self):
+        idocs = [[1], [1, 2], [3, 4, 5]]
+        with SharedCorpus(idocs) as corpus:
+            _init_shared_distance_worker(corpus.handle, distance_int_list_python)
+            ks, distances = calc_dld_batch(np.arange(3))
+        self.assertEqual(distances.tolist(), [1, 3, 3])
+
+    def test_pool_with_shared_corpus(self):
+        idocs = [[1], [1, 2], [3, 4, 5], []]
+        darr = calc_condensed_distances(idocs, workers=2, distance_function=distance_int_list_python)
+        self.assertEqual(darr.tolist(), [1, 3, 1, 3, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+import numpy as np
+
+from dendro_text.dld import distance_int_list_python
+from dendro_text.pairwise import condensed_index
+from dendro_text.sketch import (
+    approx_condensed_distances,
+    calibrate_estimates,
+    compute_sketches,
+    estimate_distances,
+    refine_pair_indices,
+    sample_accuracy,
+    sample_exact_distances,
+)
+
+
+class TestSketch(unittest.TestCase):
+    def test_identical_empty_and_disjoint_documents(self):
+        rng = np.random.default_rng(0)
+        a = rng.integers(1, 50, size=200)
+        b = rng.integers(100, 150, size=150)
+        sketches = compute_sketches([a, a.copy(), [], b])
+        self.assertEqual(estimate_distances(sketches, 0, np.array([1, 2, 3])).tolist(), [0, 200, 200])
+        self.assertEqual(estimate_distances(sketches, 2, np.array([2])).tolist(), [0])
+
+    def test_estimate_grows_with_edits(self):
+        rng = np.random.default_rng(1)
+        base = rng.integers(1, 1000, size=1000)
+        docs = [base]
+        for rate in [0.01, 0.05, 0.2]:
+            doc = base.copy()
+            positions = rng.choice(len(doc), size=int(len(doc) * rate), replace=False)
+            doc[positions] = rng.integers(1000, 2000, size=len(positions))
+            docs.append(doc)
+        estimates = estimate_distances(compute_sketches(docs, sketch_size=256), 0, np.arange(1, 4))
+        self.assertTrue(np.all(np.diff(estimates) > 0))
+
+    def test_repeated_shingles_are_counted(self):
+        sketches = compute_sketches([[1, 2] * 50, [1, 2] * 100])
+        self.assertEqual(estimate_distances(sketches, 0, np.array([1])).tolist(), [100])
+
+    def test_condensed_order(self):
+        docs = [[1, 2, 3, 4, 5], [1, 2, 3], [7, 8, 9, 10], [1, 2, 3, 4, 6, 7]]
+        sketches = compute_sketches(docs)
+        darr = approx_condensed_distances(sketches)
+        for i in range(len(docs)):
+            for j in range(i + 1, len(docs)):
+                self.assertEqual(darr[condensed_index(len(docs), i, j)], estimate_distances(sketches, i, np.array([j]))[0])
+
+    def test_sample_accuracy(self):
+        docs = [[1, 2, 3], [1, 2, 4], [5, 6]]
+        exact = np.array([1.0, 3.0, 3.0])
+        accuracy = sample_accuracy(docs, exact, distance_int_list_python)
+        self.assertEqual((accuracy.pairs, accuracy.mean_abs_error), (3, 0.0))
+        accuracy = sample_accuracy(docs, exact + 1, distance_int_list_python, sample_size=2)
+        self.assertEqual((accuracy.pairs, accuracy.mean_abs_error), (2, 1.0))
+        self.assertIsNone(sample_accuracy(docs[:1], np.zeros(0), distance_int_list_python))
+
+
+class TestRefine(unittest.TestCase):
+    def test_refine_pair_indices(self):
+        n = 4
+        darr = np.array([1.0, 5.0, 9.0, 2.0, 7.0, 3.0])  # (0,1) (0,2) (0,3) (1,2) (1,3) (2,3)
+        self.assertEqual(refine_pair_indices(darr, n, neighbors=1).tolist(), [0, 3, 5])
+        self.assertEqual(refine_pair_indices(darr, n, threshold=2.0).tolist(), [0, 3])
+        self.assertEqual(refine_pair_indices(darr, n, neighbors=1, threshold=5.0).tolist(), [0, 1, 3, 5])
+        self.assertEqual(refine_pair_indices(darr, n, neighbors=10).tolist(), list(range(6)))
+        self.assertEqual(refine_pair_indices(darr, n).tolist(), [])
+
+    def test_sample_exact_distances(self):
+        docs = [[1, 2, 3], [1, 2, 4], [5, 6], []]
+        ks, exact = sample_exact_distances(docs, distance_int_list_python, sample_size=4)
+        self.assertEqual(len(ks), 4)
+        self.assertEqual(ks.tolist(), sorted(ks.tolist()))
+        all_exact = [1, 3, 3, 3, 3, 2]
+        self.assertEqual(exact.tolist(), [all_exact[k] for k in ks])
+
+    def test_calibrate_estimates(self):
+        estimated = np.array([10.0, 20.0, 30.0, 40.0])
+        exact = np.array([5.0, 10.0, 15.0, 12.0])  # made monotone: 15 for 40
+        calibrated = calibrate_estimates(np.array([0.0, 10.0, 25.0, 40.0, 100.0]), estimated, exact, bins=4)
+        self.assertEqual(calibrated.tolist(), [5.0, 5.0, 12.5, 15.0, 15.0])
+        self.assertEqual(calibrate_estimates(np.array([3.0]), np.zeros(0), np.zeros(0)).tolist(), [3.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
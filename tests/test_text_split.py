@@ -1,8 +1,17 @@
+import random
 import unittest
 from contextlib import redirect_stderr
 from io import StringIO
+from unittest.mock import patch
 
-from dendro_text.ts import normalize_block_name, strip_common_head_and_tail, text_split, text_split_by_char_type
+from dendro_text.ts import (
+    normalize_block_name,
+    strip_common_head_and_tail,
+    take_tokenize_stats,
+    text_split,
+    text_split_by_char_type,
+    text_split_by_char_type_python,
+)
 
 
 class TestTextSplit(unittest.TestCase):
@@ -13,13 +22,42 @@ class TestTextSplit(unittest.TestCase):
         self.assertTrue("種類" in doc)
         self.assertTrue("。" in doc)
 
+    def test_same_as_reference(self):
+        self.assertEqual(text_split_by_char_type(""), [""])
+        rng = random.Random(0)
+        # ASCII, BMP (including unassigned code points and lone surrogates), and above the BMP
+        ranges = [(0x00, 0x80), (0x80, 0x3000), (0x3000, 0x10000), (0x10000, 0x110000)]
+        pieces = ["abc", "  ", "\n", "12", "日本", "ア", "😀", ".,", "\x00", chr(0x2FE0), chr(0x10FFFF)]
+        for _ in range(500):
+            chars = [chr(rng.randrange(*rng.choice(ranges))) for _ in range(rng.randint(1, 30))]
+            chars += [rng.choice(pieces) * rng.randint(1, 3) for _ in range(rng.randint(0, 10))]
+            rng.shuffle(chars)
+            text = "".join(chars)
+            self.assertEqual(text_split_by_char_type(text), text_split_by_char_type_python(text))
+
     def test_unknown_lexer_falls_back_with_warning(self):
+        take_tokenize_stats()
         stderr = StringIO()
         with redirect_stderr(stderr):
             doc = text_split("abc 123", "input.unknown-extension")
+            text_split("abc", "other.unknown-extension")
 
         self.assertEqual(doc, ["abc", " ", "123"])
-        self.assertIn("Lexer not found for file", stderr.getvalue())
+        self.assertEqual(stderr.getvalue(), "")  # summarized by the caller
+        stats = take_tokenize_stats()
+        self.assertEqual(stats.unknown_lexers, {"*.unknown-extension": 2})
+        self.assertIn("Lexer not found for 2 files", stats.format_unknown_lexers())
+
+    @patch.dict("dendro_text.ts._lexer_cache", clear=True)
+    def test_lexers_are_cached(self):
+        take_tokenize_stats()
+        self.assertEqual(text_split("def f(x):\n  return x\n", "a.py"), ["def", "f", "(", "x", ")", ":", "return", "x"])
+        text_split("x = 1\n", "dir/b.py")
+        text_split("all:\n\techo\n", "Makefile.am")
+        text_split("all:\n\techo\n", "Makefile.in")
+        stats = take_tokenize_stats()
+        self.assertEqual((stats.files, stats.lexer_lookups), (4, 3))  # *.py, Makefile.am, Makefile.in
+        self.assertEqual(take_tokenize_stats().files, 0)
 
 
 class TestStripCommonHeadAndTail(unittest.TestCase):